@@ -218,6 +218,14 @@ class SatSolverChoice(Enum):
         return self.value
 
 
+class RepodataCacheBackend(Enum):
+    INDEX = 'index'
+    SQLITE = 'sqlite'
+
+    def __str__(self):
+        return self.value
+
+
 # Magic files for permissions determination
 PACKAGE_CACHE_MAGIC_FILE = 'urls.txt'
 PREFIX_MAGIC_FILE = join('conda-meta', 'history')
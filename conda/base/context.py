@@ -16,7 +16,8 @@ from .constants import (APP_NAME, ChannelPriority, DEFAULTS_CHANNEL_NAME,
                         DEFAULT_AGGRESSIVE_UPDATE_PACKAGES, DEFAULT_CHANNELS,
                         DEFAULT_CHANNEL_ALIAS, DEFAULT_CUSTOM_CHANNELS, DepsModifier,
                         ERROR_UPLOAD_URL, PLATFORM_DIRECTORIES, PREFIX_MAGIC_FILE, PathConflict,
-                        ROOT_ENV_NAME, SEARCH_PATH, SafetyChecks, SatSolverChoice, UpdateModifier)
+                        ROOT_ENV_NAME, RepodataCacheBackend, SEARCH_PATH, SafetyChecks,
+                        SatSolverChoice, UpdateModifier)
 from .. import __version__ as CONDA_VERSION
 from .._vendor.appdirs import user_data_dir
 from .._vendor.auxlib.decorators import memoize, memoizedproperty
@@ -157,6 +158,7 @@ class Context(Configuration):
     rollback_enabled = PrimitiveParameter(True)
     track_features = SequenceParameter(string_types)
     use_index_cache = PrimitiveParameter(False)
+    use_reduced_index_cache = PrimitiveParameter(False)
 
     _root_prefix = PrimitiveParameter("", aliases=('root_dir', 'root_prefix'))
     _envs_dirs = SequenceParameter(string_types, aliases=('envs_dirs', 'envs_path'),
@@ -172,6 +174,12 @@ class Context(Configuration):
     #   True/1: respect Cache-Control max-age header
     #   False/0: always fetch remote repodata (HTTP 304 responses respected)
 
+    # how repodata is fetched, cached and indexed
+    repodata_cache_backend = PrimitiveParameter(RepodataCacheBackend.INDEX)
+    repodata_threads = PrimitiveParameter(0, element_type=int)
+    use_repodata_patches = PrimitiveParameter(False)
+    use_repodata_shards = PrimitiveParameter(False)
+
     # remote connection details
     ssl_verify = PrimitiveParameter(True, element_type=string_types + (bool,),
                                     aliases=('verify_ssl',),
@@ -241,6 +249,9 @@ class Context(Configuration):
     update_modifier = PrimitiveParameter(UpdateModifier.UPDATE_SPECS)
     sat_solver = PrimitiveParameter(SatSolverChoice.PYCOSAT)
     solver_ignore_timestamps = PrimitiveParameter(False)
+    _report_alternate_solutions = PrimitiveParameter(None, aliases=('report_alternate_solutions',),
+                                                     element_type=(bool, NoneType))
+    alternate_solutions_timeout = PrimitiveParameter(0, element_type=(float, int))
 
     # no_deps = PrimitiveParameter(NULL, element_type=(type(NULL), bool))  # CLI-only
     # only_deps = PrimitiveParameter(NULL, element_type=(type(NULL), bool))   # CLI-only
@@ -617,6 +628,13 @@ class Context(Configuration):
     def verbosity(self):
         return 2 if self.debug else self._verbosity
 
+    @property
+    def report_alternate_solutions(self):
+        if self._report_alternate_solutions is not None:
+            return self._report_alternate_solutions
+        # nobody is there to act on the warning
+        return not (self.json or self.always_yes or self.quiet)
+
     @memoizedproperty
     def user_agent(self):
         builder = ["conda/%s requests/%s" % (CONDA_VERSION, self.requests_version)]
@@ -727,10 +745,15 @@ class Context(Configuration):
             'remote_connect_timeout_secs',
             'remote_max_retries',
             'remote_read_timeout_secs',
+            'repodata_cache_backend',
+            'repodata_threads',
             'ssl_verify',
+            'use_repodata_patches',
+            'use_repodata_shards',
         )),
         ('Solver Configuration', (
             'aggressive_update_packages',
+            'alternate_solutions_timeout',
             'auto_update_conda',
             'channel_priority',
             'create_default_packages',
@@ -739,7 +762,9 @@ class Context(Configuration):
             'pinned_packages',
             'pip_interop_enabled',
             'prune',
+            'report_alternate_solutions',
             'track_features',
+            'use_reduced_index_cache',
         )),
         ('Package Linking and Install-time Configuration', (
             'allow_softlinks',
@@ -838,6 +863,10 @@ class Context(Configuration):
                 this setting, specifying that certain files should never be soft-linked (see the
                 no_link option in the build recipe documentation).
                 """),
+            'alternate_solutions_timeout': dals("""
+                The number of seconds a solve may spend looking for alternate solutions, when
+                report_alternate_solutions is on. Zero means no limit.
+                """),
             'always_copy': dals("""
                 Register a preference that files be copied into a prefix during install rather
                 than hard-linked.
@@ -1057,6 +1086,23 @@ class Context(Configuration):
                 read timeout is the number of seconds conda will wait for the server to send
                 a response.
                 """),
+            'repodata_cache_backend': dals("""
+                The on-disk format used in pkgs/cache for the fast-load repodata cache built
+                from each downloaded repodata.json. 'index' is a memory-mapped file that is
+                read one package name at a time. 'sqlite' stores the records in a SQLite
+                database indexed by name, track_features and sha256, and answers name
+                wildcard searches within SQLite.
+                """),
+            'repodata_threads': dals("""
+                The number of threads used to download, revalidate and parse the repodata of
+                all channel subdirs concurrently when building an index. A value of 0 uses
+                conda's default thread pool size.
+                """),
+            'report_alternate_solutions': dals("""
+                After solving, look for other solutions that are just as good, and warn when
+                there are several. Each one costs another SAT run. By default this is only done
+                for interactive use, and not with --json, --yes or --quiet.
+                """),
             'report_errors': dals("""
                 Opt in, or opt out, of automatic error reporting to core maintainers. Error
                 reports are anonymous, with only the error stack trace and information given
@@ -1096,6 +1142,24 @@ class Context(Configuration):
             'use_index_cache': dals("""
                 Use cache of channel index files, even if it has expired.
                 """),
+            'use_reduced_index_cache': dals("""
+                Remember which packages each solve needed from each channel subdir, and
+                reuse that instead of walking the dependency graph again when a later solve
+                has the same specs, channels, installed packages and settings, and none of
+                the channels' repodata has changed since.
+                """),
+            'use_repodata_patches': dals("""
+                When cached repodata has expired, first look for a repodata_patches.json
+                file next to the channel's repodata.json. If it holds a chain of patches
+                from the cached version to the latest one, apply them to the cache instead
+                of downloading the full repodata again.
+                """),
+            'use_repodata_shards': dals("""
+                For channels that publish a repodata_shards.json manifest, fetch only the
+                per-package repodata shards that are needed, when they are first needed,
+                instead of the channel's full repodata.json. Each shard is cached on its own.
+                Channels without a manifest fall back to repodata.json.
+                """),
             'verbosity': dals("""
                 Sets output log level. 0 is warn. 1 is info. 2 is debug. 3 is trace.
                 """),
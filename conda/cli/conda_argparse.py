@@ -63,6 +63,7 @@ def generate_parser():
     configure_parser_install(sub_parsers)
     configure_parser_list(sub_parsers)
     configure_parser_package(sub_parsers)
+    configure_parser_refresh(sub_parsers)
     configure_parser_remove(sub_parsers)
     configure_parser_remove(sub_parsers, name='uninstall')
     configure_parser_run(sub_parsers)
@@ -913,6 +914,50 @@ def configure_parser_package(sub_parsers):
     p.set_defaults(func='.main_package.execute')
 
 
+def configure_parser_refresh(sub_parsers):
+    descr = dedent("""
+    Revalidate the local repodata caches of the configured channels.
+
+    Caches that have expired, following 'local_repodata_ttl' and the channel's
+    Cache-Control max-age, are revalidated with the channel and their fast-load
+    index is rebuilt. Caches that are still current are left alone. With
+    --interval, conda keeps running and refreshes each cache before it expires,
+    so that other conda commands can use the local cache without going to the
+    network.
+    """)
+    example = dedent("""
+    Examples:
+
+        conda refresh
+        conda refresh -c conda-forge --interval 300
+    """)
+    p = sub_parsers.add_parser(
+        'refresh',
+        description=descr,
+        help="Revalidate the local repodata caches of the configured channels.",
+        epilog=example,
+    )
+    p.add_argument(
+        '--subdir', '--platform',
+        action='store',
+        dest='subdir',
+        help="Refresh the given subdir. Should be formatted like 'osx-64', 'linux-32', "
+             "'win-64', and so on. The default is the current platform.",
+        default=NULL,
+    )
+    p.add_argument(
+        '--interval',
+        action='store',
+        type=int,
+        metavar='SECONDS',
+        help="Keep running, and check the caches again every SECONDS seconds. Caches that "
+             "would expire before the next check are refreshed early.",
+    )
+    add_parser_channels(p)
+    add_parser_json(p)
+    p.set_defaults(func='.main_refresh.execute')
+
+
 def configure_parser_remove(sub_parsers, name='remove'):
     help = "%s a list of packages from a specified conda environment."
     descr = dedent(help + """
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Anaconda, Inc
+# SPDX-License-Identifier: BSD-3-Clause
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from logging import getLogger
+from time import sleep
+
+from .common import stdout_json
+from ..base.context import context
+from ..common.compat import text_type
+from ..common.io import ThreadLimitedThreadPoolExecutor
+from ..core.index import check_whitelist
+from ..core.subdir_data import SubdirData
+from ..exceptions import CondaError
+from ..models.channel import Channel, all_channel_urls
+
+log = getLogger(__name__)
+
+
+def execute(args, parser):
+    channel_urls = all_channel_urls(context.channels, subdirs=context.subdirs)
+    check_whitelist(channel_urls)
+
+    while True:
+        results = refresh_repodata_caches(channel_urls, window=args.interval or 0)
+        if context.json:
+            stdout_json(results)
+        else:
+            for result in results:
+                expires_in = result.get('expires_in')
+                print("%-9s  %s%s" % (
+                    result['action'],
+                    result['url'],
+                    "  (expires in %d sec)" % expires_in if expires_in else "",
+                ))
+        if not args.interval:
+            return 1 if any(result['action'] == 'error' for result in results) else 0
+
+        # don't hold every channel's repodata in memory while waiting for the next pass
+        SubdirData.clear()
+        sleep(args.interval)
+
+
+def refresh_repodata_caches(channel_urls, window=0):
+    """Revalidate the repodata cache of each channel subdir url that has expired, or that
+    will expire within ``window`` seconds, and make sure every cache has a current fast-load
+    index.
+
+    Returns one dict per url, with the url, the action taken ('refreshed', 'current', or
+    'error'), and the number of seconds until the cache expires, if it does.
+    """
+    def refresh(url):
+        sd = SubdirData(Channel(url))
+        try:
+            expires_in = sd.cache_expires_in()
+            if expires_in is None or expires_in <= window:
+                sd.refresh()
+                action = 'refreshed'
+            else:
+                # loading rebuilds the index if it's missing or out of date
+                sd.load()
+                action = 'current'
+        except CondaError as e:
+            log.warning("Unable to refresh the repodata cache for %s\n%s", sd.url_w_subdir, e)
+            return {'url': sd.url_w_subdir, 'action': 'error', 'error': text_type(e)}
+        expires_in = sd.cache_expires_in()
+        if expires_in == float('inf'):
+            # an unchanged file:// channel cache doesn't expire
+            expires_in = None
+        return {'url': sd.url_w_subdir, 'action': action, 'expires_in': expires_in}
+
+    with ThreadLimitedThreadPoolExecutor() as executor:
+        return list(executor.map(refresh, channel_urls))
@@ -25,6 +25,7 @@ class Commands:
     INSTALL = "install"
     HELP = "help"
     LIST = "list"
+    REFRESH = "refresh"
     REMOVE = "remove"
     SEARCH = "search"
     UPDATE = "update"
@@ -150,6 +150,8 @@ class SatSolver(object):
     """
     Simple wrapper to call a SAT solver given a ClauseList/ClauseArray instance.
     """
+    # True for solvers that implement core()
+    supports_assumptions = False
 
     def __init__(self, **run_kwargs):
         self._run_kwargs = run_kwargs or {}
@@ -193,6 +195,15 @@ class SatSolver(object):
         """
         raise NotImplementedError()
 
+    def core(self, m, assumptions, **kwargs):
+        """
+        Solve with the literals in assumptions taken as true.
+        Returns None if a solution is found, or else the subset of assumptions the solver
+        used to prove the clauses unsatisfiable.  Solvers that can't solve under
+        assumptions raise NotImplementedError.
+        """
+        raise NotImplementedError()
+
 
 class PycoSatSolver(SatSolver):
     def setup(self, m, limit=0, **kwargs):
@@ -242,6 +253,8 @@ class CryptoMiniSatSolver(SatSolver):
 
 
 class PySatSolver(SatSolver):
+    supports_assumptions = True
+
     def setup(self, m, **kwargs):
         from pysat.solvers import Glucose4
 
@@ -264,6 +277,15 @@ class PySatSolver(SatSolver):
             solution = sat_solution
         return solution
 
+    def core(self, m, assumptions, **kwargs):
+        solver = self.setup(m, **kwargs)
+        try:
+            if solver.solve(assumptions=assumptions):
+                return None
+            return solver.get_core() or []
+        finally:
+            solver.delete()
+
 
 def get_sat_solver_cls(sat_solver_choice=SatSolverChoice.PYCOSAT):
     solvers = odict([
@@ -749,23 +771,7 @@ class Clauses(object):
             return set() if names else []
         saved_state = self._sat_solver.save_state()
         if additional:
-            def preproc(eqs):
-                def preproc_(cc):
-                    for c in cc:
-                        c = self.names.get(c, c)
-                        if c is False:
-                            continue
-                        yield c
-                        if c is True:
-                            break
-                for cc in eqs:
-                    cc = tuple(preproc_(cc))
-                    if not cc:
-                        yield cc
-                        break
-                    if cc[-1] is not True:
-                        yield cc
-            additional = list(preproc(additional))
+            additional = list(self._preprocess_clauses(additional))
             if additional:
                 if not additional[-1]:
                     return None
@@ -779,6 +785,68 @@ class Clauses(object):
             return set(nm for nm in (self.indices.get(s) for s in solution) if nm and nm[0] != '!')
         return solution
 
+    def _preprocess_clauses(self, eqs):
+        # Resolve names to literals and drop the clauses that are already satisfied.  An
+        # unsatisfiable clause is yielded as () and ends the sequence.
+        def preproc_(cc):
+            for c in cc:
+                c = self.names.get(c, c)
+                if c is False:
+                    continue
+                yield c
+                if c is True:
+                    break
+        for cc in eqs:
+            cc = tuple(preproc_(cc))
+            if not cc:
+                yield cc
+                break
+            if cc[-1] is not True:
+                yield cc
+
+    @property
+    def supports_unsat_core(self):
+        return self._sat_solver.supports_assumptions
+
+    def unsat_core(self, groups):
+        """
+        Find an unsatisfiable core among groups of additional clauses.
+
+        Each group is a sequence of clauses in the form sat() takes.  Every group gets a
+        selector variable that enables it, and a single solve with all selectors assumed
+        true yields the groups the solver needed for its proof of unsatisfiability.
+
+        Returns None if all the groups can be satisfied together, and otherwise a list of
+        group indices.  The core is not necessarily minimal.  Raises NotImplementedError
+        if the SAT solver can't solve under assumptions; see supports_unsat_core.
+        """
+        if not self.supports_unsat_core:
+            raise NotImplementedError("%s can't solve under assumptions"
+                                      % type(self._sat_solver).__name__)
+        if self.unsat:
+            return []
+        saved_state = self._sat_solver.save_state()
+        saved_m = self.m
+        try:
+            selectors = {}
+            for index, group in enumerate(groups):
+                clauses = list(self._preprocess_clauses(group))
+                if clauses and not clauses[-1]:
+                    return [index]
+                selector = self._new_var()
+                selectors[selector] = index
+                self.add_clauses([(-selector,) + clause for clause in clauses])
+            if log.isEnabledFor(DEBUG):
+                log.debug("Invoking SAT for an unsatisfiable core with clause count: %s",
+                          self.get_clause_count())
+            core = self._sat_solver.core(self.m, list(selectors))
+        finally:
+            self._sat_solver.restore_state(saved_state)
+            self.m = saved_m
+        if core is None:
+            return None
+        return sorted(selectors[lit] for lit in core if lit in selectors)
+
     def itersolve(self, constraints=None, m=None):
         exclude = []
         if m is None:
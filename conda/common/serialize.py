@@ -4,7 +4,9 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 import json
+from json.decoder import scanstring
 from logging import getLogger
+import re
 
 from .compat import PY2, odict, ensure_text_type
 from .._vendor.auxlib.decorators import memoize
@@ -90,3 +92,69 @@ def json_load(string):
 def json_dump(object):
     return ensure_text_type(json.dumps(object, indent=2, sort_keys=True,
                                        separators=(',', ': '), cls=EntityEncoder))
+
+
+_JSON_DECODER = json.JSONDecoder()
+_JSON_WHITESPACE_RE = re.compile(r'[ \t\n\r]*')
+
+
+def _json_scan_key(string, idx):
+    # idx points at the opening quote of an object key; returns the key and the index of
+    # the first character of its value
+    if string[idx:idx + 1] != '"':
+        raise ValueError("Expecting property name enclosed in double quotes: char %d" % idx)
+    key, idx = scanstring(string, idx + 1)
+    idx = _JSON_WHITESPACE_RE.match(string, idx).end()
+    if string[idx:idx + 1] != ':':
+        raise ValueError("Expecting ':' delimiter: char %d" % idx)
+    return key, _JSON_WHITESPACE_RE.match(string, idx + 1).end()
+
+
+def _json_scan_delimiter(string, idx):
+    # returns the index of the next key (or of the character past '}'), and whether
+    # the enclosing object is exhausted
+    idx = _JSON_WHITESPACE_RE.match(string, idx).end()
+    nextchar = string[idx:idx + 1]
+    if nextchar == '}':
+        return idx + 1, True
+    elif nextchar == ',':
+        return _JSON_WHITESPACE_RE.match(string, idx + 1).end(), False
+    raise ValueError("Expecting ',' delimiter: char %d" % idx)
+
+
+def json_iter_object(string, stream_keys=()):
+    """Walk the members of a JSON object without decoding the document as a whole.
+
+    Yields ``(key, None, value)`` for each top-level member.  Members named in `stream_keys`
+    whose values are themselves JSON objects are not decoded in one piece; instead each of
+    their members is decoded and yielded individually as ``(key, sub_key, sub_value)``.
+
+    Examples:
+        >>> list(json_iter_object('{"a": 1, "b": {"c": [2], "d": 3}}', stream_keys=('b',)))
+        [('a', None, 1), ('b', 'c', [2]), ('b', 'd', 3)]
+
+    """
+    decode = _JSON_DECODER.raw_decode
+    idx = _JSON_WHITESPACE_RE.match(string, 0).end()
+    if string[idx:idx + 1] != '{':
+        raise ValueError("Expecting '{': char %d" % idx)
+    idx = _JSON_WHITESPACE_RE.match(string, idx + 1).end()
+    if string[idx:idx + 1] == '}':
+        return
+    done = False
+    while not done:
+        key, idx = _json_scan_key(string, idx)
+        if key in stream_keys and string[idx:idx + 1] == '{':
+            idx = _JSON_WHITESPACE_RE.match(string, idx + 1).end()
+            sub_done = string[idx:idx + 1] == '}'
+            if sub_done:
+                idx += 1
+            while not sub_done:
+                sub_key, idx = _json_scan_key(string, idx)
+                value, idx = decode(string, idx)
+                yield key, sub_key, value
+                idx, sub_done = _json_scan_delimiter(string, idx)
+        else:
+            value, idx = decode(string, idx)
+            yield key, None, value
+        idx, done = _json_scan_delimiter(string, idx)
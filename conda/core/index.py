@@ -3,23 +3,29 @@
 # SPDX-License-Identifier: BSD-3-Clause
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-from logging import getLogger
-
+import hashlib
+from io import open as io_open
 from itertools import chain
+import json
+from logging import getLogger
+from os.path import dirname, isdir, join
 
 from .package_cache_data import PackageCacheData
 from .prefix_data import PrefixData
-from .subdir_data import SubdirData, make_feature_record
+from .subdir_data import SubdirData, atomic_write_path, create_cache_dir, make_feature_record
 from .._vendor.boltons.setutils import IndexedSet
 from .._vendor.toolz import concat, concatv, groupby
+from ..base.constants import ChannelPriority
 from ..base.context import context
-from ..common.compat import itervalues
+from ..common.compat import ensure_binary, ensure_text_type, itervalues, odict, text_type
 from ..common.io import ThreadLimitedThreadPoolExecutor, as_completed, dashlist, time_recorder
 from ..exceptions import ChannelNotAllowed, InvalidSpec
+from ..gateways.disk import mkdir_p
 from ..models.channel import Channel, all_channel_urls
 from ..models.match_spec import MatchSpec
 from ..models.records import EMPTY_LINK, PackageCacheRecord, PrefixRecord, PackageRecord
 from ..models.enums import PackageType
+from ..models.index import Index
 
 log = getLogger(__name__)
 
@@ -69,13 +75,105 @@ def get_index(channel_urls=(), prepend=True, platform=None,
 
 def fetch_index(channel_urls, use_cache=False, index=None):
     log.debug('channel_urls=' + repr(channel_urls))
-    index = {}
-    for url in channel_urls:
-        sd = SubdirData(Channel(url))
+    index = Index()
+    subdir_datas = tuple(SubdirData(Channel(url)) for url in channel_urls)
+    with _repodata_executor() as executor:
+        _load_subdir_datas(executor, subdir_datas)
+    for sd in subdir_datas:
         index.update((rec, rec) for rec in sd.iter_records())
     return index
 
 
+def _repodata_executor():
+    if context.repodata_threads:
+        return ThreadLimitedThreadPoolExecutor(max_workers=context.repodata_threads)
+    return ThreadLimitedThreadPoolExecutor()
+
+
+def _load_subdir_datas(executor, subdir_datas):
+    # Fetch, revalidate (etag/304) and parse every subdir at once, so the cost of a cold
+    # index is one round-trip rather than one per subdir.
+    futures = tuple(executor.submit(sd.load) for sd in subdir_datas if not sd._loaded)
+    for future in as_completed(futures):
+        future.result()
+
+
+# bump when the format of a reduced index cache entry, or what its key covers, changes
+REDUCED_INDEX_CACHE_VERSION = 1
+
+
+def _reduced_index_cache_path(prefix, channel_urls, specs):
+    # Everything the dependency walk depends on, other than the repodata itself, goes into
+    # the key.  The repodata is validated against the entry's subdir stamps when it's read.
+    key = json.dumps([
+        REDUCED_INDEX_CACHE_VERSION,
+        list(channel_urls),
+        sorted(text_type(spec) for spec in specs),
+        sorted(prefix_rec.dist_str() for prefix_rec in PrefixData(prefix).iter_records())
+        if prefix else [],
+        text_type(context.channel_priority),
+        context.add_pip_as_python_dependency,
+    ])
+    key_hash = hashlib.sha256(ensure_binary(key)).hexdigest()
+    return join(create_cache_dir(), 'reduced-index', '%s.json' % key_hash[:32])
+
+
+def _subdir_stamp(sd):
+    # identifies the version of a loaded subdir's repodata; None if it can't be identified
+    _internal_state = sd._internal_state
+    stamp = [_internal_state.get(key) for key in ('_etag', '_mod', '_file_stamp')]
+    return stamp if any(stamp) else None
+
+
+def _read_reduced_index_cache(executor, cache_path, subdir_datas):
+    # Replays the queries that the dependency walk made of each subdir, as long as none of
+    # those subdirs has changed.  Returns (records, names queried), or None when the entry
+    # can't be used.
+    try:
+        with io_open(cache_path) as fh:
+            queries = json.loads(fh.read())['queries']
+    except (IOError, OSError, KeyError, TypeError, ValueError):
+        return None
+    subdir_datas_by_url = dict((sd.url_w_subdir, sd) for sd in subdir_datas)
+    try:
+        sds = tuple(subdir_datas_by_url[query['url']] for query in queries)
+    except (KeyError, TypeError):
+        return None
+    _load_subdir_datas(executor, sds)
+    if any(_subdir_stamp(sd) != query['stamp'] for sd, query in zip(sds, queries)):
+        log.debug("Reduced index cache %s is out of date", cache_path)
+        return None
+
+    log.debug("Using reduced index cache %s", cache_path)
+    futures = tuple(executor.submit(sd.query_many, query['names'], query['track_features'])
+                    for sd, query in zip(sds, queries))
+    records = IndexedSet(concat(future.result() for future in futures))
+    return records, set(concat(query['names'] for query in queries))
+
+
+def _write_reduced_index_cache(cache_path, queried):
+    queries = []
+    for sd, (names, track_features) in queried.items():
+        stamp = _subdir_stamp(sd)
+        if stamp is None:
+            log.debug("Not caching reduced index; %s can't be validated", sd.url_w_subdir)
+            return
+        queries.append({
+            'url': sd.url_w_subdir,
+            'stamp': stamp,
+            'names': sorted(names),
+            'track_features': sorted(track_features),
+        })
+    try:
+        if not isdir(dirname(cache_path)):
+            mkdir_p(dirname(cache_path))
+        with atomic_write_path(cache_path) as tmp_path:
+            with io_open(tmp_path, 'w') as fh:
+                fh.write(ensure_text_type(json.dumps({'queries': queries})))
+    except (IOError, OSError) as e:
+        log.debug("Unable to write reduced index cache %s (%r)", cache_path, e)
+
+
 def dist_str_in_index(index, dist_str):
     match_spec = MatchSpec.from_dist_str(dist_str)
     return any(match_spec.match(prec) for prec in itervalues(index))
@@ -105,9 +203,14 @@ def _supplement_index_with_prefix(index, prefix):
             index[prefix_record] = prefix_record
 
 
-def _supplement_index_with_cache(index):
-    # supplement index with packages from the cache
-    for pcrec in PackageCacheData.get_all_extracted_entries():
+def _supplement_index_with_cache(index, names=None):
+    # supplement index with packages from the cache; with names, only with the packages of
+    # those names and their dependencies
+    if names is None:
+        pcrecs = PackageCacheData.get_all_extracted_entries()
+    else:
+        pcrecs = _get_extracted_entries_for_names(names)
+    for pcrec in pcrecs:
         if pcrec in index:
             # The downloaded repodata takes priority
             current_record = index[pcrec]
@@ -116,6 +219,25 @@ def _supplement_index_with_cache(index):
             index[pcrec] = pcrec
 
 
+def _get_extracted_entries_for_names(names):
+    pcrecs = []
+    seen_names = set()
+    pending_names = set(names)
+    while pending_names:
+        seen_names.update(pending_names)
+        new_pcrecs = PackageCacheData.get_extracted_entries_by_name(sorted(pending_names))
+        pending_names = set()
+        for pcrec in new_pcrecs:
+            try:
+                combined_depends = pcrec.combined_depends
+            except InvalidSpec:
+                continue
+            pending_names.update(spec.name for spec in combined_depends
+                                 if spec.name not in seen_names and spec.name != '*')
+        pcrecs.extend(new_pcrecs)
+    return pcrecs
+
+
 def _make_virtual_package(name, version=None):
     return PackageRecord(
             package_type=PackageType.VIRTUAL_SYSTEM,
@@ -172,7 +294,7 @@ def get_reduced_index(prefix, channels, subdirs, specs):
     #                 keep_specs.append(spec)
     #         consolidated_specs.update(keep_specs)
 
-    with ThreadLimitedThreadPoolExecutor() as executor:
+    with _repodata_executor() as executor:
 
         channel_urls = all_channel_urls(channels, subdirs=subdirs)
         check_whitelist(channel_urls)
@@ -185,16 +307,52 @@ def get_reduced_index(prefix, channels, subdirs, specs):
                          dashlist(ignored_urls))
             channel_urls = IndexedSet(grouped_urls.get(True, ()))
         subdir_datas = tuple(SubdirData(Channel(url)) for url in channel_urls)
+        if context.channel_priority == ChannelPriority.STRICT:
+            # Only the highest-priority channel that has a package is used by the solver,
+            # so names are looked up one channel at a time, in priority order.  A channel's
+            # subdirs are only loaded once some name or track_feature falls through to them.
+            channel_groups = odict()
+            for sd in subdir_datas:
+                channel_groups.setdefault(sd.channel.name, []).append(sd)
+        else:
+            channel_groups = None
+            _load_subdir_datas(executor, subdir_datas)
 
         records = IndexedSet()
         collected_names = set()
         collected_track_features = set()
         pending_names = set()
         pending_track_features = set()
-
-        def query_all(spec):
-            futures = tuple(executor.submit(sd.query, spec) for sd in subdir_datas)
-            return tuple(concat(future.result() for future in as_completed(futures)))
+        # {subdir_data: (names, track_features)} asked of each subdir during the walk
+        queried = odict()
+
+        def query_subdirs(sds, names, track_features):
+            for sd in sds:
+                queried_names, queried_track_features = queried.setdefault(sd, (set(), set()))
+                queried_names.update(names)
+                queried_track_features.update(track_features)
+            futures = tuple(executor.submit(sd.query_many, names, track_features)
+                            for sd in sds)
+            return tuple(concat(future.result() for future in futures))
+
+        def query_all(names, track_features):
+            if channel_groups is None:
+                return query_subdirs(subdir_datas, names, track_features)
+            found_records = []
+            remaining_names = names
+            remaining_track_features = track_features
+            for sds in itervalues(channel_groups):
+                if not remaining_names and not remaining_track_features:
+                    break
+                _load_subdir_datas(executor, sds)
+                new_records = query_subdirs(sds, remaining_names, remaining_track_features)
+                found_names = set(rec.name for rec in new_records)
+                remaining_names = [name for name in remaining_names if name not in found_names]
+                found_track_features = set(concat(rec.track_features for rec in new_records))
+                remaining_track_features = [ftr_name for ftr_name in remaining_track_features
+                                            if ftr_name not in found_track_features]
+                found_records.extend(new_records)
+            return found_records
 
         def push_spec(spec):
             name = spec.get_raw_value('name')
@@ -220,32 +378,41 @@ def get_reduced_index(prefix, channels, subdirs, specs):
                 for ftr_name in record.track_features:
                     push_spec(MatchSpec(track_features=ftr_name))
 
-        if prefix:
-            for prefix_rec in PrefixData(prefix).iter_records():
-                push_record(prefix_rec)
-        for spec in specs:
-            push_spec(spec)
-
-        while pending_names or pending_track_features:
-            while pending_names:
-                name = pending_names.pop()
-                collected_names.add(name)
-                spec = MatchSpec(name)
-                new_records = query_all(spec)
-                for record in new_records:
-                    push_record(record)
-                records.update(new_records)
+        cache_path = None
+        cached_records = None
+        if context.use_reduced_index_cache:
+            cache_path = _reduced_index_cache_path(prefix, channel_urls, specs)
+            cached_records = _read_reduced_index_cache(executor, cache_path, subdir_datas)
 
-            while pending_track_features:
-                feature_name = pending_track_features.pop()
-                collected_track_features.add(feature_name)
-                spec = MatchSpec(track_features=feature_name)
-                new_records = query_all(spec)
+        if cached_records is not None:
+            records, cached_names = cached_records
+            collected_names.update(cached_names)
+        else:
+            if prefix:
+                for prefix_rec in PrefixData(prefix).iter_records():
+                    push_record(prefix_rec)
+            for spec in specs:
+                push_spec(spec)
+
+            # Breadth-first over the dependency graph: every name and feature discovered in
+            # one level is looked up in a single batched query per subdir.
+            while pending_names or pending_track_features:
+                names = sorted(pending_names)
+                track_features = sorted(pending_track_features)
+                collected_names.update(names)
+                collected_track_features.update(track_features)
+                pending_names.clear()
+                pending_track_features.clear()
+
+                new_records = query_all(names, track_features)
                 for record in new_records:
                     push_record(record)
                 records.update(new_records)
 
-        reduced_index = {rec: rec for rec in records}
+            if cache_path:
+                _write_reduced_index_cache(cache_path, queried)
+
+        reduced_index = Index((rec, rec) for rec in records)
 
         if prefix is not None:
             _supplement_index_with_prefix(reduced_index, prefix)
@@ -255,7 +422,7 @@ def get_reduced_index(prefix, channels, subdirs, specs):
             # This is really messed up right now.  Dates all the way back to
             # https://github.com/conda/conda/commit/f761f65a82b739562a0d997a2570e2b8a0bdc783
             # TODO: revisit this later
-            _supplement_index_with_cache(reduced_index)
+            _supplement_index_with_cache(reduced_index, collected_names)
 
         # add feature records for the solver
         known_features = set()
@@ -4,6 +4,7 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 import codecs
+from collections import defaultdict
 from errno import EACCES, ENOENT, EPERM
 from functools import reduce
 from logging import getLogger
@@ -79,6 +80,8 @@ class PackageCacheData(object):
     def __init__(self, pkgs_dir):
         self.pkgs_dir = pkgs_dir
         self.__package_cache_records = None
+        self.__package_cache_names = None
+        self.__records_by_name = {}
         self.__is_writable = NULL
 
         self._urls_data = UrlsData(pkgs_dir)
@@ -89,20 +92,20 @@ class PackageCacheData(object):
         write_as_json_to_file(meta, PackageRecord.from_objects(package_cache_record))
 
         self._package_cache_records[package_cache_record] = package_cache_record
+        self.__package_cache_names = None
+        self.__records_by_name = {}
 
     def load(self):
         self.__package_cache_records = _package_cache_records = {}
+        self.__package_cache_names = None
+        self.__records_by_name = {}
         self._check_writable()  # called here to create the cache if it doesn't exist
         if not isdir(self.pkgs_dir):
             # no directory exists, and we didn't have permissions to create it
             return
 
         for base_name in self._dedupe_pkgs_dir_contents(listdir(self.pkgs_dir)):
-            full_path = join(self.pkgs_dir, base_name)
-            if islink(full_path):
-                continue
-            elif (isdir(full_path) and isfile(join(full_path, 'info', 'index.json'))
-                  or isfile(full_path) and full_path.endswith(CONDA_TARBALL_EXTENSION)):
+            if self._is_package_cache_entry(join(self.pkgs_dir, base_name)):
                 package_cache_record = self._make_single_record(base_name)
                 if package_cache_record:
                     _package_cache_records[package_cache_record] = package_cache_record
@@ -122,11 +125,33 @@ class PackageCacheData(object):
                 raise
 
     def remove(self, package_ref, default=NULL):
+        self.__records_by_name.pop(package_ref.name, None)
         if default is NULL:
             return self._package_cache_records.pop(package_ref)
         else:
             return self._package_cache_records.pop(package_ref, default)
 
+    def query_name(self, name):
+        """Return the records of this package cache for the package ``name``.
+
+        Until the whole cache has been loaded, only the entries whose file or directory
+        name starts with ``name`` are read.
+        """
+        if self.__package_cache_records is not None:
+            return [pcrec for pcrec in itervalues(self.__package_cache_records)
+                    if pcrec.name == name]
+        try:
+            return self.__records_by_name[name]
+        except KeyError:
+            records = []
+            for base_name in self._package_cache_names.get(name, ()):
+                if self._is_package_cache_entry(join(self.pkgs_dir, base_name)):
+                    package_cache_record = self._make_single_record(base_name)
+                    if package_cache_record and package_cache_record.name == name:
+                        records.append(package_cache_record)
+            self.__records_by_name[name] = records
+            return records
+
     def query(self, package_ref_or_match_spec):
         # returns a generator
         param = package_ref_or_match_spec
@@ -206,6 +231,14 @@ class PackageCacheData(object):
         return tuple(pc_entry for pc_entry in concat(map(itervalues, package_caches))
                      if pc_entry.is_extracted)
 
+    @classmethod
+    def get_extracted_entries_by_name(cls, names):
+        package_caches = tuple(cls(pd) for pd in context.pkgs_dirs)
+        return tuple(pc_entry for pc_entry in concat(package_cache.query_name(name)
+                                                     for package_cache in package_caches
+                                                     for name in names)
+                     if pc_entry.is_extracted)
+
     @classmethod
     def get_entry_to_link(cls, package_ref):
         pc_entry = next((pcrec for pcrec in cls.query_all(package_ref)
@@ -256,6 +289,28 @@ class PackageCacheData(object):
             self.load()
         return self.__package_cache_records
 
+    @property
+    def _package_cache_names(self):
+        # {name: [base_name, ...]}, for looking up entries by name without loading them all.
+        # Entries are named '<name>-<version>-<build>', so only the directory is listed.
+        if self.__package_cache_names is None:
+            self.__package_cache_names = package_cache_names = defaultdict(list)
+            if isdir(self.pkgs_dir):
+                for base_name in self._dedupe_pkgs_dir_contents(listdir(self.pkgs_dir)):
+                    dist_name = (base_name[:-len(CONDA_TARBALL_EXTENSION)]
+                                 if base_name.endswith(CONDA_TARBALL_EXTENSION) else base_name)
+                    parts = dist_name.rsplit('-', 2)
+                    if len(parts) == 3:
+                        package_cache_names[parts[0]].append(base_name)
+        return self.__package_cache_names
+
+    @staticmethod
+    def _is_package_cache_entry(full_path):
+        if islink(full_path):
+            return False
+        return (isdir(full_path) and isfile(join(full_path, 'info', 'index.json'))
+                or isfile(full_path) and full_path.endswith(CONDA_TARBALL_EXTENSION))
+
     @property
     def is_writable(self):
         # returns None if package cache directory does not exist / has not been created
@@ -3,30 +3,37 @@
 # SPDX-License-Identifier: BSD-3-Clause
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+from array import array
 import bz2
 from collections import defaultdict
-from contextlib import closing
-from errno import EACCES, ENODEV, EPERM
+from contextlib import closing, contextmanager
+from errno import EACCES, EPERM
 from genericpath import getmtime, isfile
+import gzip
 import hashlib
 import json
 from logging import DEBUG, getLogger
 from mmap import ACCESS_READ, mmap
+import os
 from os.path import dirname, isdir, join, splitext
 import re
+import struct
 from time import time
 import warnings
 from io import open as io_open
+from uuid import uuid4
 
 from .. import CondaError
 from .._vendor.auxlib.ish import dals
 from .._vendor.auxlib.logz import stringify
-from .._vendor.toolz import concat, take
-from ..base.constants import CONDA_HOMEPAGE_URL
+from .._vendor.toolz import concat
+from ..base.constants import CONDA_HOMEPAGE_URL, RepodataCacheBackend
 from ..base.context import context
-from ..common.compat import (ensure_binary, ensure_text_type, ensure_unicode, iteritems,
-                             string_types, text_type, with_metaclass)
+from ..common.compat import (Mapping, ensure_binary, ensure_text_type, iteritems, itervalues,
+                             on_win, string_types, text_type, with_metaclass)
 from ..common.io import ThreadLimitedThreadPoolExecutor, as_completed
+from ..common.serialize import json_iter_object
+from ..common.path import url_to_path
 from ..common.url import join_url, maybe_unquote
 from ..core.package_cache_data import PackageCacheData
 from ..exceptions import (CondaDependencyError, CondaHTTPError, CondaUpgradeError,
@@ -36,22 +43,22 @@ from ..gateways.connection import (ConnectionError, HTTPError, InsecureRequestWa
 from ..gateways.connection.session import CondaSession
 from ..gateways.disk import mkdir_p, mkdir_p_sudo_safe
 from ..gateways.disk.delete import rm_rf
-from ..gateways.disk.update import touch
+from ..gateways.disk.link import lexists
+from ..gateways.disk.lock import file_lock
+from ..gateways.disk.update import backoff_rename, touch
 from ..models.channel import Channel, all_channel_urls
 from ..models.match_spec import MatchSpec
 from ..models.records import PackageRecord
 
-try:
-    import cPickle as pickle
-except ImportError:  # pragma: no cover
-    import pickle  # NOQA
-
 log = getLogger(__name__)
 stderrlog = getLogger('conda.stderrlog')
 
-REPODATA_PICKLE_VERSION = 28
+REPODATA_INDEX_VERSION = 2
 MAX_REPODATA_VERSION = 1
-REPODATA_HEADER_RE = b'"(_etag|_mod|_cache_control)":[ ]?"(.*?[^\\\\])"[,\}\s]'  # NOQA
+REPODATA_PATCHES_FN = 'repodata_patches.json'
+REPODATA_SHARDS_FN = 'repodata_shards.json'
+REPODATA_HEADER_KEYS = ('_url', '_etag', '_mod', '_cache_control', '_file_stamp',
+                        '_no_shards')
 
 
 class SubdirDataType(type):
@@ -61,8 +68,15 @@ class SubdirDataType(type):
         assert not channel.package_filename
         assert type(channel) is Channel
         cache_key = channel.url(with_credentials=True)
-        if not cache_key.startswith('file://') and cache_key in SubdirData._cache_:
-            return SubdirData._cache_[cache_key]
+        if cache_key in SubdirData._cache_:
+            cache_entry = SubdirData._cache_[cache_key]
+            # A local channel can change at any time; reload it once its repodata has.  There
+            # is no stamp to compare when the state didn't come from repodata.json (shards).
+            if (cache_key.startswith('file://') and cache_entry._loaded
+                    and cache_entry._file_stamp is not None
+                    and cache_entry._file_stamp != cache_entry._local_repodata_stamp()):
+                cache_entry._loaded = False
+            return cache_entry
 
         subdir_data_instance = super(SubdirDataType, cls).__call__(channel)
         SubdirData._cache_[cache_key] = subdir_data_instance
@@ -73,6 +87,10 @@ class SubdirDataType(type):
 class SubdirData(object):
     _cache_ = {}
 
+    @classmethod
+    def clear(cls):
+        cls._cache_.clear()
+
     @staticmethod
     def query_all(package_ref_or_match_spec, channels=None, subdirs=None):
         from .index import check_whitelist  # TODO: fix in-line import
@@ -97,26 +115,55 @@ class SubdirData(object):
         if isinstance(param, MatchSpec):
             if param.get_exact_value('name'):
                 package_name = param.get_exact_value('name')
-                for prec in self._names_index[package_name]:
-                    if param.match(prec):
-                        yield prec
+                for prec in self._query_name(package_name, param):
+                    yield prec
             elif param.get_exact_value('track_features'):
-                track_features = param.get_exact_value('track') or ()
-                candidates = concat(self._track_features_index[feature_name]
+                track_features = param.get_exact_value('track_features') or ()
+                candidates = concat(self._get_records_by_track_feature(feature_name)
                                     for feature_name in track_features)
                 for prec in candidates:
                     if param.match(prec):
                         yield prec
             else:
-                for prec in self._package_records:
-                    if param.match(prec):
-                        yield prec
+                name_match = param._match_components.get('name')
+                if name_match is None:
+                    for prec in self._package_records:
+                        if param.match(prec):
+                            yield prec
+                else:
+                    # only materialize records for the names that can possibly match
+                    for name in self._iter_names_matching(name_match):
+                        for prec in self._query_name(name, param):
+                            yield prec
         else:
             assert isinstance(param, PackageRecord)
-            for prec in self._names_index[param.name]:
+            for prec in self._get_records_by_name(param.name):
                 if prec == param:
                     yield prec
 
+    def query_many(self, names=(), track_features=()):
+        """Return the records matching any of the given package names, or any of the given
+        track_features, in one call.
+
+        Equivalent to ``query(MatchSpec(name))`` for each name and
+        ``query(MatchSpec(track_features=feature))`` for each feature, but answers a whole
+        batch of lookups against the loaded index at once.
+        """
+        if not self._loaded:
+            self.load()
+        self._prefetch_records(MatchSpec(name).get_exact_value('name') for name in names)
+        result = []
+        for name in names:
+            spec = MatchSpec(name)
+            exact_name = spec.get_exact_value('name')
+            if exact_name:
+                result.extend(self._get_records_by_name(exact_name))
+            else:
+                result.extend(self.query(spec))
+        for feature_name in track_features:
+            result.extend(self.query(MatchSpec(track_features=feature_name)))
+        return result
+
     def __init__(self, channel):
         assert channel.subdir
         if channel.package_filename:
@@ -129,6 +176,10 @@ class SubdirData(object):
         self.cache_path_base = join(create_cache_dir(),
                                     splitext(cache_fn_url(self.url_w_credentials))[0])
         self._loaded = False
+        self._file_stamp = None
+        self._shards_unavailable = False
+        self._raw_names_index = None
+        self._intern_pool = {}
 
     def reload(self):
         self._loaded = False
@@ -137,128 +188,402 @@ class SubdirData(object):
 
     @property
     def cache_path_json(self):
-        return self.cache_path_base + '.json'
+        return self.cache_path_base + '.json.gz'
 
     @property
-    def cache_path_pickle(self):
-        return self.cache_path_base + '.q'
+    def cache_path_headers(self):
+        return self.cache_path_base + '.headers.json'
 
-    def load(self):
-        _internal_state = self._load()
-        if _internal_state.get("repodata_version", 0) > MAX_REPODATA_VERSION:
-            raise CondaUpgradeError(dals("""
-                The current version of conda is too old to read repodata from
+    @property
+    def cache_path_index(self):
+        if context.repodata_cache_backend == RepodataCacheBackend.SQLITE:
+            return self.cache_path_base + '.sqlite'
+        return self.cache_path_base + '.idx'
 
-                    %s
+    @property
+    def cache_path_shards(self):
+        return self.cache_path_base + '.shards'
 
-                (This version only supports repodata_version 1.)
-                Please update conda to use this channel.
-                """) % self.url_w_subdir)
+    def load(self):
+        return self._set_internal_state(self._load_shards() or self._load())
+
+    def refresh(self):
+        """Revalidate the cached repodata with the channel now, whether or not the cache has
+        expired, and load the result."""
+        return self._set_internal_state(self._load_shards(revalidate=True)
+                                        or self._refresh_locked(self._cache_mtime()))
+
+    def cache_expires_in(self):
+        """Seconds until the cached repodata must be revalidated, or None if there's no
+        cache.  Negative once the cache has expired."""
+        mtime = self._cache_mtime()
+        if mtime is None:
+            return None
+        if self.url_w_subdir.startswith('file://'):
+            mod_etag_headers = read_mod_and_etag(self.cache_path_headers)
+            unchanged = mod_etag_headers.get('_file_stamp') == self._local_repodata_stamp()
+            return float('inf') if unchanged else 0
+        return mtime + self._cache_max_age(read_mod_and_etag(self.cache_path_headers)) - time()
 
+    def _set_internal_state(self, _internal_state):
+        self._check_repodata_version(_internal_state.get("repodata_version", 0))
+
+        self._close_index(keep=_internal_state['_raw_names_index'])
         self._internal_state = _internal_state
-        self._package_records = _internal_state['_package_records']
-        self._names_index = _internal_state['_names_index']
+        self._raw_names_index = _internal_state['_raw_names_index']
         self._track_features_index = _internal_state['_track_features_index']
+        self._meta_in_common = _internal_state['_meta_in_common']
+        self._file_stamp = _internal_state.get('_file_stamp')
+        self._reset_materialized_records()
         self._loaded = True
         return self
 
+    def _close_index(self, keep=None):
+        # A mapped index holds its file open until closed.  On Windows that also keeps a
+        # freshly written index from being renamed over it, so the previous index is closed
+        # whenever the loaded state is replaced.
+        if self._raw_names_index is not keep:
+            _close_raw_names_index(self._raw_names_index)
+
     def iter_records(self):
         if not self._loaded:
             self.load()
         return iter(self._package_records)
 
+    @property
+    def _package_records(self):
+        if isinstance(self._raw_names_index, ShardedRepodataIndex):
+            # Listing every record would fetch every shard, one request per name.  The
+            # repodata.json published next to the shards has them all in one download.
+            log.debug("Loading repodata.json for %s to list all records", self.url_w_subdir)
+            self._set_internal_state(self._load())
+        return list(concat(self._get_records_by_name(name) for name in self._raw_names_index))
+
+    def _reset_materialized_records(self):
+        # PackageRecord objects are only created when a query first asks for them; the
+        # loaded state holds the raw repodata entries, grouped by name.  The pool of shared
+        # values goes with them, so that nothing outlives the state it was interned for.
+        self._names_index = {}
+        self._columns_index = {}
+        self._intern_pool = {}
+
+    def _get_records_by_name(self, name):
+        try:
+            return self._names_index[name]
+        except KeyError:
+            url_w_credentials = self.url_w_credentials
+            meta_in_common = self._meta_in_common
+            precs = []
+            for fn, info in self._raw_names_index.get(name, ()):
+                info = dict(info, fn=fn, url=join_url(url_w_credentials, fn))
+                info.update(meta_in_common)
+                precs.append(PackageRecord(**intern_package_info(info, self._intern_pool)))
+            self._names_index[name] = precs
+            return precs
+
+    def _query_name(self, name, spec):
+        # The name's version, build and build_number columns are filtered first; the
+        # records still need a full match only if the spec has other components.
+        precs = self._get_records_by_name(name)
+        columns = self._get_columns_by_name(name)
+        full_match = not columns.covers(spec)
+        for position in columns.select(spec):
+            prec = precs[position]
+            if not full_match or spec.match(prec):
+                yield prec
+
+    def _get_columns_by_name(self, name):
+        # rows are in the same order as the records from _get_records_by_name()
+        try:
+            return self._columns_index[name]
+        except KeyError:
+            columns = self._columns_index[name] = RepodataColumns(
+                self._get_records_by_name(name)
+            )
+            return columns
+
+    def _prefetch_records(self, names):
+        # Shards are fetched one request per name; when a batch of names is needed at once,
+        # fetch the missing ones concurrently rather than one after the other.
+        raw_names_index = self._raw_names_index
+        if not isinstance(raw_names_index, ShardedRepodataIndex):
+            return
+        missing = [name for name in names
+                   if name not in self._names_index and name in raw_names_index]
+        if len(missing) > 1:
+            with ThreadLimitedThreadPoolExecutor() as executor:
+                tuple(executor.map(self._get_records_by_name, missing))
+
+    def _iter_names_matching(self, name_match):
+        raw_names_index = self._raw_names_index
+        pattern = name_match._raw_value
+        if (isinstance(raw_names_index, SqliteRepodataIndex)
+                and not pattern.startswith('^') and not any(c in pattern for c in '?[')):
+            # a plain '*' wildcard has the same meaning in SQLite's GLOB operator
+            return raw_names_index.glob_names(pattern)
+        return (name for name in raw_names_index if name_match.match(name))
+
+    def _get_records_by_track_feature(self, feature_name):
+        return [prec
+                for name in self._track_features_index.get(feature_name, ())
+                for prec in self._get_records_by_name(name)
+                if feature_name in prec.track_features]
+
+    def _load_shards(self, revalidate=False):
+        # Returns None when shards are disabled or the channel has no manifest; the caller then
+        # loads repodata.json.
+        if not context.use_repodata_shards or self._shards_unavailable:
+            return None
+        if (not revalidate and read_mod_and_etag(self.cache_path_headers).get('_no_shards')
+                and (self.cache_expires_in() or 0) > 0):
+            # the channel had no manifest when the cached repodata was last revalidated
+            self._shards_unavailable = True
+            return None
+        try:
+            manifest = fetch_cached_json(self.url_w_credentials, REPODATA_SHARDS_FN,
+                                         self.cache_path_shards + '.json', revalidate)
+        except CondaHTTPError as e:
+            log.debug("Unable to retrieve repodata shards for %s (%r). Using repodata.json.",
+                      self.url_w_subdir, e)
+            return None
+        if manifest is None:
+            log.debug("No repodata shards for %s. Using repodata.json.", self.url_w_subdir)
+            self._shards_unavailable = True
+            return None
+        self._check_repodata_version(manifest.get('repodata_version', 0))
+
+        info = manifest.get('info') or {}
+        subdir = info.get('subdir') or self.channel.subdir
+        assert subdir == self.channel.subdir
+        schannel = self.channel.canonical_name
+        return {
+            'channel': self.channel,
+            'url_w_subdir': self.url_w_subdir,
+            'url_w_credentials': self.url_w_credentials,
+            'cache_path_base': self.cache_path_base,
+
+            '_raw_names_index': ShardedRepodataIndex(self, manifest.get('shards') or {}),
+            '_track_features_index': manifest.get('track_features') or {},
+            '_meta_in_common': intern_package_info({
+                'arch': info.get('arch'),
+                'channel': self.channel,
+                'platform': info.get('platform'),
+                'schannel': schannel,
+                'subdir': subdir,
+            }, self._intern_pool),
+
+            '_add_pip': context.add_pip_as_python_dependency,
+            '_schannel': schannel,
+            'repodata_version': manifest.get('repodata_version', 0),
+        }
+
     def _load(self):
+        cache_mtime = self._cache_mtime()
+        _internal_state = self._read_unexpired_cache(cache_mtime)
+        if _internal_state is not None:
+            return _internal_state
+        return self._refresh_locked(cache_mtime)
+
+    def _refresh_locked(self, cache_mtime):
+        # Only one process at a time refreshes a given subdir's cache.  The others wait here,
+        # and then read the cache the first one wrote instead of fetching it again.
+        with file_lock(self.cache_path_base + '.lock'):
+            refreshed_mtime = self._cache_mtime()
+            if refreshed_mtime is not None and refreshed_mtime != cache_mtime:
+                log.debug("Repodata cache for %s at %s was refreshed by another process",
+                          self.url_w_subdir, self.cache_path_json)
+                mod_etag_headers = read_mod_and_etag(self.cache_path_headers)
+                return self._read_local_repdata(mod_etag_headers.get('_etag'),
+                                                mod_etag_headers.get('_mod'))
+            return self._refresh_cache(refreshed_mtime is not None)
+
+    def _cache_mtime(self):
+        # the headers file is touched whenever the cache is revalidated
         try:
-            mtime = getmtime(self.cache_path_json)
+            mtime = getmtime(self.cache_path_headers)
         except (IOError, OSError):
+            return None
+        return mtime if isfile(self.cache_path_json) else None
+
+    def _read_unexpired_cache(self, mtime):
+        if mtime is None:
             log.debug("No local cache found for %s at %s", self.url_w_subdir, self.cache_path_json)
             if context.use_index_cache or (context.offline
                                            and not self.url_w_subdir.startswith('file://')):
                 log.debug("Using cached data for %s at %s forced. Returning empty repodata.",
                           self.url_w_subdir, self.cache_path_json)
                 return {
-                    '_package_records': (),
-                    '_names_index': defaultdict(list),
-                    '_track_features_index': defaultdict(list),
+                    '_raw_names_index': {},
+                    '_track_features_index': {},
+                    '_meta_in_common': {},
                 }
-            else:
-                mod_etag_headers = {}
-        else:
-            mod_etag_headers = read_mod_and_etag(self.cache_path_json)
+            return None
+
+        mod_etag_headers = read_mod_and_etag(self.cache_path_headers)
+
+        if context.use_index_cache:
+            log.debug("Using cached repodata for %s at %s because use_cache=True",
+                      self.url_w_subdir, self.cache_path_json)
 
-            if context.use_index_cache:
-                log.debug("Using cached repodata for %s at %s because use_cache=True",
+            _internal_state = self._read_local_repdata(mod_etag_headers.get('_etag'),
+                                                       mod_etag_headers.get('_mod'))
+            return _internal_state
+
+        if self.url_w_subdir.startswith('file://'):
+            # No TTL applies to local channels; the cache is good for exactly as long as the
+            # repodata.json it was made from is unchanged.
+            file_stamp = mod_etag_headers.get('_file_stamp')
+            if file_stamp and file_stamp == self._local_repodata_stamp():
+                log.debug("Using cached repodata for %s at %s. Local repodata is unchanged.",
                           self.url_w_subdir, self.cache_path_json)
+                return self._read_local_repdata(mod_etag_headers.get('_etag'),
+                                                mod_etag_headers.get('_mod'))
+            log.debug("Local repodata changed for %s", self.url_w_subdir)
+            return None
 
-                _internal_state = self._read_local_repdata(mod_etag_headers.get('_etag'),
-                                                           mod_etag_headers.get('_mod'))
-                return _internal_state
+        timeout = mtime + self._cache_max_age(mod_etag_headers) - time()
+        if timeout > 0 or context.offline:
+            log.debug("Using cached repodata for %s at %s. Timeout in %d sec",
+                      self.url_w_subdir, self.cache_path_json, timeout)
+            _internal_state = self._read_local_repdata(mod_etag_headers.get('_etag'),
+                                                       mod_etag_headers.get('_mod'))
+            return _internal_state
 
-            if context.local_repodata_ttl > 1:
-                max_age = context.local_repodata_ttl
-            elif context.local_repodata_ttl == 1:
-                max_age = get_cache_control_max_age(mod_etag_headers.get('_cache_control', ''))
-            else:
-                max_age = 0
-
-            timeout = mtime + max_age - time()
-            if (timeout > 0 or context.offline) and not self.url_w_subdir.startswith('file://'):
-                log.debug("Using cached repodata for %s at %s. Timeout in %d sec",
-                          self.url_w_subdir, self.cache_path_json, timeout)
-                _internal_state = self._read_local_repdata(mod_etag_headers.get('_etag'),
-                                                           mod_etag_headers.get('_mod'))
-                return _internal_state
+        log.debug("Local cache timed out for %s at %s",
+                  self.url_w_subdir, self.cache_path_json)
+        return None
 
-            log.debug("Local cache timed out for %s at %s",
-                      self.url_w_subdir, self.cache_path_json)
+    @staticmethod
+    def _cache_max_age(mod_etag_headers):
+        if context.local_repodata_ttl > 1:
+            return context.local_repodata_ttl
+        elif context.local_repodata_ttl == 1:
+            return get_cache_control_max_age(mod_etag_headers.get('_cache_control', ''))
+        else:
+            return 0
+
+    def _refresh_cache(self, have_cache):
+        mod_etag_headers = read_mod_and_etag(self.cache_path_headers) if have_cache else {}
 
+        if context.use_repodata_patches and mod_etag_headers.get('_etag'):
+            _internal_state = self._update_from_patches(mod_etag_headers)
+            if _internal_state is not None:
+                return _internal_state
+
+        # taken before reading, so that a change made while reading is seen by the next load
+        file_stamp = self._local_repodata_stamp()
         try:
-            raw_repodata_str = fetch_repodata_remote_request(self.url_w_credentials,
-                                                             mod_etag_headers.get('_etag'),
-                                                             mod_etag_headers.get('_mod'))
+            raw_repodata_str, saved_fields = fetch_repodata_remote_request(
+                self.url_w_credentials, mod_etag_headers.get('_etag'), mod_etag_headers.get('_mod')
+            )
         except Response304ContentUnchanged:
             log.debug("304 NOT MODIFIED for '%s'. Updating mtime and loading from disk",
                       self.url_w_subdir)
-            touch(self.cache_path_json)
+            touch(self.cache_path_headers)
             _internal_state = self._read_local_repdata(mod_etag_headers.get('_etag'),
                                                        mod_etag_headers.get('_mod'))
             return _internal_state
         else:
-            if not isdir(dirname(self.cache_path_json)):
-                mkdir_p(dirname(self.cache_path_json))
-            try:
-                with io_open(self.cache_path_json, 'w') as fh:
-                    fh.write(raw_repodata_str or '{}')
-            except (IOError, OSError) as e:
-                if e.errno in (EACCES, EPERM):
-                    raise NotWritableError(self.cache_path_json, e.errno, caused_by=e)
-                else:
-                    raise
-            _internal_state = self._process_raw_repodata_str(raw_repodata_str)
+            if file_stamp:
+                saved_fields['_file_stamp'] = file_stamp
+            self._write_cache(raw_repodata_str, saved_fields)
+            _internal_state = self._process_raw_repodata_str(raw_repodata_str, saved_fields)
             self._internal_state = _internal_state
-            self._pickle_me()
+            self._save_index()
             return _internal_state
 
-    def _pickle_me(self):
+    def _local_repodata_stamp(self):
+        # identifies the current version of a file:// channel's repodata.json
+        if not self.url_w_subdir.startswith('file://'):
+            return None
+        try:
+            st = os.stat(url_to_path(join_url(self.url_w_subdir, 'repodata.json')))
+        except (IOError, OSError):
+            return None
+        return "%r:%d:%d" % (st.st_mtime, st.st_size, st.st_ino)
+
+    def _update_from_patches(self, mod_etag_headers):
+        # Returns None whenever the cache can't be brought up to date this way, in which
+        # case the caller falls back to downloading the full repodata.
+        etag, mod_stamp = mod_etag_headers['_etag'], mod_etag_headers.get('_mod')
+        patches = fetch_repodata_patches(self.url_w_credentials, etag)
+        if patches is None:
+            return None
+        operations, saved_fields = patches
+
+        if saved_fields['_etag'] == etag:
+            log.debug("Repodata patches for %s show no changes. Updating mtime and loading "
+                      "from disk", self.url_w_subdir)
+            touch(self.cache_path_headers)
+            return self._read_local_repdata(etag, mod_stamp)
+
+        # The cached document is decoded once; the patched document is both written back to
+        # the cache and indexed directly, without being parsed again.
+        with gzip.open(self.cache_path_json, 'rb') as fh:
+            repodata = json.loads(ensure_text_type(fh.read()))
+        try:
+            apply_repodata_patch(repodata, operations)
+        except (KeyError, TypeError, ValueError) as e:
+            log.debug("Unable to apply repodata patches to %s (%r)", self.cache_path_json, e)
+            return None
+        log.debug("Applied %d repodata patch operations to %s",
+                  len(operations), self.cache_path_json)
+
+        self._write_cache(json.dumps(repodata), saved_fields)
+        _internal_state = self._process_repodata(repodata, saved_fields)
+        self._save_index()
+        return _internal_state
+
+    def _write_cache(self, raw_repodata_str, saved_fields):
+        # The repodata is stored gzip-compressed, as downloaded.  The HTTP headers needed to
+        # revalidate it are kept in a small separate file, so that revalidation never has
+        # to read the repodata itself.
+        if self._shards_unavailable:
+            # kept with the headers, so the manifest isn't requested again until the
+            # repodata itself has to be revalidated
+            saved_fields = dict(saved_fields, _no_shards=True)
+        if not isdir(dirname(self.cache_path_json)):
+            mkdir_p(dirname(self.cache_path_json))
         try:
-            log.debug("Saving pickled state for %s at %s", self.url_w_subdir, self.cache_path_json)
-            with open(self.cache_path_pickle, 'wb') as fh:
-                pickle.dump(self._internal_state, fh, -1)  # -1 means HIGHEST_PROTOCOL
+            with atomic_write_path(self.cache_path_json) as tmp_path:
+                with gzip.open(tmp_path, 'wb', compresslevel=1) as fh:
+                    fh.write(ensure_binary(raw_repodata_str or '{}'))
+            with atomic_write_path(self.cache_path_headers) as tmp_path:
+                with io_open(tmp_path, 'w') as fh:
+                    fh.write(ensure_text_type(json.dumps(saved_fields)))
+        except (IOError, OSError) as e:
+            if e.errno in (EACCES, EPERM):
+                raise NotWritableError(e.filename or self.cache_path_json, e.errno,
+                                       caused_by=e)
+            else:
+                raise
+
+    def _save_index(self):
+        self._close_index(keep=self._internal_state['_raw_names_index'])
+        try:
+            log.debug("Saving repodata index for %s at %s", self.url_w_subdir,
+                      self.cache_path_index)
+            with atomic_write_path(self.cache_path_index) as tmp_path:
+                if context.repodata_cache_backend == RepodataCacheBackend.SQLITE:
+                    write_repodata_sqlite(tmp_path, self._internal_state)
+                else:
+                    write_repodata_index(tmp_path, self._internal_state)
         except Exception:
-            log.debug("Failed to dump pickled repodata.", exc_info=True)
+            log.debug("Failed to write repodata index %s", self.cache_path_index,
+                      exc_info=True)
 
     def _read_local_repdata(self, etag, mod_stamp):
-        # first try reading pickled data
-        _pickled_state = self._read_pickled(etag, mod_stamp)
-        if _pickled_state:
-            return _pickled_state
+        # first try the binary index
+        _index_state = self._read_index(etag, mod_stamp)
+        if _index_state:
+            return _index_state
 
-        # pickled data is bad or doesn't exist; load cached json
+        # the index is bad or doesn't exist; load cached json
         log.debug("Loading raw json for %s at %s", self.url_w_subdir, self.cache_path_json)
-        with open(self.cache_path_json) as fh:
+        with gzip.open(self.cache_path_json, 'rb') as fh:
             try:
-                raw_repodata_str = fh.read()
-            except ValueError as e:
+                raw_repodata_str = ensure_text_type(fh.read())
+            except (IOError, ValueError) as e:
                 # ValueError: Expecting object: line 11750 column 6 (char 303397)
                 log.debug("Error for cache path: '%s'\n%r", self.cache_path_json, e)
                 message = dals("""
@@ -268,53 +593,129 @@ class SubdirData(object):
                 """)
                 raise CondaError(message)
             else:
-                _internal_state = self._process_raw_repodata_str(raw_repodata_str)
+                _internal_state = self._process_raw_repodata_str(
+                    raw_repodata_str, read_mod_and_etag(self.cache_path_headers)
+                )
                 self._internal_state = _internal_state
-                self._pickle_me()
+                self._save_index()
                 return _internal_state
 
-    def _read_pickled(self, etag, mod_stamp):
+    def _read_index(self, etag, mod_stamp):
 
-        if not isfile(self.cache_path_pickle) or not isfile(self.cache_path_json):
-            # Don't trust pickled data if there is no accompanying json data
+        if not isfile(self.cache_path_index) or not isfile(self.cache_path_json):
+            # Don't trust the index if there is no accompanying json data
             return None
 
         try:
-            if isfile(self.cache_path_pickle):
-                log.debug("found pickle file %s", self.cache_path_pickle)
-            with open(self.cache_path_pickle, 'rb') as fh:
-                _pickled_state = pickle.load(fh)
+            log.debug("found repodata index %s", self.cache_path_index)
+            if context.repodata_cache_backend == RepodataCacheBackend.SQLITE:
+                mapped_index = SqliteRepodataIndex(self.cache_path_index)
+            else:
+                mapped_index = MappedRepodataIndex(self.cache_path_index)
         except Exception:
-            log.debug("Failed to load pickled repodata.", exc_info=True)
-            rm_rf(self.cache_path_pickle)
+            log.debug("Failed to load repodata index.", exc_info=True)
+            rm_rf(self.cache_path_index)
             return None
 
-        def _check_pickled_valid():
-            yield _pickled_state.get('_url') == self.url_w_credentials
-            yield _pickled_state.get('_schannel') == self.channel.canonical_name
-            yield _pickled_state.get('_add_pip') == context.add_pip_as_python_dependency
-            yield _pickled_state.get('_mod') == mod_stamp
-            yield _pickled_state.get('_etag') == etag
-            yield _pickled_state.get('_pickle_version') == REPODATA_PICKLE_VERSION
+        index_meta = mapped_index.meta
 
-        if not all(_check_pickled_valid()):
-            log.debug("Pickle load validation failed for %s at %s.",
+        def _check_index_valid():
+            yield index_meta.get('_url') == self.url_w_credentials
+            yield index_meta.get('_schannel') == self.channel.canonical_name
+            yield index_meta.get('_add_pip') == context.add_pip_as_python_dependency
+            yield index_meta.get('_mod') == mod_stamp
+            yield index_meta.get('_etag') == etag
+            yield mapped_index.format_version == REPODATA_INDEX_VERSION
+
+        if not all(_check_index_valid()):
+            log.debug("Repodata index validation failed for %s at %s.",
                       self.url_w_subdir, self.cache_path_json)
+            mapped_index.close()
             return None
 
-        return _pickled_state
+        _internal_state = dict(index_meta)
+        _internal_state.update({
+            'channel': self.channel,
+            'url_w_subdir': self.url_w_subdir,
+            'url_w_credentials': self.url_w_credentials,
+            'cache_path_base': self.cache_path_base,
 
-    def _process_raw_repodata_str(self, raw_repodata_str):
-        json_obj = json.loads(raw_repodata_str or '{}')
+            '_raw_names_index': mapped_index,
+            '_meta_in_common': intern_package_info(dict(index_meta['_meta_in_common'],
+                                                        channel=self.channel),
+                                                   self._intern_pool),
+        })
+        return _internal_state
 
-        subdir = json_obj.get('info', {}).get('subdir') or self.channel.subdir
-        assert subdir == self.channel.subdir
+    def _process_raw_repodata_str(self, raw_repodata_str, saved_fields=None):
+        # The repodata document is walked member by member rather than decoded as a whole.
+        # Each entry of 'packages' is decoded and indexed before the next one is touched,
+        # so the fully-decoded document never exists in memory.  Entries are kept in their
+        # raw form, grouped by name; PackageRecords are created on demand by query().
+        return self._process_repodata_members(
+            json_iter_object(raw_repodata_str or '{}', stream_keys=('packages',)),
+            saved_fields,
+        )
+
+    def _process_repodata(self, repodata, saved_fields=None):
+        # Same as _process_raw_repodata_str(), for a document that's already decoded.
+        def iter_members():
+            for key, value in iteritems(repodata):
+                if key == 'packages':
+                    for fn, info in iteritems(value or {}):
+                        yield key, fn, info
+                else:
+                    yield key, None, value
+        return self._process_repodata_members(iter_members(), saved_fields)
+
+    def _process_repodata_members(self, members, saved_fields):
+        # members are (key, None, value) for the top-level members of a repodata document,
+        # and ('packages', fn, info) for each of its package entries
         add_pip = context.add_pip_as_python_dependency
         schannel = self.channel.canonical_name
 
-        self._package_records = _package_records = []
-        self._names_index = _names_index = defaultdict(list)
-        self._track_features_index = _track_features_index = defaultdict(list)
+        self._close_index()
+        self._raw_names_index = _raw_names_index = defaultdict(list)
+        self._track_features_index = _track_features_index = defaultdict(set)
+
+        repodata_meta = {}
+        deferred_packages = []
+
+        for key, fn, value in members:
+            if fn is None:
+                repodata_meta[key] = value
+                if key == 'repodata_version':
+                    self._check_repodata_version(value)
+            elif 'info' in repodata_meta:
+                self._index_raw_package(fn, value, _raw_names_index, _track_features_index,
+                                        add_pip)
+            else:
+                # 'info' may still follow 'packages'; hold these entries until it's known
+                deferred_packages.append((fn, value))
+
+        if saved_fields is None:
+            # older caches carried the HTTP headers as members of the repodata document
+            saved_fields = repodata_meta
+        info = repodata_meta.get('info') or {}
+        subdir = info.get('subdir') or self.channel.subdir
+        assert subdir == self.channel.subdir
+        for fn, package_info in deferred_packages:
+            self._index_raw_package(fn, package_info, _raw_names_index, _track_features_index,
+                                    add_pip)
+        del deferred_packages[:]
+
+        self._meta_in_common = meta_in_common = intern_package_info({  # applied with .update()
+            'arch': info.get('arch'),
+            'channel': self.channel,
+            'platform': info.get('platform'),
+            'schannel': schannel,
+            'subdir': subdir,
+        }, self._intern_pool)
+        self._raw_names_index = _raw_names_index = dict(_raw_names_index)
+        self._track_features_index = _track_features_index = {
+            ftr_name: sorted(names) for ftr_name, names in iteritems(_track_features_index)
+        }
+        self._reset_materialized_records()
 
         _internal_state = {
             'channel': self.channel,
@@ -322,20 +723,44 @@ class SubdirData(object):
             'url_w_credentials': self.url_w_credentials,
             'cache_path_base': self.cache_path_base,
 
-            '_package_records': _package_records,
-            '_names_index': _names_index,
+            '_raw_names_index': _raw_names_index,
             '_track_features_index': _track_features_index,
+            '_meta_in_common': meta_in_common,
 
-            '_etag': json_obj.get('_etag'),
-            '_mod': json_obj.get('_mod'),
-            '_cache_control': json_obj.get('_cache_control'),
-            '_url': json_obj.get('_url'),
+            '_etag': saved_fields.get('_etag'),
+            '_mod': saved_fields.get('_mod'),
+            '_cache_control': saved_fields.get('_cache_control'),
+            '_url': saved_fields.get('_url'),
+            '_file_stamp': saved_fields.get('_file_stamp'),
             '_add_pip': add_pip,
-            '_pickle_version': REPODATA_PICKLE_VERSION,
             '_schannel': schannel,
-            'repodata_version': json_obj.get('repodata_version', 0),
+            'repodata_version': repodata_meta.get('repodata_version', 0),
         }
-        if _internal_state["repodata_version"] > MAX_REPODATA_VERSION:
+
+        self._internal_state = _internal_state
+        return _internal_state
+
+    def _index_raw_package(self, fn, info, raw_names_index, track_features_index, add_pip):
+        if info.get('record_version', 0) > 1:
+            log.debug("Ignoring record_version %d from %s",
+                      info["record_version"], join_url(self.url_w_subdir, fn))
+            return
+        if add_pip and info['name'] == 'python' and info['version'].startswith(('2.', '3.')):
+            info['depends'].append('pip')
+        intern_package_info(info, self._intern_pool)
+        name = info['name']
+        raw_names_index[name].append((fn, info))
+        track_features = info.get('track_features')
+        if track_features:
+            if isinstance(track_features, string_types):
+                track_features = track_features.replace(' ', ',').split(',')
+            for ftr_name in track_features:
+                ftr_name = ftr_name.strip()
+                if ftr_name:
+                    track_features_index[ftr_name].add(name)
+
+    def _check_repodata_version(self, repodata_version):
+        if repodata_version > MAX_REPODATA_VERSION:
             raise CondaUpgradeError(dals("""
                 The current version of conda is too old to read repodata from
 
@@ -345,54 +770,434 @@ class SubdirData(object):
                 Please update conda to use this channel.
                 """) % self.url_w_subdir)
 
-        meta_in_common = {  # just need to make this once, then apply with .update()
-            'arch': json_obj.get('info', {}).get('arch'),
-            'channel': self.channel,
-            'platform': json_obj.get('info', {}).get('platform'),
-            'schannel': schannel,
-            'subdir': subdir,
-        }
 
-        channel_url = self.url_w_credentials
-        for fn, info in iteritems(json_obj.get('packages', {})):
-            info['fn'] = fn
-            info['url'] = join_url(channel_url, fn)
-            if add_pip and info['name'] == 'python' and info['version'].startswith(('2.', '3.')):
-                info['depends'].append('pip')
-            info.update(meta_in_common)
-            if info.get('record_version', 0) > 1:
-                log.debug("Ignoring record_version %d from %s",
-                          info["record_version"], info['url'])
+class RepodataColumns(object):
+    """Column-oriented view of a sequence of PackageRecords, typically all those of one
+    package name.  SubdirData builds one for a name the first time that name is queried,
+    and keeps it for later queries of the same name.
+
+    Row ``i`` describes the ``i``-th record.  The version, build and
+    build_number columns are dictionary-encoded: each keeps its distinct values once, plus
+    an array with the code of every row's value.  A MatchSpec component is then evaluated
+    once per distinct value, and the result spread over the rows through the codes, rather
+    than evaluated for every record.
+
+    >>> columns = RepodataColumns([
+    ...     PackageRecord(name='a', version='1.0', build='0', build_number=0),
+    ...     PackageRecord(name='a', version='1.0', build='1', build_number=1),
+    ...     PackageRecord(name='a', version='2.0', build='0', build_number=0),
+    ... ])
+    >>> columns.values['version'], list(columns.codes['version'])
+    (['1.0', '2.0'], [0, 0, 1])
+    >>> columns.select(MatchSpec('a >=1.0', build_number='>0'))
+    [1]
+    """
+    ENCODED_FIELDS = ('version', 'build', 'build_number')
+
+    def __init__(self, records):
+        self.values = dict((field, []) for field in self.ENCODED_FIELDS)
+        self.codes = dict((field, array(str('I'))) for field in self.ENCODED_FIELDS)
+        value_codes = dict((field, {}) for field in self.ENCODED_FIELDS)
+        for prec in records:
+            for field in self.ENCODED_FIELDS:
+                value = getattr(prec, field)
+                code = value_codes[field].get(value)
+                if code is None:
+                    code = value_codes[field][value] = len(self.values[field])
+                    self.values[field].append(value)
+                self.codes[field].append(code)
+
+    def __len__(self):
+        return len(self.codes['version'])
+
+    def covers(self, spec):
+        """True if select() alone decides whether a record of this name matches ``spec``."""
+        return all(field == 'name' or field in self.ENCODED_FIELDS
+                   for field in spec._match_components)
+
+    def select(self, spec):
+        """Return the positions of the rows whose version, build and build_number match
+        ``spec``.  Other components of ``spec`` are not checked."""
+        positions = range(len(self))
+        for field in self.ENCODED_FIELDS:
+            component = spec._match_components.get(field)
+            if component is None:
                 continue
-            package_record = PackageRecord(**info)
+            mask = [_match_component(component, value) for value in self.values[field]]
+            codes = self.codes[field]
+            positions = [i for i in positions if mask[codes[i]]]
+        return list(positions)
 
-            _package_records.append(package_record)
-            _names_index[package_record.name].append(package_record)
-            for ftr_name in package_record.track_features:
-                _track_features_index[ftr_name].append(package_record)
 
-        self._internal_state = _internal_state
-        return _internal_state
+def _match_component(match_component, value):
+    # same as MatchSpec._match_individual(), for a bare value
+    try:
+        return match_component.match(value)
+    except AttributeError:
+        return match_component == value
 
 
-def read_mod_and_etag(path):
-    with open(path, 'rb') as f:
+class ShardedRepodataIndex(Mapping):
+    """A ``{name: [(fn, info), ...]}`` mapping over a channel subdir whose repodata is split
+    into one shard per package name.  Such a subdir publishes a ``repodata_shards.json``
+    manifest next to its repodata.json::
+
+        {
+          "info": {"subdir": "linux-64"},
+          "repodata_version": 1,
+          "shards": {"<name>": "<path of the shard, relative to the subdir>", ...},
+          "track_features": {"<feature>": ["<name>", ...], ...}
+        }
+
+    Each shard is a ``{"packages": {"<fn>": {...}, ...}}`` document holding the repodata
+    entries for one package name.  The manifest lists every name, so the keys of this mapping
+    are known up front; a name's shard is only fetched, or read from its own cache, when the
+    name is first looked up.
+    """
+
+    def __init__(self, subdir_data, shards):
+        self._subdir_data = subdir_data
+        self._shards = shards
+
+    def shard_cache_path(self, name):
+        shard_fn = self._shards[name]
+        return join(self._subdir_data.cache_path_shards,
+                    '%s.json' % hashlib.md5(ensure_binary(shard_fn)).hexdigest()[:16])
+
+    def __getitem__(self, name):
+        sd = self._subdir_data
+        shard = fetch_cached_json(sd.url_w_credentials, self._shards[name],
+                                  self.shard_cache_path(name)) or {}
+        raw_names_index = defaultdict(list)
+        add_pip = context.add_pip_as_python_dependency
+        for fn, info in iteritems(shard.get('packages') or {}):
+            if info.get('name') == name:
+                sd._index_raw_package(fn, info, raw_names_index, defaultdict(set), add_pip)
+        return raw_names_index[name]
+
+    def __contains__(self, name):
+        return name in self._shards
+
+    def __iter__(self):
+        return iter(self._shards)
+
+    def __len__(self):
+        return len(self._shards)
+
+
+REPODATA_INDEX_MAGIC = b'CONDAIDX'
+# magic, format version, length of the json-encoded metadata block
+_INDEX_HEADER = struct.Struct(str('<8sII'))
+# name offset, name length, data offset, data length; one entry per package name, sorted by
+# the utf-8 encoded name so lookups can bisect the table in place
+_INDEX_ENTRY = struct.Struct(str('<QIQI'))
+_INDEX_META_KEYS = ('_url', '_etag', '_mod', '_cache_control', '_file_stamp', '_add_pip',
+                    '_schannel', 'repodata_version', '_track_features_index')
+
+
+def write_repodata_index(path, internal_state):
+    """Write the raw repodata entries of a SubdirData state to a binary index file.
+
+    Layout: header, json metadata, name table, names, then one json blob per package name
+    holding that name's ``[fn, info]`` entries.  Blobs are written in the order the names
+    first appear in the repodata, and are read back one name at a time through
+    MappedRepodataIndex.
+    """
+    raw_names_index = internal_state['_raw_names_index']
+    names = [ensure_binary(name) for name in raw_names_index]
+    meta = dict((key, internal_state.get(key)) for key in _INDEX_META_KEYS)
+    meta['_meta_in_common'] = dict((key, value) for key, value
+                                   in iteritems(internal_state['_meta_in_common'])
+                                   if key != 'channel')
+    meta['name_count'] = len(names)
+    meta_bytes = ensure_binary(json.dumps(meta))
+
+    table_offset = _INDEX_HEADER.size + len(meta_bytes)
+    names_offset = table_offset + _INDEX_ENTRY.size * len(names)
+    name_offsets = []
+    data_offset = names_offset
+    for name in names:
+        name_offsets.append(data_offset)
+        data_offset += len(name)
+
+    with open(path, 'wb') as fh:
+        fh.write(_INDEX_HEADER.pack(REPODATA_INDEX_MAGIC, REPODATA_INDEX_VERSION,
+                                    len(meta_bytes)))
+        fh.write(meta_bytes)
+        fh.write(b'\0' * (_INDEX_ENTRY.size * len(names)))
+        for name in names:
+            fh.write(name)
+        entries = []
+        for name, name_offset, raw_entries in zip(names, name_offsets,
+                                                  itervalues(raw_names_index)):
+            blob = ensure_binary(json.dumps(raw_entries, separators=(',', ':')))
+            fh.write(blob)
+            entries.append((name, name_offset, data_offset, len(blob)))
+            data_offset += len(blob)
+        entries.sort()
+        fh.seek(table_offset)
+        for name, name_offset, blob_offset, blob_len in entries:
+            fh.write(_INDEX_ENTRY.pack(name_offset, len(name), blob_offset, blob_len))
+
+
+class MappedRepodataIndex(Mapping):
+    """Read-only ``{name: [[fn, info], ...]}`` mapping over a file written by
+    write_repodata_index.
+
+    The file is memory-mapped and only the header is decoded up front; each lookup bisects
+    the name table and decodes the entries for that single name.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as fh:
+            self._mmap = mmap(fh.fileno(), 0, access=ACCESS_READ)
+        try:
+            magic, self.format_version, meta_len = _INDEX_HEADER.unpack_from(self._mmap, 0)
+            if magic != REPODATA_INDEX_MAGIC:
+                raise ValueError("%s is not a repodata index" % path)
+            meta_offset = _INDEX_HEADER.size
+            self.meta = json.loads(ensure_text_type(
+                self._mmap[meta_offset:meta_offset + meta_len]
+            ))
+        except Exception:
+            self.close()
+            raise
+        self._table_offset = meta_offset + meta_len
+        self._name_count = self.meta['name_count']
+
+    def close(self):
+        self._mmap.close()
+
+    def _entry(self, k):
+        return _INDEX_ENTRY.unpack_from(self._mmap, self._table_offset + k * _INDEX_ENTRY.size)
+
+    def _find(self, name):
+        name = ensure_binary(name)
+        mm = self._mmap
+        lo, hi = 0, self._name_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            name_offset, name_len, data_offset, data_len = self._entry(mid)
+            this_name = mm[name_offset:name_offset + name_len]
+            if this_name < name:
+                lo = mid + 1
+            elif this_name > name:
+                hi = mid
+            else:
+                return data_offset, data_len
+        return None
+
+    def __getitem__(self, name):
+        found = self._find(name)
+        if found is None:
+            raise KeyError(name)
+        data_offset, data_len = found
+        return json.loads(ensure_text_type(self._mmap[data_offset:data_offset + data_len]))
+
+    def __contains__(self, name):
+        return self._find(name) is not None
+
+    def __iter__(self):
+        mm = self._mmap
+        entries = sorted((data_offset, name_offset, name_len) for name_offset, name_len,
+                         data_offset, _ in (self._entry(k) for k in range(self._name_count)))
+        for _, name_offset, name_len in entries:
+            yield ensure_text_type(mm[name_offset:name_offset + name_len])
+
+    def __len__(self):
+        return self._name_count
+
+
+def write_repodata_sqlite(path, internal_state):
+    """Write the raw repodata entries of a SubdirData state to a SQLite database.
+
+    Each package is one row of the ``packages`` table, indexed by name and sha256, and each
+    of its track_features is a row of the ``track_features`` table.
+    """
+    import sqlite3
+    rm_rf(path)
+    meta = dict((key, internal_state.get(key)) for key in _INDEX_META_KEYS
+                if key != '_track_features_index')
+    meta['_meta_in_common'] = dict((key, value) for key, value
+                                   in iteritems(internal_state['_meta_in_common'])
+                                   if key != 'channel')
+
+    def package_rows():
+        seq = 0
+        for name, raw_entries in iteritems(internal_state['_raw_names_index']):
+            for fn, info in raw_entries:
+                yield seq, fn, name, info.get('sha256'), json.dumps(info, separators=(',', ':'))
+                seq += 1
+
+    def track_features_rows():
+        for ftr_name, names in iteritems(internal_state['_track_features_index']):
+            for name in names:
+                yield ftr_name, name
+
+    with closing(sqlite3.connect(path)) as conn:
+        conn.executescript("""
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE packages (seq INTEGER PRIMARY KEY, fn TEXT NOT NULL, name TEXT NOT NULL,
+                                   sha256 TEXT, info TEXT NOT NULL);
+            CREATE TABLE track_features (feature TEXT NOT NULL, name TEXT NOT NULL);
+        """)
+        conn.executemany("INSERT INTO meta VALUES (?, ?)",
+                         ((key, json.dumps(value)) for key, value in iteritems(meta)))
+        conn.executemany("INSERT INTO packages VALUES (?, ?, ?, ?, ?)", package_rows())
+        conn.executemany("INSERT INTO track_features VALUES (?, ?)", track_features_rows())
+        conn.executescript("""
+            CREATE INDEX packages_name ON packages (name);
+            CREATE INDEX packages_sha256 ON packages (sha256);
+            CREATE INDEX track_features_feature ON track_features (feature);
+        """)
+        conn.execute("PRAGMA user_version = %d" % REPODATA_INDEX_VERSION)
+        conn.commit()
+
+
+class SqliteRepodataIndex(Mapping):
+    """Read-only ``{name: [[fn, info], ...]}`` mapping over a database written by
+    write_repodata_sqlite.
+
+    Lookups by name, track_feature, sha256, and name glob pattern are indexed SQL queries.
+    """
+
+    def __init__(self, path):
+        import sqlite3
+        from threading import Lock
+        if not isfile(path):
+            raise IOError("%s does not exist" % path)
+        # SubdirData.query may be called from any thread of the query_all executor
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = Lock()
         try:
-            with closing(mmap(f.fileno(), 0, access=ACCESS_READ)) as m:
-                match_objects = take(3, re.finditer(REPODATA_HEADER_RE, m))
-                result = dict(map(ensure_unicode, mo.groups()) for mo in match_objects)
-                return result
-        except (BufferError, ValueError, OSError):  # pragma: no cover
-            # BufferError: cannot close exported pointers exist
-            #   https://github.com/conda/conda/issues/4592
-            # ValueError: cannot mmap an empty file
-            return {}
-        except (IOError, OSError) as e:  # pragma: no cover
-            # OSError: [Errno 19] No such device
-            if e.errno == ENODEV:
-                return {}
+            self.format_version = self._execute("PRAGMA user_version")[0][0]
+            self.meta = dict((key, json.loads(value))
+                             for key, value in self._execute("SELECT key, value FROM meta"))
+            self.meta['_track_features_index'] = self.track_features_index()
+        except Exception:
+            self.close()
             raise
 
+    def close(self):
+        self._conn.close()
+
+    def _execute(self, sql, parameters=()):
+        with self._lock:
+            return self._conn.execute(sql, parameters).fetchall()
+
+    def track_features_index(self):
+        result = defaultdict(list)
+        for ftr_name, name in self._execute("SELECT DISTINCT feature, name FROM track_features "
+                                            "ORDER BY feature, name"):
+            result[ftr_name].append(name)
+        return dict(result)
+
+    def glob_names(self, pattern):
+        return [name for name, in self._execute(
+            "SELECT name FROM packages WHERE name GLOB ? GROUP BY name ORDER BY MIN(seq)",
+            (pattern,)
+        )]
+
+    def get_by_sha256(self, sha256):
+        return [[fn, json.loads(info)] for fn, info in self._execute(
+            "SELECT fn, info FROM packages WHERE sha256 = ? ORDER BY seq", (sha256,)
+        )]
+
+    def __getitem__(self, name):
+        rows = self._execute("SELECT fn, info FROM packages WHERE name = ? ORDER BY seq", (name,))
+        if not rows:
+            raise KeyError(name)
+        return [[fn, json.loads(info)] for fn, info in rows]
+
+    def __contains__(self, name):
+        return bool(self._execute("SELECT 1 FROM packages WHERE name = ? LIMIT 1", (name,)))
+
+    def __iter__(self):
+        return iter([name for name, in self._execute(
+            "SELECT name FROM packages GROUP BY name ORDER BY MIN(seq)"
+        )])
+
+    def __len__(self):
+        return self._execute("SELECT COUNT(DISTINCT name) FROM packages")[0][0]
+
+
+@contextmanager
+def atomic_write_path(path):
+    """Yield a temporary path to write in place of ``path``, and move the finished file
+    over ``path`` in a single rename.
+
+    Readers see either the old file or the complete new one, never a partial write.
+    """
+    tmp_path = "%s.%s.tmp" % (path, uuid4().hex[:8])
+    try:
+        yield tmp_path
+        backoff_rename(tmp_path, path, force=on_win)
+    finally:
+        if lexists(tmp_path):
+            rm_rf(tmp_path)
+
+
+def read_mod_and_etag(path):
+    """Read the HTTP headers saved alongside a cached repodata.json."""
+    try:
+        with open(path) as fh:
+            saved_fields = json.load(fh)
+    except (IOError, OSError, ValueError) as e:
+        log.debug("Unable to read repodata headers from %s (%r)", path, e)
+        return {}
+    if not isinstance(saved_fields, dict):
+        return {}
+    return dict((key, saved_fields[key]) for key in REPODATA_HEADER_KEYS[1:]
+                if saved_fields.get(key))
+
+
+def fetch_cached_json(url, filename, cache_path, revalidate=False):
+    """Return the decoded JSON document ``filename`` of the channel subdir at ``url``, or
+    None if the channel doesn't have it.
+
+    The document is cached at ``cache_path`` together with its HTTP headers, and is
+    revalidated with the channel once it expires, just as a subdir's repodata.json is.
+    """
+    try:
+        mtime = getmtime(cache_path)
+        with open(cache_path) as fh:
+            cached = json.load(fh)
+    except (IOError, OSError, ValueError):
+        mtime, cached = None, None
+    if not isinstance(cached, dict) or 'document' not in cached:
+        cached = None
+
+    if cached is not None and not revalidate:
+        timeout = mtime + SubdirData._cache_max_age(cached) - time()
+        if timeout > 0 or context.offline or context.use_index_cache:
+            return cached['document']
+    if context.offline and not url.startswith('file://'):
+        return cached and cached['document']
+
+    headers = cached or {}
+    try:
+        json_str, saved_fields = fetch_repodata_remote_request(
+            url, headers.get('_etag'), headers.get('_mod'), repodata_fn=filename
+        )
+    except Response304ContentUnchanged:
+        log.debug("304 NOT MODIFIED for '%s'. Updating mtime and loading from disk",
+                  join_url(url, filename))
+        touch(cache_path)
+        return cached['document']
+    if json_str is None:
+        return None
+
+    saved_fields['document'] = document = json.loads(json_str)
+    try:
+        if not isdir(dirname(cache_path)):
+            mkdir_p(dirname(cache_path))
+        with atomic_write_path(cache_path) as tmp_path:
+            with io_open(tmp_path, 'w') as fh:
+                fh.write(ensure_text_type(json.dumps(saved_fields)))
+    except (IOError, OSError) as e:
+        log.debug("Unable to cache %s at %s (%r)", join_url(url, filename), cache_path, e)
+    return document
+
 
 def get_cache_control_max_age(cache_control_value):
     max_age = re.search(r"max-age=(\d+)", cache_control_value)
@@ -403,7 +1208,13 @@ class Response304ContentUnchanged(Exception):
     pass
 
 
-def fetch_repodata_remote_request(url, etag, mod_stamp):
+def fetch_repodata_remote_request(url, etag, mod_stamp, repodata_fn=None):
+    """Download the repodata.json for the channel subdir at ``url``, or the other JSON
+    document ``repodata_fn`` of that subdir.
+
+    Returns ``(json_str, saved_fields)``, where saved_fields holds the HTTP headers needed to
+    revalidate the download later.  json_str is None if the subdir or document doesn't exist.
+    """
     if not context.ssl_verify:
         warnings.simplefilter('ignore', InsecureRequestWarning)
 
@@ -415,7 +1226,11 @@ def fetch_repodata_remote_request(url, etag, mod_stamp):
     if mod_stamp:
         headers["If-Modified-Since"] = mod_stamp
 
-    if 'repo.anaconda.com' in url:
+    if repodata_fn:
+        headers['Accept-Encoding'] = 'gzip, deflate, compress, identity'
+        headers['Content-Type'] = 'application/json'
+        filename = repodata_fn
+    elif 'repo.anaconda.com' in url:
         filename = 'repodata.json.bz2'
         headers['Accept-Encoding'] = 'identity'
     else:
@@ -447,14 +1262,16 @@ def fetch_repodata_remote_request(url, etag, mod_stamp):
         # status_code might not exist on SSLError
         status_code = getattr(e.response, 'status_code', None)
         if status_code in (403, 404):
-            if not url.endswith('/noarch'):
-                log.info("Unable to retrieve repodata (%d error) for %s", status_code, url)
-                return None
+            if repodata_fn or not url.endswith('/noarch'):
+                # only a missing noarch repodata.json means the channel itself is invalid
+                log.info("Unable to retrieve %s (%d error) for %s",
+                         filename, status_code, url)
+                return None, {'_url': url}
             else:
                 if context.allow_non_channel_urls:
                     stderrlog.warning("Unable to retrieve repodata (%d error) for %s",
                                       status_code, url)
-                    return None
+                    return None, {'_url': url}
                 else:
                     raise UnavailableInvalidChannel(Channel(dirname(url)), status_code)
 
@@ -548,16 +1365,148 @@ def fetch_repodata_remote_request(url, etag, mod_stamp):
     add_http_value_to_dict(resp, 'Etag', saved_fields, '_etag')
     add_http_value_to_dict(resp, 'Last-Modified', saved_fields, '_mod')
     add_http_value_to_dict(resp, 'Cache-Control', saved_fields, '_cache_control')
+    return json_str, saved_fields
 
-    # add extra values to the raw repodata json
-    if json_str and json_str != "{}":
-        raw_repodata_str = u"%s, %s" % (
-            json.dumps(saved_fields)[:-1],  # remove trailing '}'
-            json_str[1:]  # remove first '{'
-        )
-    else:
-        raw_repodata_str = ensure_text_type(json.dumps(saved_fields))
-    return raw_repodata_str
+
+def fetch_repodata_patches(url, etag):
+    """Find the patches that bring the repodata identified by ``etag`` up to date.
+
+    A channel subdir may publish a ``repodata_patches.json`` file next to its repodata.json::
+
+        {
+          "latest": "<etag of the current repodata.json>",
+          "patches": [
+            {"from": "<etag>", "to": "<etag>", "mod": "<Last-Modified of 'to'>",
+             "patch": [<JSON patch operations>]},
+            ...
+          ]
+        }
+
+    Each ``patch`` is a list of RFC 6902 ``add``, ``remove`` and ``replace`` operations that
+    turns the repodata.json served with the ``from`` etag into the one served with the ``to``
+    etag.  Returns ``(operations, saved_fields)``, where operations is the concatenated
+    chain of patches from ``etag`` to the latest repodata, or None if no such chain exists.
+    """
+    if not context.ssl_verify:
+        warnings.simplefilter('ignore', InsecureRequestWarning)
+
+    session = CondaSession()
+    patches_url = join_url(url, REPODATA_PATCHES_FN)
+    try:
+        timeout = context.remote_connect_timeout_secs, context.remote_read_timeout_secs
+        resp = session.get(patches_url, proxies=session.proxies, timeout=timeout)
+        if log.isEnabledFor(DEBUG):
+            log.debug(stringify(resp, content_max_len=256))
+        resp.raise_for_status()
+        patches_json = resp.json()
+        latest = patches_json['latest']
+        patches_by_etag = dict((patch['from'], patch) for patch in patches_json['patches'])
+    except (ConnectionError, HTTPError, InvalidSchema, SSLError,
+            KeyError, TypeError, ValueError) as e:
+        log.debug("No usable repodata patches at %s (%r)", patches_url, e)
+        return None
+
+    operations = []
+    saved_fields = {'_url': url, '_etag': etag}
+    add_http_value_to_dict(resp, 'Cache-Control', saved_fields, '_cache_control')
+    while saved_fields['_etag'] != latest:
+        # each patch is used at most once, so a cycle in the chain ends the search
+        patch = patches_by_etag.pop(saved_fields['_etag'], None)
+        if patch is None:
+            log.debug("No repodata patch chain from etag %s to %s at %s",
+                      etag, latest, patches_url)
+            return None
+        operations.extend(patch['patch'])
+        saved_fields['_etag'] = patch['to']
+        saved_fields['_mod'] = patch.get('mod')
+    if saved_fields.get('_mod') is None:
+        saved_fields.pop('_mod', None)
+    return operations, saved_fields
+
+
+def apply_repodata_patch(repodata, operations):
+    """Apply JSON patch ``add``, ``remove`` and ``replace`` operations to a decoded
+    repodata document, in place.
+
+    Returns the set of package names whose entries were changed, or None if an operation
+    changed anything other than a single entry of ``packages``.
+
+    >>> repodata = {'packages': {'a-1-0.tar.bz2': {'name': 'a'}}}
+    >>> sorted(apply_repodata_patch(repodata, [
+    ...     {'op': 'remove', 'path': '/packages/a-1-0.tar.bz2'},
+    ...     {'op': 'add', 'path': '/packages/b-1-0.tar.bz2', 'value': {'name': 'b'}},
+    ... ]))
+    ['a', 'b']
+    >>> list(repodata['packages'])
+    ['b-1-0.tar.bz2']
+    """
+    changed_names = set()
+    only_packages_changed = True
+    for operation in operations:
+        op, path = operation['op'], operation['path']
+        keys = [key.replace('~1', '/').replace('~0', '~') for key in path.split('/')[1:]]
+        if not path.startswith('/') or not 1 <= len(keys) <= 2:
+            raise ValueError("unsupported repodata patch path %r" % path)
+        parent = repodata[keys[0]] if len(keys) == 2 else repodata
+        key = keys[-1]
+
+        if keys[0] == 'packages' and len(keys) == 2:
+            if key in parent:
+                changed_names.add(parent[key]['name'])
+            if op != 'remove':
+                changed_names.add(operation['value']['name'])
+        else:
+            only_packages_changed = False
+
+        if op == 'add':
+            parent[key] = operation['value']
+        elif op == 'replace':
+            if key not in parent:
+                raise KeyError(path)
+            parent[key] = operation['value']
+        elif op == 'remove':
+            del parent[key]
+        else:
+            raise ValueError("unsupported repodata patch operation %r" % op)
+    return changed_names if only_packages_changed else None
+
+
+def _close_raw_names_index(raw_names_index):
+    close = getattr(raw_names_index, 'close', None)
+    if close:
+        close()
+
+
+# Values that repeat across many packages of a subdir, and across subdirs.  Equal values are
+# replaced by one shared object, so that the loaded records don't each keep their own copy.
+_INTERNED_KEYS = ('name', 'version', 'build', 'license', 'license_family', 'noarch',
+                  'arch', 'platform', 'schannel', 'subdir')
+_INTERNED_SEQUENCE_KEYS = ('depends', 'constrains')
+
+
+def intern_package_info(info, pool):
+    """Replace the repeated values of a repodata package entry with the shared instances held
+    in the dict ``pool``, in place.
+
+    ``depends`` and ``constrains`` become pooled tuples of pooled strings.  Returns ``info``.
+
+    >>> pool = {}
+    >>> first = intern_package_info({'depends': ['python']}, pool)
+    >>> second = intern_package_info({'depends': [''.join(('py', 'thon'))]}, pool)
+    >>> first['depends'] is second['depends']
+    True
+    """
+    setdefault = pool.setdefault
+    for key in _INTERNED_KEYS:
+        value = info.get(key)
+        if isinstance(value, string_types):
+            info[key] = setdefault(value, value)
+    for key in _INTERNED_SEQUENCE_KEYS:
+        value = info.get(key)
+        if value:
+            value = tuple(setdefault(v, v) if isinstance(v, string_types) else v for v in value)
+            info[key] = setdefault(value, value)
+    return info
 
 
 def make_feature_record(feature_name):
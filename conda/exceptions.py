@@ -245,6 +245,7 @@ class CommandNotFoundError(CondaError):
             'install',
             'list',
             'package',
+            'refresh',
             'remove',
             'search',
             'uninstall',
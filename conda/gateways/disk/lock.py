@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Anaconda, Inc
+# SPDX-License-Identifier: BSD-3-Clause
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from contextlib import contextmanager
+from logging import getLogger
+import os
+
+from ...common.compat import on_win
+
+log = getLogger(__name__)
+
+if on_win:
+    from errno import EDEADLOCK
+    import msvcrt
+
+    def _lock(fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        while True:
+            try:
+                # LK_LOCK retries once a second, and gives up with EDEADLOCK after ten tries
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                return
+            except (IOError, OSError) as e:
+                if e.errno != EDEADLOCK:
+                    raise
+
+    def _unlock(fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+else:
+    import fcntl
+
+    def _lock(fd):
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+    def _unlock(fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+@contextmanager
+def file_lock(lock_path):
+    """Hold an exclusive advisory lock on ``lock_path`` for the duration of the block.
+
+    Blocks until any other process or thread holding the lock releases it.  The lock belongs
+    to an open file handle, so the operating system releases it if its holder dies.  When
+    the lock file can't be created, or the filesystem doesn't support locking, the block
+    runs without the lock.
+    """
+    fd = None
+    locked = False
+    try:
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o666)
+        _lock(fd)
+        locked = True
+    except (IOError, OSError) as e:
+        log.debug("Unable to lock %s (%r). Continuing without the lock.", lock_path, e)
+    try:
+        yield
+    finally:
+        if locked:
+            _unlock(fd)
+        if fd is not None:
+            os.close(fd)
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Anaconda, Inc
+# SPDX-License-Identifier: BSD-3-Clause
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import defaultdict
+from logging import getLogger
+
+from .._vendor.toolz import groupby
+from .version import VersionOrder
+from ..common.compat import iteritems, itervalues
+from ..exceptions import InvalidVersionSpec
+
+log = getLogger(__name__)
+
+
+class Index(dict):
+    """
+    A package index: a ``{prec: prec}`` dict that also keeps the lookups built over it.
+
+    The records are grouped by name and by track_feature, and mapped by sha256, the first
+    time each of those is asked for.  The name groups sorted by a given key are kept as
+    well, so that every Resolve over the same index shares them rather than sorting
+    everything again.  An index made with subset() orders its groups by their positions in
+    this index's sorted groups, so its cost follows the size of the subset.
+
+    Any change to the index drops what was built over it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(Index, self).__init__(*args, **kwargs)
+        self._parent = None
+        self._invalidate()
+
+    def _invalidate(self):
+        self._groups = None  # Dict[package_name, List[PackageRecord]]
+        self._trackers = None  # Dict[track_feature, List[PackageRecord]]
+        self._sha256_map = None  # Dict[sha256, PackageRecord]
+        self._sorted_groups = {}  # Dict[sort_key_id, Dict[package_name, List[PackageRecord]]]
+        self._positions = {}  # Dict[sort_key_id, Dict[PackageRecord, int]]
+        self._sorted_versions = {}  # Dict[package_name, Tuple[List[VersionOrder], List[str]]]
+        self._version_ranks = {}  # Dict[sort_key_id, Dict[package_name, List[Tuple]]]
+
+    def __setitem__(self, key, value):
+        super(Index, self).__setitem__(key, value)
+        self._invalidate()
+
+    def __delitem__(self, key):
+        super(Index, self).__delitem__(key)
+        self._invalidate()
+
+    def clear(self):
+        super(Index, self).clear()
+        self._invalidate()
+
+    def pop(self, *args):
+        result = super(Index, self).pop(*args)
+        self._invalidate()
+        return result
+
+    def popitem(self):
+        result = super(Index, self).popitem()
+        self._invalidate()
+        return result
+
+    def setdefault(self, key, default=None):
+        result = super(Index, self).setdefault(key, default)
+        self._invalidate()
+        return result
+
+    def update(self, *args, **kwargs):
+        super(Index, self).update(*args, **kwargs)
+        self._invalidate()
+
+    def copy(self):
+        return Index(self)
+
+    @property
+    def groups(self):
+        # a name that has unmanageable records is restricted to those
+        if self._groups is None:
+            self._build_groups()
+        return self._groups
+
+    @property
+    def trackers(self):
+        if self._trackers is None:
+            self._build_groups()
+        return self._trackers
+
+    @property
+    def sha256_map(self):
+        if self._sha256_map is None:
+            self._sha256_map = dict((prec.get('sha256'), prec) for prec in itervalues(self)
+                                    if prec.get('sha256'))
+        return self._sha256_map
+
+    def _build_groups(self):
+        groups = groupby("name", itervalues(self))
+        trackers = defaultdict(list)
+
+        for name in groups:
+            unmanageable_precs = [prec for prec in groups[name] if prec.is_unmanageable]
+            if unmanageable_precs:
+                log.debug("restricting to unmanageable packages: %s", name)
+                groups[name] = unmanageable_precs
+            tf_precs = (prec for prec in groups[name] if prec.track_features)
+            for prec in tf_precs:
+                for feature_name in prec.track_features:
+                    trackers[feature_name].append(prec)
+
+        self._groups = groups
+        self._trackers = trackers
+
+    def sorted_groups(self, sort_key, sort_key_id):
+        """Return the name groups, each sorted by ``sort_key`` in descending order.
+
+        ``sort_key_id`` is a hashable value that identifies ``sort_key``; the result is kept
+        under it and shared by later calls.
+        """
+        try:
+            return self._sorted_groups[sort_key_id]
+        except KeyError:
+            pass
+
+        parent_positions = None
+        if self._parent is not None:
+            parent_positions = self._parent._sorted_positions(sort_key, sort_key_id)
+        sorted_groups = {}
+        for name, group in iteritems(self.groups):
+            if parent_positions is not None and all(prec in parent_positions for prec in group):
+                sorted_groups[name] = sorted(group, key=parent_positions.__getitem__)
+            else:
+                sorted_groups[name] = sorted(group, key=sort_key, reverse=True)
+        self._sorted_groups[sort_key_id] = sorted_groups
+        return sorted_groups
+
+    def _sorted_positions(self, sort_key, sort_key_id):
+        try:
+            return self._positions[sort_key_id]
+        except KeyError:
+            positions = self._positions[sort_key_id] = dict(
+                (prec, position)
+                for group in itervalues(self.sorted_groups(sort_key, sort_key_id))
+                for position, prec in enumerate(group)
+            )
+            return positions
+
+    def version_ranks(self, name, sort_key, sort_key_id, ignore_timestamps=False):
+        """Return the ranks of the records named ``name`` within their sorted group.
+
+        The result is a list of ``(prec, channel_rank, version_rank, build_rank,
+        timestamp_rank)`` tuples in group order.  ``sort_key`` must be laid out like
+        Resolve.version_key: validity and channel priority (or version) first, then version
+        (or channel priority), build number and timestamp.  Each rank counts the changes at
+        its level from one record to the next, and starts over when a level above it changes.
+        The tables are kept under ``sort_key_id`` with the sorted groups.
+        """
+        tables = self._version_ranks.setdefault(sort_key_id, {})
+        try:
+            return tables[name]
+        except KeyError:
+            pass
+
+        ranks = []
+        pkey = None
+        # the group is sorted by sort_key, so later entries differ from earlier ones in
+        #    some way, and comparing neighbours with != suffices
+        for prec in self.sorted_groups(sort_key, sort_key_id).get(name, ()):
+            version_key = sort_key(prec)
+            if pkey is None:
+                ic = iv = ib = it = 0
+            # valid package, channel priority
+            elif pkey[0] != version_key[0] or pkey[1] != version_key[1]:
+                ic += 1
+                iv = ib = it = 0
+            # version
+            elif pkey[2] != version_key[2]:
+                iv += 1
+                ib = it = 0
+            # build number
+            elif pkey[3] != version_key[3]:
+                ib += 1
+                it = 0
+            elif not ignore_timestamps and pkey[4] != version_key[4]:
+                it += 1
+            ranks.append((prec, ic, iv, ib, it))
+            pkey = version_key
+        tables[name] = ranks
+        return ranks
+
+    def sorted_versions(self, name):
+        """Return the distinct versions of the records named ``name``, as a list of sorted
+        VersionOrders and a parallel list of version strings.
+
+        MatchSpec.match_group() uses these for range queries.  Returns None if some version
+        can't be parsed.
+        """
+        try:
+            return self._sorted_versions[name]
+        except KeyError:
+            pass
+
+        version_strs = set(prec.version for prec in self.groups.get(name, ()))
+        try:
+            pairs = sorted((VersionOrder(version_str), version_str)
+                           for version_str in version_strs)
+        except InvalidVersionSpec as e:
+            log.debug("no sorted versions for %s: %r", name, e)
+            result = None
+        else:
+            result = [pair[0] for pair in pairs], [pair[1] for pair in pairs]
+        self._sorted_versions[name] = result
+        return result
+
+    def subset(self, precs):
+        """Return a new Index of ``precs``, whose sorted groups are taken from this index."""
+        index = Index((prec, prec) for prec in precs)
+        index._parent = self
+        return index
@@ -4,15 +4,17 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 from abc import ABCMeta, abstractmethod, abstractproperty
+from bisect import bisect_left, bisect_right
 try:
     from collections.abc import Mapping
 except ImportError:
     from collections import Mapping
-from functools import reduce
+from functools import partial, reduce
 from logging import getLogger
-from operator import attrgetter
+from operator import attrgetter, eq, ge, gt, le, lt
 from os.path import basename
 import re
+from threading import Lock
 
 from .channel import Channel
 from .version import BuildNumberMatch, VersionSpec
@@ -20,8 +22,8 @@ from .._vendor.auxlib.collection import frozendict
 from .._vendor.auxlib.decorators import memoizedproperty
 from .._vendor.toolz import concat, concatv, groupby
 from ..base.constants import CONDA_TARBALL_EXTENSION
-from ..common.compat import (isiterable, iteritems, itervalues, string_types, text_type,
-                             with_metaclass)
+from ..common.compat import (isiterable, iteritems, itervalues, odict, string_types,
+                             text_type, with_metaclass)
 from ..common.io import dashlist
 from ..common.path import expand, url_to_path
 from ..common.url import is_url, path_to_url, unquote
@@ -173,6 +175,7 @@ class MatchSpec(object):
         self._target = target
         self._original_spec_str = kwargs.pop('_original_spec_str', None)
         self._match_components = self._build_components(**kwargs)
+        self._compiled_matches = {}
 
     @classmethod
     def from_dist_str(cls, dist_str):
@@ -237,6 +240,60 @@ class MatchSpec(object):
                 return False
         return True
 
+    def match_group(self, precs, sorted_versions=None):
+        """
+        Return the records in ``precs`` that match, in their original order.  All of ``precs``
+        must have this spec's exact name; the name isn't checked again.
+
+        ``sorted_versions`` is the pair returned by ``Index.sorted_versions()`` for the name.
+        When given, a version spec with a single relational operator is answered with a range
+        query over it instead of being matched against each record.
+        """
+        versions = None
+        version_component = self._match_components.get('version')
+        if sorted_versions is not None and version_component is not None:
+            versions = _version_range(version_component, *sorted_versions)
+        if versions is None:
+            predicate = self._compiled_match(('name',))
+            return tuple(prec for prec in precs if predicate(prec))
+        if not versions:
+            return ()
+        predicate = self._compiled_match(('name', 'version'))
+        return tuple(prec for prec in precs if prec.version in versions and predicate(prec))
+
+    def _compiled_match(self, skip_fields=()):
+        """
+        Return a predicate equivalent to ``match()`` for PackageRecords, without the checks for
+        ``skip_fields``.  Exact string components become plain comparisons, and the results for
+        version and build_number are kept per value, since many records share them.
+        """
+        try:
+            return self._compiled_matches[skip_fields]
+        except KeyError:
+            pass
+
+        checks = []
+        for field_name, match_component in iteritems(self._match_components):
+            if field_name in skip_fields:
+                continue
+            elif type(match_component) is ExactStrMatch:
+                checks.append(_exact_str_check(field_name, match_component.exact_value))
+            elif field_name in ('version', 'build_number'):
+                checks.append(_memoized_check(self._match_individual, field_name,
+                                              match_component))
+            else:
+                checks.append(partial(_individual_check, self._match_individual, field_name,
+                                      match_component))
+
+        if not checks:
+            predicate = _always_true
+        elif len(checks) == 1:
+            predicate = checks[0]
+        else:
+            predicate = partial(_all_checks, tuple(checks))
+        self._compiled_matches[skip_fields] = predicate
+        return predicate
+
     def _match_individual(self, record, field_name, match_component):
         val = getattr(record, field_name)
         try:
@@ -488,6 +545,60 @@ class MatchSpec(object):
         return self.__class__(optional=self.optional, target=self.target, **final_components)
 
 
+def _always_true(record):
+    return True
+
+
+def _all_checks(checks, record):
+    return all(check(record) for check in checks)
+
+
+def _individual_check(match_individual, field_name, match_component, record):
+    return match_individual(record, field_name, match_component)
+
+
+def _exact_str_check(field_name, value):
+    get_value = attrgetter(field_name)
+
+    def check(record):
+        return value == text_type(get_value(record))
+    return check
+
+
+def _memoized_check(match_individual, field_name, match_component):
+    get_value = attrgetter(field_name)
+    results = {}
+
+    def check(record):
+        value = get_value(record)
+        try:
+            return results[value]
+        except KeyError:
+            result = results[value] = bool(match_individual(record, field_name,
+                                                            match_component))
+            return result
+    return check
+
+
+def _version_range(version_spec, version_orders, version_strs):
+    # Returns the version strings selected by a single relational operator, or None if the
+    # spec isn't one.  version_orders is sorted, and version_strs is parallel to it.
+    operator_func = getattr(version_spec, 'operator_func', None)
+    if operator_func not in (eq, ge, gt, le, lt):
+        return None
+    matcher_vo = version_spec.matcher_vo
+    lo, hi = 0, len(version_orders)
+    if operator_func in (eq, ge):
+        lo = bisect_left(version_orders, matcher_vo)
+    elif operator_func is gt:
+        lo = bisect_right(version_orders, matcher_vo)
+    if operator_func in (eq, le):
+        hi = bisect_right(version_orders, matcher_vo)
+    elif operator_func is lt:
+        hi = bisect_left(version_orders, matcher_vo)
+    return frozenset(version_strs[lo:hi])
+
+
 def _parse_version_plus_build(v_plus_b):
     """This should reliably pull the build string out of a version + build string combo.
     Examples:
@@ -711,6 +822,34 @@ def _parse_spec_str(spec_str):
     return components
 
 
+# Dependency strings repeat across records, channels and Resolve instances; keep the specs
+# made from the most recently used ones.
+_DEPENDS_CACHE = odict()  # Dict[Tuple[spec_str, optional], MatchSpec]
+_DEPENDS_CACHE_MAX_SIZE = 50000
+_DEPENDS_CACHE_LOCK = Lock()  # records are created from several threads at once
+
+
+def _depends_match_spec(spec_str, optional=False):
+    """Return the MatchSpec for a record's depends (or, with ``optional``, constrains) string,
+    shared by every caller in the process."""
+    if not isinstance(spec_str, string_types):
+        return MatchSpec(spec_str, optional=True) if optional else MatchSpec(spec_str)
+    key = spec_str, optional
+    with _DEPENDS_CACHE_LOCK:
+        ms = _DEPENDS_CACHE.pop(key, None)
+        if ms is not None:
+            _DEPENDS_CACHE[key] = ms
+            return ms
+    # parsed outside the lock; if another thread got there first, its MatchSpec is kept
+    ms = MatchSpec(spec_str, optional=True) if optional else MatchSpec(spec_str)
+    with _DEPENDS_CACHE_LOCK:
+        ms = _DEPENDS_CACHE.pop(key, ms)
+        while len(_DEPENDS_CACHE) >= _DEPENDS_CACHE_MAX_SIZE:
+            _DEPENDS_CACHE.popitem(last=False)
+        _DEPENDS_CACHE[key] = ms
+    return ms
+
+
 @with_metaclass(ABCMeta)
 class MatchInterface(object):
     def __init__(self, value):
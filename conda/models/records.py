@@ -321,10 +321,12 @@ class PackageRecord(DictSafeMixin, Entity):
 
     @property
     def combined_depends(self):
-        from .match_spec import MatchSpec
-        result = {ms.name: ms for ms in MatchSpec.merge(self.depends)}
+        from .match_spec import MatchSpec, _depends_match_spec
+        result = {ms.name: ms for ms in MatchSpec.merge(
+            _depends_match_spec(spec) for spec in self.depends if spec
+        )}
         result.update({ms.name: ms for ms in MatchSpec.merge(
-            MatchSpec(spec, optional=True) for spec in self.constrains or ()
+            _depends_match_spec(spec, optional=True) for spec in self.constrains or () if spec
         )})
         return tuple(itervalues(result))
 
@@ -3,8 +3,10 @@
 # SPDX-License-Identifier: BSD-3-Clause
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-from collections import defaultdict, OrderedDict
+from collections import OrderedDict, defaultdict
+from itertools import islice, product
 from logging import DEBUG, getLogger
+from time import time
 
 from ._vendor.auxlib.collection import frozendict
 from ._vendor.auxlib.decorators import memoize, memoizemethod
@@ -18,6 +20,7 @@ from .common.toposort import toposort
 from .exceptions import InvalidSpec, ResolvePackageNotFound, UnsatisfiableError
 from .models.channel import Channel, MultiChannel
 from .models.enums import NoarchType
+from .models.index import Index
 from .models.match_spec import MatchSpec
 from .models.records import PackageRecord
 from .models.version import VersionOrder
@@ -46,33 +49,23 @@ class Resolve(object):
         self._channel_priority = context.channel_priority
         self._solver_ignore_timestamps = context.solver_ignore_timestamps
 
-        groups = groupby("name", itervalues(index))
-        trackers = defaultdict(list)
-
-        for name in groups:
-            unmanageable_precs = [prec for prec in groups[name] if prec.is_unmanageable]
-            if unmanageable_precs:
-                log.debug("restricting to unmanageable packages: %s", name)
-                groups[name] = unmanageable_precs
-            tf_precs = (prec for prec in groups[name] if prec.track_features)
-            for prec in tf_precs:
-                for feature_name in prec.track_features:
-                    trackers[feature_name].append(prec)
-
-        self.groups = groups  # Dict[package_name, List[PackageRecord]]
-        self.trackers = trackers  # Dict[track_feature, Set[PackageRecord]]
-        self._cached_find_matches = {}  # Dict[MatchSpec, Set[PackageRecord]]
-        self.ms_depends_ = {}  # Dict[PackageRecord, List[MatchSpec]]
-        self._reduced_index_cache = {}
-        self._strict_channel_cache = {}
+        # the name groups, trackers and sorted groups are built by, and shared through, the
+        # Index; they are read-only here
+        self._index = index if isinstance(index, Index) else Index(index)
 
         # sorting these in reverse order is effectively prioritizing
         # contstraint behavior from newer packages. It is applying broadening
         # reduction based on the latest packages, which may reduce the space
         # more, because more modern packages utilize constraints in more sane
         # ways (for example, using run_exports in conda-build 3)
-        for name, group in self.groups.items():
-            self.groups[name] = sorted(group, key=self.version_key, reverse=True)
+        self._version_key_id = (tuple(iteritems(self._channel_priorities_map)),
+                                self._channel_priority, self._solver_ignore_timestamps)
+        self.groups = self._index.sorted_groups(self.version_key, self._version_key_id)  # Dict[package_name, List[PackageRecord]]  # NOQA
+        self.trackers = self._index.trackers  # Dict[track_feature, List[PackageRecord]]
+        self._cached_find_matches = {}  # Dict[MatchSpec, Set[PackageRecord]]
+        self.ms_depends_ = {}  # Dict[PackageRecord, List[MatchSpec]]
+        self._reduced_index_cache = {}
+        self._strict_channel_cache = {}
 
     def __hash__(self):
         return (super(Resolve, self).__hash__() ^
@@ -356,107 +349,15 @@ class Resolve(object):
         specs, features = self.verify_specs(specs)
         filter_out = {prec: False if val else "feature not enabled"
                       for prec, val in iteritems(self.default_filter(features))}
-        snames = set()
-        top_level_spec = None
-
-        cp_filter_applied = set()  # values are package names
-
-        def filter_group(_specs):
-            # all _specs should be for the same package name
-            name = next(iter(_specs)).name
-            group = self.groups.get(name, ())
-
-            # implement strict channel priority
-            if strict_channel_priority and name not in cp_filter_applied:
-                sole_source_channel_name = self._get_strict_channel(name)
-                for prec in group:
-                    if prec.channel.name != sole_source_channel_name:
-                        filter_out[prec] = "removed due to strict channel priority"
-                cp_filter_applied.add(name)
-
-            # Prune packages that don't match any of the patterns
-            # or which have unsatisfiable dependencies
-            nold = nnew = 0
-            for prec in group:
-                if not filter_out.setdefault(prec, False):
-                    nold += 1
-                    if not self.match_any(_specs, prec):
-                        filter_out[prec] = "incompatible with required spec %s" % top_level_spec
-                        continue
-                    unsatisfiable_dep_specs = tuple(
-                        ms for ms in self.ms_depends(prec)
-                        if not any(not filter_out.get(rec, False) for rec in self.find_matches(ms))
-                    )
-                    if unsatisfiable_dep_specs:
-                        filter_out[prec] = "unsatisfiable dependencies %s" % " ".join(
-                            str(s) for s in unsatisfiable_dep_specs
-                        )
-                        continue
-                    filter_out[prec] = False
-                    nnew += 1
-
-            reduced = nnew < nold
-            if reduced:
-                log.debug('%s: pruned from %d -> %d' % (name, nold, nnew))
-            if any(ms.optional for ms in _specs):
-                return reduced
-            elif nnew == 0:
-                # Indicates that a conflict was found; we can exit early
-                return None
-
-            # Perform the same filtering steps on any dependencies shared across
-            # *all* packages in the group. Even if just one of the packages does
-            # not have a particular dependency, it must be ignored in this pass.
-            # Otherwise, we might do more filtering than we should---and it is
-            # better to have extra packages here than missing ones.
-            if reduced or name not in snames:
-                snames.add(name)
-
-                _dep_specs = groupby(lambda s: s.name, (
-                    dep_spec
-                    for prec in group if not filter_out.get(prec, False)
-                    for dep_spec in self.ms_depends(prec) if not dep_spec.optional
-                ))
-                _dep_specs.pop("*", None)  # discard track_features specs
-
-                for deps in itervalues(_dep_specs):
-                    if len(deps) >= nnew:
-                        res = filter_group(set(deps))
-                        if res:
-                            reduced = True
-                        elif res is None:
-                            # Indicates that a conflict was found; we can exit early
-                            return None
-
-            return reduced
-
-        # Iterate on pruning until no progress is made. We've implemented
-        # what amounts to "double-elimination" here; packages get one additional
-        # chance after their first "False" reduction. This catches more instances
-        # where one package's filter affects another. But we don't have to be
-        # perfect about this, so performance matters.
-        for _ in range(2):
-            snames.clear()
-            slist = list(specs)
-            reduced = False
-            while slist:
-                s = slist.pop()
-                top_level_spec = s
-                reduced = filter_group([s])
-                if reduced:
-                    slist.append(s)
-                elif reduced is None:
-                    break
-            if reduced is None:
-                # This filter reset means that unsatisfiable indexes leak through.
-                filter_out = {prec: False if val else "feature not enabled"
-                              for prec, val in iteritems(self.default_filter(features))}
-                # TODO: raise unsatisfiable exception here
-                # Messaging to users should be more descriptive.
-                # 1. Are there no direct matches?
-                # 2. Are there no matches for first-level dependencies?
-                # 3. Have the first level dependencies been invalidated?
-                break
+        if not self._prune_index(specs, filter_out, strict_channel_priority):
+            # This filter reset means that unsatisfiable indexes leak through.
+            filter_out = {prec: False if val else "feature not enabled"
+                          for prec, val in iteritems(self.default_filter(features))}
+            # TODO: raise unsatisfiable exception here
+            # Messaging to users should be more descriptive.
+            # 1. Are there no direct matches?
+            # 2. Are there no matches for first-level dependencies?
+            # 3. Have the first level dependencies been invalidated?
 
         # Determine all valid packages in the dependency graph
         reduced_index2 = {prec: prec for prec in (make_feature_record(fstr) for fstr in features)}
@@ -534,10 +435,135 @@ class Resolve(object):
                     #     print("MS {} added {} specs to further examination".format(ms,
                     #                                                                specs_added))
 
-        reduced_index2 = frozendict(reduced_index2)
+        # an Index over a subset of this one; a Resolve made from it reuses our sorted groups
+        reduced_index2 = self._index.subset(itervalues(reduced_index2))
         self._reduced_index_cache[cache_key] = reduced_index2
         return reduced_index2
 
+    def _prune_index(self, specs, filter_out, strict_channel_priority):
+        """Mark in ``filter_out`` the records that cannot be part of a solution for ``specs``.
+
+        A record is removed when it does not match a top-level spec for its name, when strict
+        channel priority takes its name from another channel, or when one of its dependencies
+        is left without a match.  Each name a solution must include also restricts the names
+        that all of its remaining records depend on to the records matching one of those
+        dependencies.  The pruning runs off a worklist: every dependency keeps a count of its
+        remaining matches, so a removal only revisits the records that relied on it.
+
+        Returns False if a required name is left without records, i.e. the specs conflict.
+        """
+        # the names reachable from specs through their non-optional dependencies
+        names = set()
+        pending = [spec.name for spec in specs]
+        while pending:
+            name = pending.pop()
+            if name in names:
+                continue
+            names.add(name)
+            for prec in self.groups.get(name, ()):
+                try:
+                    pending.extend(ms.name for ms in self.ms_depends(prec)
+                                   if not ms.optional and ms.name != '*')
+                except InvalidSpec:
+                    pass
+
+        # support counts, and the reverse edges from each record to the specs it matches
+        dependents = defaultdict(list)  # Dict[MatchSpec, List[PackageRecord]]
+        supported = defaultdict(list)  # Dict[PackageRecord, List[MatchSpec]]
+        support_count = {}  # Dict[MatchSpec, int]
+        invalid_precs = []
+        for name in names:
+            for prec in self.groups.get(name, ()):
+                try:
+                    depends = self.ms_depends(prec)
+                except InvalidSpec:
+                    invalid_precs.append(prec)
+                    continue
+                for ms in depends:
+                    if ms.optional:
+                        continue
+                    dependents[ms].append(prec)
+                    if ms not in support_count:
+                        matches = self.find_matches(ms)
+                        support_count[ms] = sum(1 for rec in matches
+                                                if not filter_out.get(rec, False))
+                        for rec in matches:
+                            supported[rec].append(ms)
+
+        removed = []
+
+        def remove(prec, reason):
+            if not filter_out.get(prec, False):
+                filter_out[prec] = reason
+                removed.append(prec)
+
+        for prec in invalid_precs:
+            remove(prec, "invalid dep specs")
+        for ms, count in iteritems(support_count):
+            if not count:
+                for prec in dependents[ms]:
+                    remove(prec, "unsatisfiable dependencies %s" % ms)
+
+        # implement strict channel priority
+        if strict_channel_priority:
+            for name in names:
+                group = self.groups.get(name)
+                if group:
+                    sole_source_channel_name = self._get_strict_channel(name)
+                    for prec in group:
+                        if prec.channel.name != sole_source_channel_name:
+                            remove(prec, "removed due to strict channel priority")
+
+        required = set()
+        for spec in specs:
+            for prec in self.groups.get(spec.name, ()):
+                if not spec.match(prec):
+                    remove(prec, "incompatible with required spec %s" % spec)
+            if not spec.optional:
+                required.add(spec.name)
+
+        changed = set(required)  # required names whose records have changed
+        while True:
+            while removed:
+                prec = removed.pop()
+                if prec.name in required:
+                    changed.add(prec.name)
+                for ms in supported.get(prec, ()):
+                    support_count[ms] -= 1
+                    if not support_count[ms]:
+                        for dependent in dependents[ms]:
+                            remove(dependent, "unsatisfiable dependencies %s" % ms)
+            if not changed:
+                return True
+
+            name = changed.pop()
+            group = tuple(prec for prec in self.groups.get(name, ())
+                          if not filter_out.get(prec, False))
+            if not group:
+                log.debug('%s: no packages left after pruning', name)
+                return False
+
+            # A dependency shared across *all* remaining packages of a required name is
+            # required as well, and must match one of their specs for it.  Even if just one
+            # of the packages does not have the dependency, it is ignored here.
+            shared_names = None
+            dep_specs = defaultdict(set)
+            for prec in group:
+                dep_names = set()
+                for ms in self.ms_depends(prec):
+                    if not ms.optional and ms.name != '*':
+                        dep_specs[ms.name].add(ms)
+                        dep_names.add(ms.name)
+                shared_names = dep_names if shared_names is None else shared_names & dep_names
+            for dep_name in shared_names:
+                _specs = dep_specs[dep_name]
+                for prec in self.groups.get(dep_name, ()):
+                    if not self.match_any(_specs, prec):
+                        remove(prec, "incompatible with the dependencies of %s" % name)
+                if dep_name not in required:
+                    required.add(dep_name)
+                    changed.add(dep_name)
+
     def match_any(self, mss, prec):
         return any(ms.match(prec) for ms in mss)
 
@@ -549,7 +575,10 @@ class Resolve(object):
 
         spec_name = spec.get_exact_value('name')
         if spec_name:
-            candidate_precs = self.groups.get(spec_name, ())
+            res = spec.match_group(self.groups.get(spec_name, ()),
+                                   self._index.sorted_versions(spec_name))
+            self._cached_find_matches[spec] = res
+            return res
         elif spec.get_exact_value('track_features'):
             feature_names = spec.get_exact_value('track_features')
             candidate_precs = concat(
@@ -558,7 +587,8 @@ class Resolve(object):
         else:
             candidate_precs = itervalues(self.index)
 
-        res = tuple(p for p in candidate_precs if spec.match(p))
+        match = spec._compiled_match()
+        res = tuple(p for p in candidate_precs if match(p))
         self._cached_find_matches[spec] = res
         return res
 
@@ -756,32 +786,11 @@ class Resolve(object):
             #         if self.index[dist].get('priority', 0) < MAX_CHANNEL_PRIORITY:
             #             rec.append(dist)
 
-        for name, targets in iteritems(sdict):
-            pkgs = [(self.version_key(p), p) for p in self.groups.get(name, [])]
-            pkey = None
-            # keep in mind that pkgs is already sorted according to version_key (a tuple,
-            #    so composite sort key).  Later entries in the list are, by definition,
-            #    greater in some way, so simply comparing with != suffices.
-            for version_key, prec in pkgs:
-                if targets and any(prec == t for t in targets):
-                    continue
-                if pkey is None:
-                    ic = iv = ib = it = 0
-                # valid package, channel priority
-                elif pkey[0] != version_key[0] or pkey[1] != version_key[1]:
-                    ic += 1
-                    iv = ib = it = 0
-                # version
-                elif pkey[2] != version_key[2]:
-                    iv += 1
-                    ib = it = 0
-                # build number
-                elif pkey[3] != version_key[3]:
-                    ib += 1
-                    it = 0
-                elif not self._solver_ignore_timestamps and pkey[4] != version_key[4]:
-                    it += 1
-
+        for name in sdict:
+            # the ranks are kept with the index, so each group is only ranked once
+            for prec, ic, iv, ib, it in self._index.version_ranks(
+                    name, self.version_key, self._version_key_id,
+                    self._solver_ignore_timestamps):
                 prec_sat_name = self.to_sat_name(prec)
                 if ic or include0:
                     eqc[prec_sat_name] = ic
@@ -791,7 +800,6 @@ class Resolve(object):
                     eqb[prec_sat_name] = ib
                 if it or include0:
                     eqt[prec_sat_name] = it
-                pkey = version_key
 
         return eqc, eqv, eqb, eqt
 
@@ -863,7 +871,7 @@ class Resolve(object):
             return ()
         else:
             # This first result is just a single unsatisfiable core. There may be several.
-            unsat_specs = list(minimal_unsatisfiable_subset(specs, sat=mysat))
+            unsat_specs = list(r2.minimal_unsatisfiable_specs(C, specs))
             satisfiable_specs = set(specs) - set(unsat_specs)
 
             # In this loop, we test each unsatisfiable spec individually against the satisfiable
@@ -876,12 +884,33 @@ class Resolve(object):
                 C = r2.gen_clauses()  # TODO: wasteful call, but Clauses() needs refactored
                 solution = mysat(test_specs, True)
                 if not solution:
-                    these_unsat = minimal_unsatisfiable_subset(test_specs, sat=mysat)
+                    these_unsat = r2.minimal_unsatisfiable_specs(C, test_specs)
                     if len(these_unsat) > 1:
                         unsat_specs.extend(these_unsat)
                         satisfiable_specs -= set(unsat_specs)
             return tuple(final_unsat_specs)
 
+    def minimal_unsatisfiable_specs(self, C, specs):
+        """Return a minimal subset of specs that can't be satisfied together.
+
+        When the SAT solver can solve under assumptions, a single solve narrows the specs down
+        to an unsatisfiable core, and only the core is minimized.  Otherwise the search runs
+        over all of the specs.
+        """
+        def mysat(specs, add_if=False):
+            constraints = self.generate_spec_constraints(C, specs)
+            return C.sat(constraints, add_if)
+
+        specs = tuple(specs)
+        if not C.supports_unsat_core:
+            log.debug("SAT solver can't find unsatisfiable cores; searching all specs")
+            return minimal_unsatisfiable_subset(specs, sat=mysat)
+        core = C.unsat_core([self.generate_spec_constraints(C, (spec,)) for spec in specs])
+        if core:
+            log.debug("unsatisfiable core of %d/%d specs", len(core), len(specs))
+            specs = tuple(specs[k] for k in core)
+        return minimal_unsatisfiable_subset(specs, sat=mysat)
+
     def bad_installed(self, installed, new_specs):
         log.debug('Checking if the current environment is consistent')
         if not installed:
@@ -1005,8 +1034,72 @@ class Resolve(object):
         self.restore_bad(pkgs, preserve)
         return pkgs
 
+    def _collapse_equivalent_builds(self, reduced_index, specs):
+        """Keep one record of each set of builds the solver can't tell apart.
+
+        Records with the same name, version, build_number, subdir, depends, constrains and
+        features differ only in things like their channel or build string.  If no spec in
+        the problem matches some of them but not others, each would just be another SAT
+        variable with the same clauses.  Only the one that sorts first by version_key is
+        kept; it is the one the solver's objectives would prefer.  Installed records (spec
+        targets) are never dropped.
+
+        Returns the reduced index and a ``{sat_name: sat_names}`` map from each kept record
+        that stands for others to itself and the dropped records that tie with it on every
+        objective.  Any solution holding the kept record is equally good with one of those
+        in its place.
+        """
+        def equivalence_key(prec):
+            return (prec.name, prec.version, prec.build_number, prec.subdir,
+                    tuple(prec.depends), tuple(prec.constrains or ()),
+                    frozenset(prec.features), frozenset(prec.track_features))
+
+        classes = groupby(equivalence_key, itervalues(reduced_index))
+        classes = [precs for precs in itervalues(classes) if len(precs) > 1]
+        if not classes:
+            return reduced_index, {}
+
+        targets = set(ms.target for ms in specs if ms.target)
+        all_specs = set(specs)
+        for prec in itervalues(reduced_index):
+            all_specs.update(self.ms_depends(prec))
+        specs_by_name = groupby(lambda ms: ms.name, all_specs)
+        dropped = set()
+        collapsed = {}
+        for precs in classes:
+            if any(prec.dist_str() in targets for prec in precs):
+                continue
+            if any(len(set(bool(ms.match(prec)) for prec in precs)) > 1
+                   for ms in concat((specs_by_name.get(precs[0].name, ()),
+                                     specs_by_name.get('*', ())))):
+                continue
+            precs = sorted(precs, key=self.version_key, reverse=True)
+            dropped.update(precs[1:])
+            # the build string only breaks ties; it isn't one of the solver's objectives
+            best_key = self.version_key(precs[0])[:-1]
+            tied = [self.to_sat_name(prec) for prec in precs
+                    if self.version_key(prec)[:-1] == best_key]
+            if len(tied) > 1:
+                collapsed[tied[0]] = tuple(tied)
+        if not dropped:
+            return reduced_index, {}
+
+        log.debug("collapsed %d equivalent builds", len(dropped))
+        return reduced_index.subset(prec for prec in itervalues(reduced_index)
+                                    if prec not in dropped), collapsed
+
+    def solve_alternatives(self, specs, limit=10, timeout=None, _remove=False):
+        # type: (List[str], int, Optional[float], bool) -> List[List[PackageRecord]]
+        """Solve for specs, and return the optimal solutions found, at most limit of them.
+
+        The first is the solution solve() returns; the others are equally good under every
+        objective.  With a timeout in seconds, no further solutions are looked for once it
+        has passed.
+        """
+        return self.solve(specs, _remove=_remove, _alternatives=(limit, timeout))
+
     @time_recorder(module_name=__name__)
-    def solve(self, specs, returnall=False, _remove=False):
+    def solve(self, specs, returnall=False, _remove=False, _alternatives=None):
         # type: (List[str], bool) -> List[PackageRecord]
         if log.isEnabledFor(DEBUG):
             log.debug('Solving for: %s', dashlist(sorted(text_type(s) for s in specs)))
@@ -1019,6 +1112,7 @@ class Resolve(object):
         reduced_index = self.get_reduced_index(specs)
         if not reduced_index:
             return False if reduced_index is None else ([[]] if returnall else [])
+        reduced_index, collapsed = self._collapse_equivalent_builds(reduced_index, specs)
 
         # Check if satisfiable
         log.debug("Solve: determining satisfiability")
@@ -1050,7 +1144,7 @@ class Resolve(object):
         C = r2.gen_clauses()
         solution = mysat(specs, True)
         if not solution:
-            specs = minimal_unsatisfiable_subset(specs, sat=mysat)
+            specs = r2.minimal_unsatisfiable_specs(C, specs)
             self.find_conflicts(specs)
 
         speco = []  # optional packages
@@ -1139,24 +1233,42 @@ class Resolve(object):
             solution, obj6t = C.minimize(eq_t, solution)
             log.debug('Timestamp metric: %d', obj6t)
 
-        log.debug('Looking for alternate solutions')
-        nsol = 1
-        psolutions = []
+        if _alternatives is not None:
+            max_solutions, timeout = _alternatives
+        elif returnall or context.report_alternate_solutions:
+            max_solutions, timeout = 10, context.alternate_solutions_timeout
+        else:
+            max_solutions, timeout = 1, None
+
         psolution = clean(solution)
-        psolutions.append(psolution)
-        while True:
-            nclause = tuple(C.Not(C.from_name(q)) for q in psolution)
-            solution = C.sat((nclause,), True)
-            if solution is None:
-                break
-            nsol += 1
-            if nsol > 10:
-                log.debug('Too many solutions; terminating')
-                break
-            psolution = clean(solution)
-            psolutions.append(psolution)
+        psolutions = [psolution]
+        nsol = 1
+        if not converged and max_solutions > 1:
+            log.debug('Looking for alternate solutions')
+            deadline = timeout and time() + timeout
+            while True:
+                if deadline and time() > deadline:
+                    log.debug('Timed out looking for alternate solutions')
+                    break
+                nclause = tuple(C.Not(C.from_name(q)) for q in psolution)
+                solution = C.sat((nclause,), True)
+                if solution is None:
+                    break
+                nsol += 1
+                if nsol > max_solutions:
+                    log.debug('Too many solutions; terminating')
+                    break
+                psolution = clean(solution)
+                psolutions.append(psolution)
+
+        if collapsed and max_solutions > 1:
+            # every build that was collapsed into one in a solution gives another solution
+            expanded = list(islice(concat(product(*(collapsed.get(q, (q,)) for q in psol))
+                                          for psol in psolutions), max_solutions + 1))
+            nsol += len(expanded) - len(psolutions)
+            psolutions = [list(psol) for psol in expanded[:max_solutions]]
 
-        if nsol > 1:
+        if nsol > 1 and _alternatives is None:
             psols2 = list(map(set, psolutions))
             common = set.intersection(*psols2)
             diffs = [sorted(set(sol) - common) for sol in psols2]
@@ -1173,6 +1285,9 @@ class Resolve(object):
 
         new_index = {self.to_sat_name(prec): prec for prec in itervalues(self.index)}
 
+        if _alternatives is not None:
+            return [sorted((new_index[sat_name] for sat_name in psol), key=lambda x: x.name)
+                    for psol in psolutions]
         if returnall:
             if len(psolutions) > 1:
                 raise RuntimeError()
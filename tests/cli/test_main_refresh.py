@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+from logging import getLogger
+from os.path import isfile, join
+
+from conda.base.context import conda_tests_ctxt_mgmt_def_pol
+from conda.cli.main_refresh import refresh_repodata_caches
+from conda.cli.python_api import Commands, run_command
+from conda.common.io import env_vars
+from conda.common.url import path_to_url
+from conda.core.subdir_data import SubdirData
+from conda.models.channel import Channel
+from tests.helpers import local_channels, make_package_info, repodata_stand_in_server, tempdir
+
+log = getLogger(__name__)
+
+
+def test_refresh_repodata_caches():
+    repodata = json.dumps({"info": {"subdir": "linux-64"}, "packages": dict((
+        make_package_info("six", "1.0"),
+    ))})
+    with repodata_stand_in_server() as server, tempdir() as td:
+        url = "http://127.0.0.1:%d/channel/linux-64" % server.server_address[1]
+        server.files["/channel/linux-64/repodata.json"] = (repodata, '"v1"')
+        with env_vars({'CONDA_PKGS_DIRS': join(td, "pkgs"), 'CONDA_LOCAL_REPODATA_TTL': '60'},
+                      stack_callback=conda_tests_ctxt_mgmt_def_pol):
+            results = refresh_repodata_caches([url])
+            assert [result['action'] for result in results] == ["refreshed"]
+            assert 0 < results[0]['expires_in'] <= 60
+            assert isfile(SubdirData(Channel(url)).cache_path_index)
+
+            # a current cache is left alone
+            assert [result['action'] for result in refresh_repodata_caches([url])] == [
+                "current"
+            ]
+            assert len(server.requested_paths) == 1
+
+            # one that expires within the window is refreshed ahead of time
+            assert [result['action'] for result in refresh_repodata_caches([url], 120)] == [
+                "refreshed"
+            ]
+            assert len(server.requested_paths) == 2
+
+
+def test_refresh_command_json():
+    with local_channels([("channel", (make_package_info("six", "1.0"),))]) as (td, channels):
+        args = (Commands.REFRESH, "--override-channels", "-c", channels[0].base_url,
+                "--subdir", "linux-64", "--json")
+        stdout, stderr, rc = run_command(*args)
+        assert rc == 0
+        results = json.loads(stdout)
+        assert sorted(result['url'] for result in results) == [
+            path_to_url(join(td, "channel", subdir)) for subdir in ("linux-64", "noarch")
+        ]
+        assert all(result['action'] == "refreshed" for result in results)
+
+        # an unchanged local channel's cache doesn't expire
+        stdout, stderr, rc = run_command(*args)
+        assert rc == 0
+        assert all(result['action'] == "current" and result['expires_in'] is None
+                   for result in json.loads(stdout))
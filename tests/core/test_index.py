@@ -2,6 +2,9 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 from logging import getLogger
+import os
+from os.path import join
+from threading import current_thread
 from unittest import TestCase
 
 import pytest
@@ -10,12 +13,16 @@ from conda.base.constants import DEFAULT_CHANNELS
 from conda.base.context import context, conda_tests_ctxt_mgmt_def_pol
 from conda.common.compat import iteritems
 from conda.common.io import env_vars
-from conda.core.index import check_whitelist, get_index, get_reduced_index, _supplement_index_with_system
+from conda.common.url import path_to_url
+from conda.core.index import check_whitelist, fetch_index, get_index, get_reduced_index, \
+    _repodata_executor, _supplement_index_with_system
+from conda.core.subdir_data import SubdirData
 from conda.exceptions import ChannelNotAllowed
 from conda.models.channel import Channel
 from conda.models.enums import PackageType
 from conda.models.match_spec import MatchSpec
 from tests.core.test_repodata import platform_in_record
+from tests.helpers import local_channels, make_package_info, write_local_repodata
 
 try:
     from unittest.mock import patch
@@ -54,6 +61,167 @@ def test_supplement_index_with_system():
     assert cuda_pkg.package_type == PackageType.VIRTUAL_SYSTEM
 
 
+def test_fetch_index_loads_subdirs_concurrently():
+    loading_threads = set()
+    original_load = SubdirData.load
+
+    def load(self):
+        loading_threads.add(current_thread().ident)
+        return original_load(self)
+
+    with local_channels([(channel_name, (make_package_info("%s-pkg" % channel_name, "1.0"),))
+                         for channel_name in ("chan1", "chan2")],
+                        CONDA_REPODATA_THREADS='3') as (td, channels):
+        channel_urls = [url for channel in channels
+                        for url in channel.urls(subdirs=("linux-64", "noarch"))]
+        assert _repodata_executor()._max_workers == 3
+        with patch.object(SubdirData, 'load', load):
+            index = fetch_index(channel_urls)
+
+    assert sorted(rec.name for rec in index) == ["chan1-pkg", "chan2-pkg"]
+    assert current_thread().ident not in loading_threads
+
+
+def test_get_reduced_index_queries_by_level():
+    queried_names = []
+    original_query_many = SubdirData.query_many
+
+    def query_many(self, names=(), track_features=()):
+        if self.channel.subdir == "linux-64":
+            queried_names.append(list(names))
+        return original_query_many(self, names, track_features)
+
+    with local_channels([("channel", (
+        make_package_info("app", "1.0", ["libfoo", "libbar >=2"]),
+        make_package_info("libfoo", "1.0", ["libc"]),
+        make_package_info("libbar", "1.0", ["libc"]),
+        make_package_info("libbar", "2.0", ["libc"]),
+        make_package_info("libc", "1.0"),
+        make_package_info("unrelated", "1.0"),
+    ))]) as (td, channels):
+        with patch.object(SubdirData, 'query_many', query_many):
+            reduced_index = get_reduced_index(None, channels, ("linux-64", "noarch"),
+                                              (MatchSpec("app"),))
+
+    assert queried_names == [["app"], ["libbar", "libfoo"], ["libc"]]
+    assert sorted((rec.name, rec.version) for rec in reduced_index
+                  if rec.package_type != PackageType.VIRTUAL_SYSTEM) == [
+        ("app", "1.0"), ("libbar", "1.0"), ("libbar", "2.0"), ("libc", "1.0"), ("libfoo", "1.0"),
+    ]
+
+
+def test_get_reduced_index_strict_priority_loads_channels_lazily():
+    def reduced_records(channels):
+        reduced_index = get_reduced_index(None, channels, ("linux-64", "noarch"),
+                                          (MatchSpec("app"),))
+        return sorted((rec.channel.name, rec.name, rec.version) for rec in reduced_index
+                      if rec.package_type != PackageType.VIRTUAL_SYSTEM)
+
+    with local_channels([
+        ("high", (make_package_info("app", "1.0", ["libfoo"]),
+                  make_package_info("libfoo", "2.0", ["libc"]))),
+        ("low", (make_package_info("libfoo", "1.0"),
+                 make_package_info("libc", "1.0"))),
+        ("fallback", (make_package_info("libc", "0.9"),
+                      make_package_info("unrelated", "1.0"))),
+    ], CONDA_CHANNEL_PRIORITY='strict') as (td, channels):
+        strict_records = reduced_records(channels)
+        loaded_channels = set(sd.channel.name for sd in SubdirData._cache_.values()
+                              if sd._loaded and sd.url_w_subdir.startswith(path_to_url(td)))
+        with env_vars({'CONDA_CHANNEL_PRIORITY': 'flexible'},
+                      stack_callback=conda_tests_ctxt_mgmt_def_pol):
+            flexible_records = reduced_records(channels)
+
+    # libfoo is found in "high", so only libc falls through to "low", and "fallback" is
+    # never needed
+    assert loaded_channels == set(channel.name for channel in channels[:2])
+    assert strict_records == sorted([
+        (channels[0].name, "app", "1.0"), (channels[0].name, "libfoo", "2.0"),
+        (channels[1].name, "libc", "1.0"),
+    ])
+    assert set(strict_records) < set(flexible_records)
+    assert (channels[2].name, "libc", "0.9") in flexible_records
+
+
+def test_get_reduced_index_strict_priority_loads_channels_for_track_features():
+    with local_channels([
+        ("high", (make_package_info("app", "1.0"),)),
+        ("low", (make_package_info("fancy-app", "1.0", track_features="fancy"),)),
+    ], CONDA_CHANNEL_PRIORITY='strict') as (td, channels):
+        reduced_index = get_reduced_index(None, channels, ("linux-64", "noarch"),
+                                          (MatchSpec("app"), MatchSpec(track_features="fancy")))
+        records = sorted((rec.channel.name, rec.name) for rec in reduced_index
+                         if rec.package_type != PackageType.VIRTUAL_SYSTEM)
+
+    # no record in "high" has the feature, so it falls through to "low"
+    assert records == sorted([
+        ("@", "fancy@"), (channels[0].name, "app"), (channels[1].name, "fancy-app"),
+    ])
+
+
+def test_get_reduced_index_strict_priority_resolves_track_features_once():
+    with local_channels([
+        ("high", (make_package_info("app", "1.0"),
+                  make_package_info("fancy-high", "1.0", track_features="fancy"))),
+        ("low", (make_package_info("libc", "1.0"),
+                 make_package_info("fancy-low", "1.0", track_features="fancy"))),
+    ], CONDA_CHANNEL_PRIORITY='strict') as (td, channels):
+        specs = (MatchSpec("app"), MatchSpec("libc"), MatchSpec(track_features="fancy"))
+        reduced_index = get_reduced_index(None, channels, ("linux-64", "noarch"), specs)
+        records = sorted((rec.channel.name, rec.name) for rec in reduced_index
+                         if rec.package_type != PackageType.VIRTUAL_SYSTEM)
+
+    # "low" is loaded for libc, but "high" already provides the feature
+    assert records == sorted([
+        ("@", "fancy@"), (channels[0].name, "app"), (channels[0].name, "fancy-high"),
+        (channels[1].name, "libc"),
+    ])
+
+
+def test_get_reduced_index_cache():
+    packages = [
+        make_package_info("app", "1.0", ["libfoo"]),
+        make_package_info("libfoo", "1.0", ["libc"]),
+        make_package_info("libc", "1.0"),
+        make_package_info("unrelated", "1.0"),
+    ]
+    queries = []
+    original_query_many = SubdirData.query_many
+
+    def query_many(self, names=(), track_features=()):
+        if self.channel.subdir == "linux-64":
+            queries.append(list(names))
+        return original_query_many(self, names, track_features)
+
+    def reduced_records(channels):
+        del queries[:]
+        with patch.object(SubdirData, 'query_many', query_many):
+            reduced_index = get_reduced_index(None, channels, ("linux-64", "noarch"),
+                                              (MatchSpec("app"),))
+        return sorted((rec.name, rec.version) for rec in reduced_index
+                      if rec.package_type != PackageType.VIRTUAL_SYSTEM)
+
+    with local_channels([("channel", packages)],
+                        CONDA_USE_REDUCED_INDEX_CACHE='true') as (td, channels):
+        expected = [("app", "1.0"), ("libc", "1.0"), ("libfoo", "1.0")]
+        assert reduced_records(channels) == expected
+        assert queries == [["app"], ["libfoo"], ["libc"]]
+
+        # unchanged: the walk is replayed as a single query
+        assert reduced_records(channels) == expected
+        assert queries == [["app", "libc", "libfoo"]]
+
+        # the channel changed, so the cache entry is no longer valid
+        write_local_repodata(join(td, "channel"), "linux-64",
+                             packages + [make_package_info("libc", "2.0")])
+        assert reduced_records(channels) == sorted(expected + [("libc", "2.0")])
+        assert queries[0] == ["app"] and len(queries) == 3
+
+        # different specs don't share a cache entry
+        get_reduced_index(None, channels, ("linux-64", "noarch"), (MatchSpec("libc"),))
+        assert len(os.listdir(join(td, "pkgs", "cache", "reduced-index"))) == 2
+
+
 @pytest.mark.integration
 class GetIndexIntegrationTests(TestCase):
 
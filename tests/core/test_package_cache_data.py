@@ -1,8 +1,17 @@
+import json
 import os
 
+from conda.base.context import conda_tests_ctxt_mgmt_def_pol
+from conda.common.io import env_vars
 from conda.core import package_cache_data as pcd
 from conda.exports import url_path
-from conda.core.index import get_index
+from conda.core.index import get_index, _supplement_index_with_cache
+from tests.helpers import tempdir
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
 
 CONDA_PKG_REPO = url_path(os.path.join(os.path.dirname(__file__), '..', 'data', 'conda_format_repo'))
 
@@ -18,3 +27,45 @@ def test_ProgressiveFetchExtract_prefers_conda_v2_format():
 
     assert extract_action.source_full_path.endswith('.conda')
     assert extract_action.sha256sum == rec.conda_outer_sha256
+
+
+def make_extracted_package(pkgs_dir, name, version, depends=()):
+    extracted_package_dir = os.path.join(pkgs_dir, "%s-%s-0" % (name, version))
+    os.makedirs(os.path.join(extracted_package_dir, "info"))
+    with open(os.path.join(extracted_package_dir, "info", "index.json"), "w") as fh:
+        json.dump({"name": name, "version": version, "build": "0", "build_number": 0,
+                   "depends": list(depends)}, fh)
+
+
+def test_query_name_reads_only_matching_entries():
+    with tempdir() as td:
+        pkgs_dir = os.path.join(td, "pkgs")
+        make_extracted_package(pkgs_dir, "app", "1.0", ["libfoo >=1"])
+        make_extracted_package(pkgs_dir, "libfoo", "1.0")
+        make_extracted_package(pkgs_dir, "libfoo-dev", "1.0", ["libfoo"])
+        make_extracted_package(pkgs_dir, "unrelated", "1.0")
+        with env_vars({'CONDA_PKGS_DIRS': pkgs_dir},
+                      stack_callback=conda_tests_ctxt_mgmt_def_pol):
+            package_cache = pcd.PackageCacheData(pkgs_dir)
+            original_make_single_record = pcd.PackageCacheData._make_single_record
+            read_entries = []
+
+            def _make_single_record(self, package_filename):
+                read_entries.append(package_filename)
+                return original_make_single_record(self, package_filename)
+
+            with patch.object(pcd.PackageCacheData, '_make_single_record', _make_single_record):
+                precs = package_cache.query_name("libfoo")
+                assert [prec.version for prec in precs] == ["1.0"]
+                assert read_entries == ["libfoo-1.0-0"]
+                assert package_cache.query_name("libfoo") is precs
+
+                index = {}
+                _supplement_index_with_cache(index, ["app"])
+                assert sorted(prec.name for prec in index) == ["app", "libfoo"]
+                assert sorted(read_entries) == ["app-1.0-0", "libfoo-1.0-0"]
+
+            assert sorted(prec.name for prec in package_cache.iter_records()) == [
+                "app", "libfoo", "libfoo-dev", "unrelated",
+            ]
+            assert [prec.name for prec in package_cache.query_name("libfoo")] == ["libfoo"]
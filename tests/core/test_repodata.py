@@ -1,7 +1,14 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+from contextlib import contextmanager
+import gzip
+import json
 from logging import getLogger
+import os
+from os.path import isfile, join
+from threading import Thread
+from time import time
 from unittest import TestCase
 
 import pytest
@@ -10,10 +17,18 @@ from conda.base.context import context, conda_tests_ctxt_mgmt_def_pol
 from conda.common.compat import iteritems
 from conda.common.disk import temporary_content_in_file
 from conda.common.io import env_var
+from conda.common.url import path_to_url
 from conda.core.index import get_index
 from conda.core.subdir_data import Response304ContentUnchanged, cache_fn_url, read_mod_and_etag, \
-    SubdirData, fetch_repodata_remote_request, UnavailableInvalidChannel
+    SubdirData, fetch_repodata_remote_request, UnavailableInvalidChannel, MappedRepodataIndex, \
+    SqliteRepodataIndex, write_repodata_index, write_repodata_sqlite, REPODATA_PATCHES_FN, \
+    REPODATA_SHARDS_FN, ShardedRepodataIndex
+from conda.exceptions import CondaUpgradeError
+from conda.gateways.disk.lock import file_lock
 from conda.models.channel import Channel
+from conda.models.match_spec import MatchSpec
+from tests.helpers import local_channels, make_package_info, repodata_stand_in_server, \
+    tempdir, write_local_repodata
 
 try:
     from unittest.mock import patch
@@ -27,6 +42,21 @@ def platform_in_record(platform, record):
     return record.name.endswith('@') or ("/%s/" % platform in record.url) or ("/noarch/" in record.url)
 
 
+def make_repodata_shards(subdir, packages):
+    # {path relative to the subdir: json document} for a sharded channel subdir
+    shards = {}
+    for fn, info in packages:
+        shards.setdefault(info["name"], {})[fn] = info
+    files = dict(("shards/%s.json" % name, json.dumps({"packages": shard_packages}))
+                 for name, shard_packages in iteritems(shards))
+    files[REPODATA_SHARDS_FN] = json.dumps({
+        "info": {"subdir": subdir},
+        "repodata_version": 1,
+        "shards": dict((name, "shards/%s.json" % name) for name in shards),
+    })
+    return files
+
+
 @pytest.mark.integration
 class GetRepodataIntegrationTests(TestCase):
 
@@ -93,7 +123,7 @@ class StaticFunctionTests(TestCase):
         {
           "_url": "https://repo.anaconda.com/pkgs/r/noarch",
           "info": {},
-          "_etag": "\"569c0ecb-48\"",
+          "_etag": "\\"569c0ecb-48\\"",
           "packages": {}
         }
         """.strip()
@@ -105,7 +135,7 @@ class StaticFunctionTests(TestCase):
     def test_read_mod_and_etag_etag_mod(self):
         etag_mod_str = """
         {
-          "_etag": "\"569c0ecb-48\"",
+          "_etag": "\\"569c0ecb-48\\"",
           "_mod": "Sun, 17 Jan 2016 21:59:39 GMT",
           "_url": "https://repo.anaconda.com/pkgs/r/noarch",
           "info": {},
@@ -123,7 +153,7 @@ class StaticFunctionTests(TestCase):
           "_mod": "Sun, 17 Jan 2016 21:59:39 GMT",
           "_url": "https://repo.anaconda.com/pkgs/r/noarch",
           "info": {},
-          "_etag": "\"569c0ecb-48\"",
+          "_etag": "\\"569c0ecb-48\\"",
           "packages": {}
         }
         """.strip()
@@ -132,6 +162,10 @@ class StaticFunctionTests(TestCase):
             assert mod_etag_dict["_mod"] == "Sun, 17 Jan 2016 21:59:39 GMT"
             assert mod_etag_dict["_etag"] == "\"569c0ecb-48\""
 
+    def test_read_mod_and_etag_missing_file(self):
+        with tempdir() as td:
+            assert read_mod_and_etag(join(td, "missing.headers.json")) == {}
+
     def test_cache_fn_url_repo_continuum_io(self):
         hash1 = cache_fn_url("http://repo.continuum.io/pkgs/free/osx-64/")
         hash2 = cache_fn_url("http://repo.continuum.io/pkgs/free/osx-64")
@@ -170,8 +204,9 @@ class FetchLocalRepodataTests(TestCase):
         url = 'file:///fake/fake/fake/linux-64'
         etag = None
         mod_stamp = 'Mon, 28 Jan 2019 01:01:01 GMT'
-        result = fetch_repodata_remote_request(url, etag, mod_stamp)
-        assert result is None
+        raw_repodata_str, saved_fields = fetch_repodata_remote_request(url, etag, mod_stamp)
+        assert raw_repodata_str is None
+        assert saved_fields == {'_url': url}
 
     def test_fetch_repodata_remote_request_invalid_noarch(self):
         url = 'file:///fake/fake/fake/noarch'
@@ -181,6 +216,555 @@ class FetchLocalRepodataTests(TestCase):
             result = fetch_repodata_remote_request(url, etag, mod_stamp)
 
 
+class ProcessRawRepodataTests(TestCase):
+
+    def test_info_after_packages(self):
+        channel = Channel("https://conda.anaconda.org/conda-test/linux-64")
+        raw_repodata_str = """
+        {
+          "_etag": "\\"569c0ecb-48\\"",
+          "packages": {
+            "one-1.0-0.tar.bz2": {"name": "one", "version": "1.0", "build": "0",
+                                  "build_number": 0, "depends": ["two"]},
+            "two-2.0-0.tar.bz2": {"name": "two", "version": "2.0", "build": "0",
+                                  "build_number": 0, "depends": [],
+                                  "track_features": "feat"},
+            "two-3.0-0.tar.bz2": {"name": "two", "version": "3.0", "build": "0",
+                                  "build_number": 0, "depends": [], "record_version": 2}
+          },
+          "info": {"subdir": "linux-64", "arch": "x86_64", "platform": "linux"},
+          "repodata_version": 1
+        }
+        """
+        sd = SubdirData(channel)
+        state = sd._process_raw_repodata_str(raw_repodata_str)
+        assert state['_etag'] == '"569c0ecb-48"'
+        assert state['repodata_version'] == 1
+        assert sorted(sd._raw_names_index) == ['one', 'two']
+        assert len(sd._package_records) == 2
+        two = sd._get_records_by_name('two')[0]
+        assert two.version == "2.0"
+        assert two.arch == "x86_64"
+        assert two.url == "https://conda.anaconda.org/conda-test/linux-64/two-2.0-0.tar.bz2"
+        assert sd._get_records_by_track_feature('feat') == [two]
+
+    def test_records_materialized_on_query(self):
+        channel = Channel("https://conda.anaconda.org/conda-test/linux-64")
+        raw_repodata_str = """
+        {
+          "info": {"subdir": "linux-64"},
+          "packages": {
+            "one-1.0-0.tar.bz2": {"name": "one", "version": "1.0", "build": "0",
+                                  "build_number": 0, "depends": ["two"]},
+            "two-2.0-0.tar.bz2": {"name": "two", "version": "2.0", "build": "0",
+                                  "build_number": 0, "depends": []}
+          }
+        }
+        """
+        sd = SubdirData(channel)
+        sd._process_raw_repodata_str(raw_repodata_str)
+        sd._loaded = True
+        assert sd._names_index == {}
+        assert sd._internal_state['_raw_names_index']['one'][0][0] == "one-1.0-0.tar.bz2"
+
+        precs = tuple(sd.query("two"))
+        assert len(precs) == 1 and precs[0].name == "two"
+        assert list(sd._names_index) == ["two"]
+        assert tuple(sd.query("two")) == precs
+        assert sd._get_records_by_name("two")[0] is precs[0]
+
+        assert tuple(prec.name for prec in sd.query("o*")) == ("one",)
+        assert tuple(sd.query("nonexistent")) == ()
+
+    def test_query_many(self):
+        channel = Channel("https://conda.anaconda.org/conda-test/linux-64")
+        sd = SubdirData(channel)
+        sd._process_raw_repodata_str(json.dumps({
+            "info": {"subdir": "linux-64"},
+            "packages": dict((
+                make_package_info("numpy", "1.1", ["python"]),
+                make_package_info("numpy", "1.2", ["python"]),
+                make_package_info("numpy-base", "1.2"),
+                make_package_info("python", "3.7"),
+            )),
+        }))
+        sd._loaded = True
+        precs = sd.query_many(["python", "numpy", "nonexistent"])
+        assert sorted((prec.name, prec.version) for prec in precs) == [
+            ("numpy", "1.1"), ("numpy", "1.2"), ("python", "3.7"),
+        ]
+        for name in ("python", "numpy-*"):
+            assert sd.query_many([name]) == list(sd.query(name))
+        assert sd.query_many() == []
+
+    def test_query_filters_by_columns(self):
+        channel = Channel("https://conda.anaconda.org/conda-test/linux-64")
+        sd = SubdirData(channel)
+        packages = [make_package_info("numpy", version, build_number=build_number)
+                    for version in ("1.1", "1.2", "1.10")
+                    for build_number in (0, 1, 2)]
+        packages = [("numpy-%s-%d.tar.bz2" % (info["version"], info["build_number"]),
+                     dict(info, build="py37_%d" % info["build_number"]))
+                    for _, info in packages]
+        packages.append(make_package_info("numpy-base", "1.2", md5="0" * 32))
+        sd._process_raw_repodata_str(json.dumps({
+            "info": {"subdir": "linux-64"},
+            "packages": dict(packages),
+        }))
+        sd._loaded = True
+
+        columns = sd._get_columns_by_name("numpy")
+        assert len(columns) == 9
+        assert sorted(columns.values["version"]) == ["1.1", "1.10", "1.2"]
+        assert sorted(columns.values["build_number"]) == [0, 1, 2]
+
+        precs = list(sd.query("numpy >=1.2"))
+        assert sorted((prec.version, prec.build_number) for prec in precs) == [
+            ("1.10", 0), ("1.10", 1), ("1.10", 2), ("1.2", 0), ("1.2", 1), ("1.2", 2),
+        ]
+        for spec in ("numpy >=1.2[build_number='>0']", "numpy 1.1 py37_2",
+                     "numpy[build=py37_*, build_number=1]", "numpy-*[version='>=1.2']",
+                     "numpy-base[md5=%s]" % ("0" * 32), "numpy-base[md5=%s]" % ("1" * 32)):
+            spec = MatchSpec(spec)
+            assert list(sd.query(spec)) == [prec for prec in sd.iter_records()
+                                            if spec.match(prec)], spec
+
+    def test_repeated_values_are_shared(self):
+        channel = Channel("https://conda.anaconda.org/conda-test/linux-64")
+        sd = SubdirData(channel)
+        sd._process_raw_repodata_str(json.dumps({
+            "info": {"subdir": "linux-64"},
+            "packages": dict((
+                make_package_info("numpy", "1.1", ["python >=3.7,<3.8.0a0"], license="BSD"),
+                make_package_info("scipy", "1.1", ["python >=3.7,<3.8.0a0"], license="BSD"),
+            )),
+        }))
+        sd._loaded = True
+        numpy, = sd.query("numpy")
+        scipy, = sd.query("scipy")
+        assert numpy.depends == ("python >=3.7,<3.8.0a0",)
+        assert numpy.depends is scipy.depends
+        assert numpy.license is scipy.license
+        assert numpy.version is scipy.version
+
+    def test_empty_repodata(self):
+        sd = SubdirData(Channel("https://conda.anaconda.org/conda-test/linux-64"))
+        for raw_repodata_str in (None, '', '{}', '{"packages": {}}'):
+            state = sd._process_raw_repodata_str(raw_repodata_str)
+            assert state['_raw_names_index'] == {}
+            assert sd._package_records == []
+            assert state['repodata_version'] == 0
+
+    def test_repodata_version_too_new(self):
+        sd = SubdirData(Channel("https://conda.anaconda.org/conda-test/linux-64"))
+        with pytest.raises(CondaUpgradeError):
+            sd._process_raw_repodata_str('{"repodata_version": 2, "packages": {}}')
+
+
+class RepodataIndexTests(TestCase):
+
+    def test_write_and_map_repodata_index(self):
+        channel = Channel("https://conda.anaconda.org/conda-test/linux-64")
+        raw_repodata_str = json.dumps({
+            "_etag": "abc",
+            "info": {"subdir": "linux-64"},
+            "packages": dict((
+                make_package_info("zlib", "1.2"),
+                make_package_info("numpy", "1.1", ["python"], track_features="nomkl"),
+                make_package_info("python", "3.7"),
+                make_package_info("numpy", "1.2", ["python"]),
+            )),
+        })
+        sd = SubdirData(channel)
+        state = sd._process_raw_repodata_str(raw_repodata_str)
+        with tempdir() as td:
+            path = join(td, "index.idx")
+            write_repodata_index(path, state)
+            mapped = MappedRepodataIndex(path)
+            try:
+                assert mapped.meta['_etag'] == "abc"
+                assert mapped.meta['_track_features_index'] == {"nomkl": ["numpy"]}
+                assert mapped.meta['_meta_in_common']['subdir'] == "linux-64"
+                assert len(mapped) == 3
+                assert list(mapped) == list(state['_raw_names_index'])
+                assert "numpy" in mapped and "scipy" not in mapped
+                assert mapped.get("scipy") is None
+                assert [fn for fn, _ in mapped["numpy"]] == [
+                    fn for fn, _ in state['_raw_names_index']["numpy"]
+                ]
+                assert mapped["python"][0][1]["version"] == "3.7"
+            finally:
+                mapped.close()
+
+    def test_subdir_data_loads_from_index(self):
+        with local_channels([("channel", (
+            make_package_info("one", "1.0", ["two"]),
+            make_package_info("two", "2.0"),
+        ))]) as (td, _):
+            channel = Channel(path_to_url(join(td, "channel", "linux-64")))
+            sd = SubdirData(channel).load()
+            assert isfile(sd.cache_path_index)
+            assert [prec.name for prec in sd.query("two")] == ["two"]
+
+            with gzip.open(sd.cache_path_json, 'rb') as fh:
+                assert sorted(json.loads(fh.read().decode('utf-8'))["packages"]) == [
+                    "one-1.0-0.tar.bz2", "two-2.0-0.tar.bz2",
+                ]
+            with open(sd.cache_path_headers) as fh:
+                assert json.load(fh)['_url'] == sd.url_w_credentials
+
+            headers = read_mod_and_etag(sd.cache_path_headers)
+            sd2 = SubdirData(channel)
+            state = sd2._read_local_repdata(headers.get('_etag'), headers.get('_mod'))
+            assert isinstance(state['_raw_names_index'], MappedRepodataIndex)
+            assert sorted(state['_raw_names_index']) == ["one", "two"]
+            assert sd2._read_index("wrong-etag", headers.get('_mod')) is None
+            state['_raw_names_index'].close()
+
+
+class LocalChannelCacheTests(TestCase):
+
+    def test_unchanged_local_channel_uses_caches(self):
+        with local_channels([("channel", (make_package_info("six", "1.0"),))]) as (td, _):
+            channel_root = join(td, "channel")
+            channel = Channel(path_to_url(channel_root) + "/linux-64")
+            sd = SubdirData(channel).load()
+            assert SubdirData(channel) is sd and sd._loaded
+            assert sd.cache_expires_in() == float('inf')
+
+            import conda.core.subdir_data
+            with patch.object(conda.core.subdir_data,
+                              'fetch_repodata_remote_request') as remote_request:
+                sd.load()
+                assert remote_request.call_count == 0
+            assert [prec.version for prec in sd.query("six")] == ["1.0"]
+
+            write_local_repodata(channel_root, "linux-64", (
+                make_package_info("six", "1.0"),
+                make_package_info("six", "1.1"),
+            ))
+            assert SubdirData(channel) is sd and not sd._loaded
+            assert sd.cache_expires_in() == 0
+            assert sorted(prec.version for prec in sd.query("six")) == ["1.0", "1.1"]
+
+    def test_replaced_index_is_closed(self):
+        with local_channels([("channel", (make_package_info("six", "1.0"),))]) as (td, _):
+            channel_root = join(td, "channel")
+            channel = Channel(path_to_url(channel_root) + "/linux-64")
+            sd = SubdirData(channel).load().reload()
+            mapped_index = sd._raw_names_index
+            assert isinstance(mapped_index, MappedRepodataIndex)
+
+            write_local_repodata(channel_root, "linux-64", (
+                make_package_info("six", "1.0"),
+                make_package_info("six", "1.1"),
+            ))
+            assert SubdirData(channel) is sd and not sd._loaded
+            assert sorted(prec.version for prec in sd.query("six")) == ["1.0", "1.1"]
+            assert mapped_index._mmap.closed
+            assert sd._raw_names_index is not mapped_index
+
+
+class SqliteRepodataIndexTests(TestCase):
+
+    def test_write_and_query_sqlite_index(self):
+        channel = Channel("https://conda.anaconda.org/conda-test/linux-64")
+        raw_repodata_str = json.dumps({
+            "_etag": "abc",
+            "info": {"subdir": "linux-64"},
+            "packages": dict((
+                make_package_info("numpy", "1.1", ["python"], track_features="nomkl",
+                                  sha256="aa" * 32),
+                make_package_info("numpy-base", "1.1", ["python"]),
+                make_package_info("python", "3.7"),
+                make_package_info("numpy", "1.2", ["python"]),
+            )),
+        })
+        sd = SubdirData(channel)
+        state = sd._process_raw_repodata_str(raw_repodata_str)
+        with tempdir() as td:
+            path = join(td, "index.sqlite")
+            write_repodata_sqlite(path, state)
+            index = SqliteRepodataIndex(path)
+            try:
+                assert index.meta['_etag'] == "abc"
+                assert index.meta['_track_features_index'] == {"nomkl": ["numpy"]}
+                assert list(index) == list(state['_raw_names_index'])
+                assert len(index) == 3
+                assert "python" in index and "scipy" not in index
+                assert [fn for fn, _ in index["numpy"]] == [
+                    fn for fn, _ in state['_raw_names_index']["numpy"]
+                ]
+                assert sorted(index.glob_names("num*")) == ["numpy", "numpy-base"]
+                assert index.get_by_sha256("aa" * 32)[0][1]["version"] == "1.1"
+            finally:
+                index.close()
+
+    def test_subdir_data_sqlite_backend(self):
+        with local_channels([("channel", (
+            make_package_info("numpy", "1.1", ["python"]),
+            make_package_info("numpy-base", "1.1"),
+            make_package_info("python", "3.7"),
+        ))], CONDA_REPODATA_CACHE_BACKEND='sqlite') as (td, _):
+            channel = Channel(path_to_url(join(td, "channel", "linux-64")))
+            SubdirData(channel).load()
+            with env_var('CONDA_USE_INDEX_CACHE', 'true',
+                         stack_callback=conda_tests_ctxt_mgmt_def_pol):
+                sd = SubdirData(channel).load()
+            assert sd.cache_path_index.endswith('.sqlite')
+            assert isinstance(sd._raw_names_index, SqliteRepodataIndex)
+            assert sorted(prec.name for prec in sd.query("numpy*")) == [
+                "numpy", "numpy-base"
+            ]
+            assert [prec.version for prec in sd.query("python")] == ["3.7"]
+            sd._raw_names_index.close()
+
+
+class RepodataPatchTests(TestCase):
+
+    def load_patched(self, files_v1, files_v2):
+        with repodata_stand_in_server() as server, tempdir() as td:
+            url = "http://127.0.0.1:%d/channel/linux-64" % server.server_address[1]
+            server.files.update(files_v1)
+            with env_var('CONDA_PKGS_DIRS', join(td, "pkgs"),
+                         stack_callback=conda_tests_ctxt_mgmt_def_pol), \
+                    env_var('CONDA_LOCAL_REPODATA_TTL', '0',
+                            stack_callback=conda_tests_ctxt_mgmt_def_pol), \
+                    env_var('CONDA_USE_REPODATA_PATCHES', 'true',
+                            stack_callback=conda_tests_ctxt_mgmt_def_pol):
+                sd = SubdirData(Channel(url)).load()
+                assert sd._internal_state['_etag'] == '"v1"'
+                server.files.clear()
+                server.files.update(files_v2)
+                sd.reload()
+                names = sorted(prec.name for prec in sd.iter_records())
+                with gzip.open(sd.cache_path_json, 'rb') as fh:
+                    cached_repodata = json.loads(fh.read().decode('utf-8'))
+                headers = read_mod_and_etag(sd.cache_path_headers)
+                index = MappedRepodataIndex(sd.cache_path_index)
+                index_names = sorted(index)
+                index.close()
+            return sd, names, cached_repodata, headers, index_names, server.requested_paths
+
+    def test_update_from_patches(self):
+        packages_v1 = dict((
+            make_package_info("numpy", "1.1", ["python"], track_features="nomkl"),
+            make_package_info("python", "3.7"),
+            make_package_info("six", "1.0"),
+        ))
+        repodata_v1 = json.dumps({"info": {"subdir": "linux-64"}, "packages": packages_v1})
+        numpy_fn, numpy_info = make_package_info("numpy", "1.2", ["python"])
+        patches = json.dumps({
+            "latest": '"v3"',
+            "patches": [
+                {"from": '"v2"', "to": '"v3"', "patch": [
+                    {"op": "add", "path": "/packages/%s" % numpy_fn, "value": numpy_info},
+                ]},
+                {"from": '"v1"', "to": '"v2"', "mod": "Wed, 01 Jan 2020 00:00:00 GMT",
+                 "patch": [
+                     {"op": "remove", "path": "/packages/numpy-1.1-0.tar.bz2"},
+                 ]},
+            ],
+        })
+        sd, names, cached_repodata, headers, index_names, requested_paths = self.load_patched(
+            {"/channel/linux-64/repodata.json": (repodata_v1, '"v1"')},
+            {"/channel/linux-64/%s" % REPODATA_PATCHES_FN: (patches, None)},
+        )
+
+        # the full repodata.json was only downloaded once
+        assert requested_paths.count("/channel/linux-64/repodata.json") == 1
+        assert names == ["numpy", "python", "six"]
+        assert [prec.version for prec in sd.query("numpy")] == ["1.2"]
+        assert sd._track_features_index == {}
+        assert sorted(cached_repodata["packages"]) == sorted(
+            [numpy_fn, "python-3.7-0.tar.bz2", "six-1.0-0.tar.bz2"]
+        )
+        # the cache holds the patched document as published, not as indexed
+        assert cached_repodata["packages"]["python-3.7-0.tar.bz2"]["depends"] == []
+        assert headers["_etag"] == '"v3"' and "_mod" not in headers
+        assert sd._internal_state["_etag"] == '"v3"'
+        assert index_names == ["numpy", "python", "six"]
+
+    def test_full_fetch_without_patch_chain(self):
+        repodata_v1 = json.dumps({"info": {"subdir": "linux-64"}, "packages": dict((
+            make_package_info("six", "1.0"),
+        ))})
+        repodata_v2 = json.dumps({"info": {"subdir": "linux-64"}, "packages": dict((
+            make_package_info("six", "1.1"),
+        ))})
+        patches = json.dumps({"latest": '"v2"', "patches": []})
+        sd, names, cached_repodata, headers, index_names, requested_paths = self.load_patched(
+            {"/channel/linux-64/repodata.json": (repodata_v1, '"v1"')},
+            {"/channel/linux-64/repodata.json": (repodata_v2, '"v2"'),
+             "/channel/linux-64/%s" % REPODATA_PATCHES_FN: (patches, None)},
+        )
+
+        assert requested_paths.count("/channel/linux-64/repodata.json") == 2
+        assert [prec.version for prec in sd.query("six")] == ["1.1"]
+        assert headers["_etag"] == '"v2"'
+
+
+class RepodataCacheLockTests(TestCase):
+
+    def test_waiting_process_reads_refreshed_cache(self):
+        repodata = json.dumps({"info": {"subdir": "linux-64"}, "packages": dict((
+            make_package_info("six", "1.0"),
+        ))})
+        with repodata_stand_in_server() as server, tempdir() as td:
+            url = "http://127.0.0.1:%d/channel/linux-64" % server.server_address[1]
+            server.files["/channel/linux-64/repodata.json"] = (repodata, '"v1"')
+            with env_var('CONDA_PKGS_DIRS', join(td, "pkgs"),
+                         stack_callback=conda_tests_ctxt_mgmt_def_pol), \
+                    env_var('CONDA_LOCAL_REPODATA_TTL', '60',
+                            stack_callback=conda_tests_ctxt_mgmt_def_pol):
+                sd = SubdirData(Channel(url)).load()
+                assert not [fn for fn in os.listdir(join(td, "pkgs", "cache"))
+                            if fn.endswith(".tmp")]
+
+                # expire the cache, and refresh it "from another process" while the lock
+                # is held; the waiting load must not fetch the repodata again
+                expired = time() - 3600
+                os.utime(sd.cache_path_headers, (expired, expired))
+                loaded = []
+                thread = Thread(target=lambda: loaded.append(sd.reload()))
+                with file_lock(sd.cache_path_base + '.lock'):
+                    thread.start()
+                    thread.join(0.2)
+                    os.utime(sd.cache_path_headers, None)
+                thread.join(5)
+
+            assert loaded and [prec.version for prec in sd.query("six")] == ["1.0"]
+            assert server.requested_paths == ["/channel/linux-64/repodata.json"]
+
+
+class RepodataShardTests(TestCase):
+
+    packages = (
+        make_package_info("app", "1.0", ["libfoo"]),
+        make_package_info("libfoo", "1.0", ["libc"]),
+        make_package_info("libfoo", "2.0", ["libc"]),
+        make_package_info("libc", "1.0"),
+        make_package_info("unrelated", "1.0"),
+    )
+
+    @contextmanager
+    def sharded_channel(self, files):
+        with repodata_stand_in_server() as server, tempdir() as td:
+            url = "http://127.0.0.1:%d/channel/linux-64" % server.server_address[1]
+            server.files.update(("/channel/linux-64/%s" % path, (body, '"%s"' % path))
+                                for path, body in iteritems(files))
+            with env_var('CONDA_PKGS_DIRS', join(td, "pkgs"),
+                         stack_callback=conda_tests_ctxt_mgmt_def_pol), \
+                    env_var('CONDA_LOCAL_REPODATA_TTL', '0',
+                            stack_callback=conda_tests_ctxt_mgmt_def_pol), \
+                    env_var('CONDA_USE_REPODATA_SHARDS', 'true',
+                            stack_callback=conda_tests_ctxt_mgmt_def_pol):
+                yield url, server
+
+    def test_only_requested_shards_are_fetched(self):
+        with self.sharded_channel(make_repodata_shards("linux-64", self.packages)) as (url, server):
+            sd = SubdirData(Channel(url)).load()
+            assert isinstance(sd._raw_names_index, ShardedRepodataIndex)
+            assert sorted(sd._raw_names_index) == ["app", "libc", "libfoo", "unrelated"]
+            precs = sd.query_many(["app", "libfoo"])
+            assert sorted((prec.name, prec.version) for prec in precs) == [
+                ("app", "1.0"), ("libfoo", "1.0"), ("libfoo", "2.0"),
+            ]
+            assert url + "/app-1.0-0.tar.bz2" in [prec.url for prec in precs]
+            assert sorted(server.requested_paths) == [
+                "/channel/linux-64/%s" % REPODATA_SHARDS_FN,
+                "/channel/linux-64/shards/app.json",
+                "/channel/linux-64/shards/libfoo.json",
+            ]
+
+    def test_listing_all_records_uses_repodata_json(self):
+        files = make_repodata_shards("linux-64", self.packages)
+        files["repodata.json"] = json.dumps({"info": {"subdir": "linux-64"},
+                                             "packages": dict(self.packages)})
+        with self.sharded_channel(files) as (url, server):
+            sd = SubdirData(Channel(url)).load()
+            assert isinstance(sd._raw_names_index, ShardedRepodataIndex)
+            assert len(list(sd.iter_records())) == len(self.packages)
+            assert not isinstance(sd._raw_names_index, ShardedRepodataIndex)
+            assert server.requested_paths == [
+                "/channel/linux-64/%s" % REPODATA_SHARDS_FN,
+                "/channel/linux-64/repodata.json",
+            ]
+
+    def test_cached_shards_are_revalidated_with_etags(self):
+        with self.sharded_channel(make_repodata_shards("linux-64", self.packages)) as (url, server):
+            sd = SubdirData(Channel(url)).load()
+            assert [prec.version for prec in sd.query("libc")] == ["1.0"]
+            shard_cache_path = sd._raw_names_index.shard_cache_path("libc")
+            with open(shard_cache_path) as fh:
+                assert json.load(fh)["_etag"] == '"shards/libc.json"'
+
+            # the channel answers 304 for the cached manifest and shard, so both are read
+            # from the local cache
+            del server.requested_paths[:]
+            sd.reload()
+            assert [prec.version for prec in sd.query("libc")] == ["1.0"]
+            assert sorted(server.requested_paths) == [
+                "/channel/linux-64/%s" % REPODATA_SHARDS_FN,
+                "/channel/linux-64/shards/libc.json",
+            ]
+
+    def test_channel_without_shards_uses_repodata_json(self):
+        repodata = json.dumps({"info": {"subdir": "linux-64"}, "packages": dict(self.packages)})
+        with self.sharded_channel({"repodata.json": repodata}) as (url, server):
+            sd = SubdirData(Channel(url)).load()
+            assert not isinstance(sd._raw_names_index, ShardedRepodataIndex)
+            assert [prec.version for prec in sd.query("app")] == ["1.0"]
+            sd.reload()
+            assert server.requested_paths == [
+                "/channel/linux-64/%s" % REPODATA_SHARDS_FN,
+                "/channel/linux-64/repodata.json",
+                "/channel/linux-64/repodata.json",
+            ]
+
+    def test_missing_manifest_is_remembered_with_the_cache(self):
+        repodata = json.dumps({"info": {"subdir": "linux-64"}, "packages": dict(self.packages)})
+        with self.sharded_channel({"repodata.json": repodata}) as (url, server), \
+                env_var('CONDA_LOCAL_REPODATA_TTL', '3600',
+                        stack_callback=conda_tests_ctxt_mgmt_def_pol):
+            channel = Channel(url)
+            SubdirData(channel).load()
+            del SubdirData._cache_[channel.url(with_credentials=True)]
+            sd = SubdirData(channel).load()
+            assert [prec.version for prec in sd.query("app")] == ["1.0"]
+            assert server.requested_paths == [
+                "/channel/linux-64/%s" % REPODATA_SHARDS_FN,
+                "/channel/linux-64/repodata.json",
+            ]
+
+    def test_manifest_server_error_uses_repodata_json(self):
+        repodata = json.dumps({"info": {"subdir": "linux-64"}, "packages": dict(self.packages)})
+        files = {REPODATA_SHARDS_FN: None, "repodata.json": repodata}
+        with self.sharded_channel(files) as (url, server):
+            sd = SubdirData(Channel(url)).load()
+            assert not isinstance(sd._raw_names_index, ShardedRepodataIndex)
+            assert [prec.version for prec in sd.query("app")] == ["1.0"]
+
+    def test_local_sharded_channel(self):
+        with tempdir() as td:
+            subdir_path = join(td, "channel", "linux-64")
+            os.makedirs(join(subdir_path, "shards"))
+            for path, body in iteritems(make_repodata_shards("linux-64", self.packages)):
+                with open(join(subdir_path, path), "w") as fh:
+                    fh.write(body)
+            with env_var('CONDA_PKGS_DIRS', join(td, "pkgs"),
+                         stack_callback=conda_tests_ctxt_mgmt_def_pol), \
+                    env_var('CONDA_USE_REPODATA_SHARDS', 'true',
+                            stack_callback=conda_tests_ctxt_mgmt_def_pol):
+                channel = Channel(path_to_url(subdir_path))
+                sd = SubdirData(channel).load()
+                assert sorted(prec.version for prec in sd.query("libfoo")) == ["1.0", "2.0"]
+                assert SubdirData(channel) is sd and sd._loaded
+                assert sorted(os.listdir(sd.cache_path_shards)) == [
+                    os.path.basename(sd._raw_names_index.shard_cache_path("libfoo"))
+                ]
+
+
 # @pytest.mark.integration
 # class SubdirDataTests(TestCase):
 #
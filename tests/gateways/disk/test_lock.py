@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 Anaconda, Inc
+# SPDX-License-Identifier: BSD-3-Clause
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from os.path import join
+from threading import Thread
+
+from conda.gateways.disk.lock import file_lock
+from tests.helpers import tempdir
+
+
+def test_file_lock_waits_for_holder():
+    with tempdir() as td:
+        lock_path = join(td, "cache.lock")
+        events = []
+
+        def contend():
+            with file_lock(lock_path):
+                events.append("second")
+
+        with file_lock(lock_path):
+            thread = Thread(target=contend)
+            thread.start()
+            thread.join(0.2)
+            assert thread.is_alive()
+            events.append("first")
+        thread.join(5)
+        assert events == ["first", "second"]
+
+
+def test_file_lock_without_lock_file():
+    with tempdir() as td:
+        with file_lock(join(td, "missing-dir", "cache.lock")):
+            pass
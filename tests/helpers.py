@@ -6,19 +6,21 @@ from __future__ import absolute_import, division, print_function
 from contextlib import contextmanager
 import json
 import os
-from os.path import dirname, join, abspath
+from os.path import dirname, isdir, join, abspath
 import re
 from shlex import split
 from conda._vendor.auxlib.compat import shlex_split_unicode
 import sys
 from tempfile import gettempdir
+from threading import Thread
 from uuid import uuid4
 
 from conda import cli
 from conda._vendor.auxlib.decorators import memoize
 from conda.base.context import context, reset_context, conda_tests_ctxt_mgmt_def_pol
 from conda.common.compat import iteritems, itervalues, encode_arguments
-from conda.common.io import argv, captured, captured as common_io_captured, env_var
+from conda.common.io import argv, captured, captured as common_io_captured, env_var, env_vars
+from conda.common.url import path_to_url
 from conda.core.subdir_data import SubdirData, make_feature_record
 from conda.gateways.disk.delete import rm_rf
 from conda.gateways.disk.read import lexists
@@ -37,6 +39,11 @@ except ImportError:
     import mock
     from mock import patch
 
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
 TEST_DATA_DIR = abspath(join(dirname(__file__), "..", "test_data"))
 
 expected_error_prefix = 'Using Anaconda Cloud api site https://api.anaconda.org'
@@ -124,6 +131,92 @@ def tempdir():
             rm_rf(prefix)
 
 
+def make_package_info(name, version, depends=(), **kwargs):
+    info = {
+        "name": name,
+        "version": version,
+        "build": "0",
+        "build_number": 0,
+        "depends": list(depends),
+    }
+    info.update(kwargs)
+    return "%s-%s-0.tar.bz2" % (name, version), info
+
+
+def write_local_repodata(channel_root, subdir, packages):
+    subdir_path = join(channel_root, subdir)
+    if not isdir(subdir_path):
+        os.makedirs(subdir_path)
+    repodata = {
+        "info": {"subdir": subdir},
+        "packages": dict(packages),
+    }
+    with open(join(subdir_path, "repodata.json"), "w") as fh:
+        json.dump(repodata, fh)
+    return join(subdir_path, "repodata.json")
+
+
+@contextmanager
+def local_channels(channel_packages, **env):
+    # writes each (channel name, linux-64 packages) pair as a local channel with an empty
+    # noarch, and points CONDA_PKGS_DIRS into the same tempdir; yields (tempdir, channels)
+    with tempdir() as td:
+        channels = []
+        for channel_name, packages in channel_packages:
+            channel_root = join(td, channel_name)
+            write_local_repodata(channel_root, "linux-64", packages)
+            write_local_repodata(channel_root, "noarch", ())
+            channels.append(Channel(path_to_url(channel_root)))
+        env['CONDA_PKGS_DIRS'] = join(td, "pkgs")
+        with env_vars(env, stack_callback=conda_tests_ctxt_mgmt_def_pol):
+            yield td, channels
+
+
+class _StandInRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.requested_paths.append(self.path)
+        try:
+            body, etag = self.server.files[self.path]
+        except KeyError:
+            self.send_error(404)
+            return
+        if body is None:
+            self.send_error(500)
+            return
+        if etag and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if etag:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def repodata_stand_in_server():
+    # serves server.files, a {path: (body, etag)} dict, over plain http on localhost
+    server = HTTPServer(("127.0.0.1", 0), _StandInRequestHandler)
+    server.files = {}
+    server.requested_paths = []
+    thread = Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
 def supplement_index_with_repodata(index, repodata, channel, priority):
     repodata_info = repodata['info']
     arch = repodata_info.get('arch')
@@ -9,14 +9,20 @@ import pytest
 from conda import text_type
 from conda.base.context import context, conda_tests_ctxt_mgmt_def_pol
 from conda.cli.common import arg2spec, spec_from_line
-from conda.common.io import env_unmodified
+from conda.common.io import ThreadLimitedThreadPoolExecutor, env_unmodified
 from conda.common.compat import on_win
 from conda.exceptions import CondaValueError, InvalidMatchSpec, InvalidSpec
 from conda.models.channel import Channel
 from conda.models.dist import Dist
 from conda.models.records import PackageRecord
-from conda.models.match_spec import ChannelMatch, MatchSpec, _parse_spec_str
-from conda.models.version import VersionSpec
+from conda.models.match_spec import (ChannelMatch, MatchSpec, _DEPENDS_CACHE,
+                                     _depends_match_spec, _parse_spec_str)
+from conda.models.version import VersionOrder, VersionSpec
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
 
 
 blas_value = 'accelerate' if context.subdir == 'osx-64' else 'openblas'
@@ -466,6 +472,47 @@ class MatchSpecTests(TestCase):
         assert MatchSpec("*[license='*gpl*']").match(record)
         assert MatchSpec("*[license='*v3+']").match(record)
 
+    def test_match_group(self):
+        precs = [DPkg('numpy-%s-py27_%d.tar.bz2' % (version, build_number))
+                 for version in ('1.5.1', '1.6.2', '1.7', '1.7.0', '1.7.1', '1.10.4', '2.0.0a1')
+                 for build_number in (0, 1)]
+        versions = sorted(set(prec.version for prec in precs), key=VersionOrder)
+        sorted_versions = [VersionOrder(v) for v in versions], versions
+        for spec_str in ('numpy', 'numpy 1.7*', 'numpy >=1.7', 'numpy >1.7', 'numpy <1.7',
+                         'numpy <=1.7', 'numpy ==1.7', 'numpy >=1.6,<2', 'numpy 1.5*|>1.7',
+                         'numpy !=1.7.1', 'numpy >=2.0.0a0', 'numpy >2', 'numpy 1.7.1 py27_1',
+                         'numpy[build_number=0]', "numpy[version='>1.6', build_number='>0']"):
+            spec = MatchSpec(spec_str)
+            expected = tuple(prec for prec in precs if spec.match(prec))
+            assert spec.match_group(precs) == expected, spec_str
+            assert spec.match_group(precs, sorted_versions) == expected, spec_str
+
+    def test_depends_match_specs_are_shared(self):
+        rec1 = DPkg('numpy-1.7.1-py27_0.tar.bz2', depends=['python 2.7*', 'mkl'],
+                    constrains=['scipy >=0.12'])
+        rec2 = DPkg('numpy-1.7.1-py27_1.tar.bz2', depends=['python 2.7*', 'mkl'],
+                    constrains=['scipy >=0.12'])
+        specs1 = sorted(rec1.combined_depends, key=lambda ms: ms.name)
+        specs2 = sorted(rec2.combined_depends, key=lambda ms: ms.name)
+        assert [text_type(ms) for ms in specs1] == ['mkl', 'python=2.7', "scipy[version='>=0.12']"]
+        assert all(ms1 is ms2 for ms1, ms2 in zip(specs1, specs2))
+        assert specs1[2].optional and not specs1[1].optional
+        assert _depends_match_spec('python 2.7*') is specs1[1]
+        assert _depends_match_spec('python 2.7*', optional=True) is not specs1[1]
+
+        with patch('conda.models.match_spec._DEPENDS_CACHE_MAX_SIZE', 2):
+            for spec_str in ('a', 'b', 'c'):
+                _depends_match_spec(spec_str)
+            assert len(_DEPENDS_CACHE) == 2
+            assert list(_DEPENDS_CACHE) == [('b', False), ('c', False)]
+
+    def test_depends_match_specs_are_shared_across_threads(self):
+        spec_strs = ['threaded-%d >=1.%d' % (n % 50, n % 3) for n in range(2000)]
+        with ThreadLimitedThreadPoolExecutor(8) as executor:
+            specs = list(executor.map(_depends_match_spec, spec_strs))
+        for spec_str, ms in zip(spec_strs, specs):
+            assert ms is _depends_match_spec(spec_str)
+
 
 class TestArg2Spec(TestCase):
 
@@ -3,7 +3,8 @@ from itertools import chain, combinations, permutations, product
 import pytest
 
 from conda.common.compat import iteritems, string_types
-from conda.common.logic import (Clauses, evaluate_eq, minimal_unsatisfiable_subset)
+from conda.common.logic import (Clauses, PySatSolver, evaluate_eq,
+                                minimal_unsatisfiable_subset)
 from tests.helpers import raises
 
 
@@ -289,6 +290,22 @@ def test_minimize():
     assert sval == 11
 
 
+def test_unsat_core():
+    groups = [[(1,)], [(-1, 2)], [(3,)], [(-2,)], [(4,)]]
+    C = Clauses(4)
+    assert not C.supports_unsat_core
+    assert raises(NotImplementedError, lambda: C.unsat_core(groups))
+    assert C.m == 4 and C.get_clause_count() == 0
+
+    pytest.importorskip('pysat')
+    C = Clauses(4, sat_solver_cls=PySatSolver)
+    assert C.supports_unsat_core
+    assert C.unsat_core(groups) == [0, 1, 3]
+    assert C.m == 4 and C.get_clause_count() == 0
+    assert C.unsat_core(groups[:3]) is None
+    assert C.unsat_core([[(1,)], [(False,), (True,)]]) == [1]
+
+
 def test_minimal_unsatisfiable_subset():
     def sat(val):
         return Clauses(max(abs(v) for v in chain(*val))).sat(val)
@@ -14,10 +14,16 @@ from conda.exceptions import UnsatisfiableError
 from conda.gateways.disk.read import read_python_record
 from conda.models.channel import Channel
 from conda.models.enums import PackageType
+from conda.models.index import Index
 from conda.models.records import PackageRecord
 from conda.resolve import MatchSpec, Resolve, ResolvePackageNotFound
 from .helpers import TEST_DATA_DIR, get_index_r_1, get_index_r_4, raises
 
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
 index, r, = get_index_r_1()
 f_mkl = set(['mkl'])
 
@@ -178,6 +184,52 @@ def test_get_reduced_index_unmanageable():
     assert len(new_r2.groups["requests"]) == 1, new_r2.groups["requests"]
 
 
+def test_resolve_shares_index_groups():
+    package_index = Index(index)
+    r1 = Resolve(package_index, channels=r.channels)
+    assert Resolve(package_index, channels=r.channels).groups is r1.groups
+    assert r1.groups == r.groups
+    assert r1.trackers == r.trackers
+
+    reduced_index = r1.get_reduced_index((MatchSpec("anaconda 1.5.0"), ))
+    assert isinstance(reduced_index, Index)
+    r2 = Resolve(reduced_index, True, channels=r.channels)
+    expected = Resolve(dict(reduced_index), True, channels=r.channels)
+    assert r2.groups == expected.groups
+    assert all(r2.groups[name] == [prec for prec in r1.groups[name] if prec in reduced_index]
+               for name in r2.groups if not name.endswith('@'))
+
+    C = r2.gen_clauses()
+    assert r2.generate_version_metrics(C, ['numpy']) == expected.generate_version_metrics(
+        C, ['numpy'])
+    ranks = reduced_index.version_ranks('numpy', r2.version_key, r2._version_key_id)
+    assert [prec for prec, _, _, _, _ in ranks] == r2.groups['numpy']
+    assert Resolve(reduced_index, True, channels=r.channels)._index.version_ranks(
+        'numpy', r2.version_key, r2._version_key_id) is ranks
+
+    prec = next(prec for prec in itervalues(package_index) if prec.get('md5'))
+    assert "mkl" in package_index.trackers
+    package_index[prec] = PackageRecord.from_objects(prec, sha256="0" * 64)
+    assert package_index.sha256_map == {"0" * 64: package_index[prec]}
+    del package_index[prec]
+    assert package_index.sha256_map == {}
+    assert prec not in Resolve(package_index, channels=r.channels).groups[prec.name]
+
+
+def test_get_reduced_index_prunes_transitive_conflicts():
+    # anaconda 1.4.0 for py27 pins llvmpy 0.11.1, while its bitey pins llvmpy 0.8.3
+    reduced_index = r.get_reduced_index((MatchSpec('anaconda'), ))
+    dist_strs = set(prec.dist_str() for prec in reduced_index)
+    assert 'channel-1::anaconda-1.4.0-np17py27_0' not in dist_strs
+    assert 'channel-1::bitey-0.0-py27_0' not in dist_strs
+    assert 'channel-1::anaconda-1.4.0-np17py26_0' in dist_strs
+    assert 'channel-1::anaconda-1.5.0-np17py27_0' in dist_strs
+
+    # a conflict among the specs leaves the index unpruned for the solver to report
+    reduced_index = r.get_reduced_index((MatchSpec('numpy 1.5*'), MatchSpec('python 3*')))
+    assert any(prec.name == 'numpy' for prec in reduced_index)
+
+
 def test_generate_eq_1():
     reduced_index = r.get_reduced_index((MatchSpec('anaconda'), ))
     r2 = Resolve(reduced_index, True)
@@ -198,168 +250,100 @@ def test_generate_eq_1():
     assert eqc == {}
     assert eqv == {
         'channel-1::anaconda-1.4.0-np15py26_0': 1,
-        'channel-1::anaconda-1.4.0-np15py27_0': 1,
         'channel-1::anaconda-1.4.0-np16py26_0': 1,
-        'channel-1::anaconda-1.4.0-np16py27_0': 1,
         'channel-1::anaconda-1.4.0-np17py26_0': 1,
-        'channel-1::anaconda-1.4.0-np17py27_0': 1,
         'channel-1::anaconda-1.4.0-np17py33_0': 1,
         'channel-1::astropy-0.2-np15py26_0': 1,
-        'channel-1::astropy-0.2-np15py27_0': 1,
         'channel-1::astropy-0.2-np16py26_0': 1,
-        'channel-1::astropy-0.2-np16py27_0': 1,
         'channel-1::astropy-0.2-np17py26_0': 1,
-        'channel-1::astropy-0.2-np17py27_0': 1,
         'channel-1::astropy-0.2-np17py33_0': 1,
         'channel-1::biopython-1.60-np15py26_0': 1,
-        'channel-1::biopython-1.60-np15py27_0': 1,
         'channel-1::biopython-1.60-np16py26_0': 1,
-        'channel-1::biopython-1.60-np16py27_0': 1,
         'channel-1::biopython-1.60-np17py26_0': 1,
-        'channel-1::biopython-1.60-np17py27_0': 1,
         'channel-1::bitarray-0.8.0-py26_0': 1,
-        'channel-1::bitarray-0.8.0-py27_0': 1,
         'channel-1::bitarray-0.8.0-py33_0': 1,
         'channel-1::boto-2.8.0-py26_0': 1,
-        'channel-1::boto-2.8.0-py27_0': 1,
-        'channel-1::conda-1.4.4-py27_0': 1,
         'channel-1::cython-0.18-py26_0': 1,
-        'channel-1::cython-0.18-py27_0': 1,
         'channel-1::cython-0.18-py33_0': 1,
         'channel-1::distribute-0.6.34-py26_1': 1,
-        'channel-1::distribute-0.6.34-py27_1': 1,
         'channel-1::distribute-0.6.34-py33_1': 1,
         'channel-1::ipython-0.13.1-py26_1': 1,
-        'channel-1::ipython-0.13.1-py27_1': 1,
         'channel-1::ipython-0.13.1-py33_1': 1,
         'channel-1::llvmpy-0.11.1-py26_0': 1,
-        'channel-1::llvmpy-0.11.1-py27_0': 1,
         'channel-1::llvmpy-0.11.1-py33_0': 1,
         'channel-1::lxml-3.0.2-py26_0': 1,
-        'channel-1::lxml-3.0.2-py27_0': 1,
         'channel-1::lxml-3.0.2-py33_0': 1,
         'channel-1::matplotlib-1.2.0-np15py26_1': 1,
-        'channel-1::matplotlib-1.2.0-np15py27_1': 1,
         'channel-1::matplotlib-1.2.0-np16py26_1': 1,
-        'channel-1::matplotlib-1.2.0-np16py27_1': 1,
         'channel-1::matplotlib-1.2.0-np17py26_1': 1,
-        'channel-1::matplotlib-1.2.0-np17py27_1': 1,
         'channel-1::matplotlib-1.2.0-np17py33_1': 1,
         'channel-1::nose-1.2.1-py26_0': 1,
-        'channel-1::nose-1.2.1-py27_0': 1,
         'channel-1::nose-1.2.1-py33_0': 1,
         'channel-1::numba-0.7.0-np16py26_1': 1,
-        'channel-1::numba-0.7.0-np16py27_1': 1,
         'channel-1::numba-0.7.0-np17py26_1': 1,
-        'channel-1::numba-0.7.0-np17py27_1': 1,
         'channel-1::numpy-1.5.1-py26_3': 3,
-        'channel-1::numpy-1.5.1-py27_3': 3,
         'channel-1::numpy-1.6.2-py26_3': 2,
         'channel-1::numpy-1.6.2-py26_4': 2,
-        'channel-1::numpy-1.6.2-py27_3': 2,
         'channel-1::numpy-1.6.2-py27_4': 2,
         'channel-1::numpy-1.7.0-py26_0': 1,
-        'channel-1::numpy-1.7.0-py27_0': 1,
         'channel-1::numpy-1.7.0-py33_0': 1,
         'channel-1::pandas-0.10.1-np16py26_0': 1,
-        'channel-1::pandas-0.10.1-np16py27_0': 1,
         'channel-1::pandas-0.10.1-np17py26_0': 1,
-        'channel-1::pandas-0.10.1-np17py27_0': 1,
         'channel-1::pandas-0.10.1-np17py33_0': 1,
         'channel-1::pip-1.2.1-py26_1': 1,
-        'channel-1::pip-1.2.1-py27_1': 1,
         'channel-1::pip-1.2.1-py33_1': 1,
         'channel-1::psutil-0.6.1-py26_0': 1,
-        'channel-1::psutil-0.6.1-py27_0': 1,
         'channel-1::psutil-0.6.1-py33_0': 1,
         'channel-1::pyflakes-0.6.1-py26_0': 1,
-        'channel-1::pyflakes-0.6.1-py27_0': 1,
         'channel-1::pyflakes-0.6.1-py33_0': 1,
-        'channel-1::python-2.6.8-6': 4,
-        'channel-1::python-2.7.3-7': 3,
+        'channel-1::python-2.6.8-6': 3,
         'channel-1::python-2.7.4-0': 2,
         'channel-1::python-3.3.0-4': 1,
         'channel-1::pytz-2012j-py26_0': 1,
-        'channel-1::pytz-2012j-py27_0': 1,
         'channel-1::pytz-2012j-py33_0': 1,
         'channel-1::requests-0.13.9-py26_0': 1,
-        'channel-1::requests-0.13.9-py27_0': 1,
         'channel-1::requests-0.13.9-py33_0': 1,
         'channel-1::scikit-learn-0.13-np15py26_1': 1,
-        'channel-1::scikit-learn-0.13-np15py27_1': 1,
         'channel-1::scikit-learn-0.13-np16py26_1': 1,
-        'channel-1::scikit-learn-0.13-np16py27_1': 1,
         'channel-1::scikit-learn-0.13-np17py26_1': 1,
-        'channel-1::scikit-learn-0.13-np17py27_1': 1,
         'channel-1::scipy-0.11.0-np15py26_3': 1,
-        'channel-1::scipy-0.11.0-np15py27_3': 1,
         'channel-1::scipy-0.11.0-np16py26_3': 1,
-        'channel-1::scipy-0.11.0-np16py27_3': 1,
         'channel-1::scipy-0.11.0-np17py26_3': 1,
-        'channel-1::scipy-0.11.0-np17py27_3': 1,
         'channel-1::scipy-0.11.0-np17py33_3': 1,
         'channel-1::six-1.2.0-py26_0': 1,
-        'channel-1::six-1.2.0-py27_0': 1,
         'channel-1::six-1.2.0-py33_0': 1,
-        'channel-1::spyder-2.1.13-py27_0': 1,
         'channel-1::sqlalchemy-0.7.8-py26_0': 1,
-        'channel-1::sqlalchemy-0.7.8-py27_0': 1,
         'channel-1::sqlalchemy-0.7.8-py33_0': 1,
         'channel-1::sympy-0.7.1-py26_0': 1,
-        'channel-1::sympy-0.7.1-py27_0': 1,
         'channel-1::tornado-2.4.1-py26_0': 1,
-        'channel-1::tornado-2.4.1-py27_0': 1,
         'channel-1::tornado-2.4.1-py33_0': 1,
         'channel-1::xlrd-0.9.0-py26_0': 1,
-        'channel-1::xlrd-0.9.0-py27_0': 1,
         'channel-1::xlrd-0.9.0-py33_0': 1,
         'channel-1::xlwt-0.7.4-py26_0': 1,
-        'channel-1::xlwt-0.7.4-py27_0': 1,
     }
     assert eqb == {
-        'channel-1::cubes-0.10.2-py27_0': 1,
         'channel-1::dateutil-2.1-py26_0': 1,
-        'channel-1::dateutil-2.1-py27_0': 1,
         'channel-1::dateutil-2.1-py33_0': 1,
         'channel-1::gevent-websocket-0.3.6-py26_1': 1,
-        'channel-1::gevent-websocket-0.3.6-py27_1': 1,
         'channel-1::gevent_zeromq-0.2.5-py26_1': 1,
-        'channel-1::gevent_zeromq-0.2.5-py27_1': 1,
         'channel-1::numexpr-2.0.1-np16py26_2': 1,
-        'channel-1::numexpr-2.0.1-np16py27_2': 1,
         'channel-1::numexpr-2.0.1-np17py26_2': 1,
-        'channel-1::numexpr-2.0.1-np17py27_2': 1,
         'channel-1::numpy-1.6.2-py26_3': 1,
-        'channel-1::numpy-1.6.2-py27_3': 1,
         'channel-1::pycurl-7.19.0-py26_0': 1,
-        'channel-1::pycurl-7.19.0-py27_0': 1,
-        'channel-1::pysal-1.5.0-np15py27_0': 1,
-        'channel-1::pysal-1.5.0-np16py27_0': 1,
-        'channel-1::pysal-1.5.0-np17py27_0': 1,
         'channel-1::pytest-2.3.4-py26_0': 1,
-        'channel-1::pytest-2.3.4-py27_0': 1,
         'channel-1::pyzmq-2.2.0.1-py26_0': 1,
-        'channel-1::pyzmq-2.2.0.1-py27_0': 1,
         'channel-1::pyzmq-2.2.0.1-py33_0': 1,
         'channel-1::scikit-image-0.8.2-np16py26_0': 1,
-        'channel-1::scikit-image-0.8.2-np16py27_0': 1,
         'channel-1::scikit-image-0.8.2-np17py26_0': 1,
-        'channel-1::scikit-image-0.8.2-np17py27_0': 1,
         'channel-1::scikit-image-0.8.2-np17py33_0': 1,
         'channel-1::sphinx-1.1.3-py26_2': 1,
-        'channel-1::sphinx-1.1.3-py27_2': 1,
         'channel-1::sphinx-1.1.3-py33_2': 1,
         'channel-1::statsmodels-0.4.3-np16py26_0': 1,
-        'channel-1::statsmodels-0.4.3-np16py27_0': 1,
         'channel-1::statsmodels-0.4.3-np17py26_0': 1,
-        'channel-1::statsmodels-0.4.3-np17py27_0': 1,
         'channel-1::system-5.8-0': 1,
         'channel-1::theano-0.5.0-np15py26_0': 1,
-        'channel-1::theano-0.5.0-np15py27_0': 1,
         'channel-1::theano-0.5.0-np16py26_0': 1,
-        'channel-1::theano-0.5.0-np16py27_0': 1,
         'channel-1::theano-0.5.0-np17py26_0': 1,
-        'channel-1::theano-0.5.0-np17py27_0': 1,
         'channel-1::zeromq-2.2.0-0': 1,
     }
 
@@ -375,6 +359,42 @@ def test_unsat():
     assert raises(UnsatisfiableError, lambda: r.install(['numpy 1.5*', 'numpy 1.6*']))
 
 
+def test_minimal_unsatisfiable_specs_narrows_to_core():
+    import pycosat
+    specs = [MatchSpec(s) for s in ('nose', 'numpy 1.5*', 'python 2.7*', 'numpy 1.6*')]
+    r2 = Resolve(r.get_reduced_index(specs))
+
+    # pycosat can't solve under assumptions, so no core is looked for
+    C = r2.gen_clauses()
+    assert not C.supports_unsat_core
+    with patch.object(C, 'unsat_core') as unsat_core:
+        assert set(r2.minimal_unsatisfiable_specs(C, specs)) == {specs[1], specs[3]}
+    assert not unsat_core.called
+
+    # a solver that can: drop every assumption that isn't needed for unsatisfiability
+    def core(m, assumptions, **kwargs):
+        clauses = C._sat_solver.as_list()
+
+        def sat(assumed):
+            return pycosat.solve(clauses + [[lit] for lit in assumed], vars=m) != 'UNSAT'
+
+        if sat(assumptions):
+            return None
+        needed = list(assumptions)
+        for lit in assumptions:
+            if not sat([k for k in needed if k != lit]):
+                needed.remove(lit)
+        return needed
+
+    C = r2.gen_clauses()
+    with patch.object(C._sat_solver, 'supports_assumptions', True), \
+            patch.object(C._sat_solver, 'core', core), \
+            patch('conda.resolve.minimal_unsatisfiable_subset',
+                  side_effect=lambda specs, sat: list(specs)) as subset:
+        assert set(r2.minimal_unsatisfiable_specs(C, specs)) == {specs[1], specs[3]}
+    assert set(subset.call_args[0][0]) == {specs[1], specs[3]}
+
+
 def test_nonexistent():
     assert not r.find_matches(MatchSpec('notarealpackage 2.0*'))
     assert raises(ResolvePackageNotFound, lambda: r.install(['notarealpackage 2.0*']))
@@ -782,6 +802,94 @@ def test_circular_dependencies():
     ]
 
 
+def test_alternate_solutions():
+    index2 = {}
+    for build in ('a_0', 'b_0'):
+        prec = PackageRecord(**{
+            "channel": "defaults",
+            "subdir": context.subdir,
+            "md5": "0123456789",
+            "fn": "doesnt-matter-here",
+            'build': build,
+            'build_number': 0,
+            'depends': [],
+            'name': 'twin',
+            'version': '1.0',
+        })
+        index2[prec] = prec
+    r = Resolve(index2)
+
+    solutions = r.solve_alternatives(['twin'])
+    assert sorted(sol[0].build for sol in solutions) == ['a_0', 'b_0']
+    assert solutions[0] == r.solve(['twin'])
+    assert len(r.solve_alternatives(['twin'], limit=1)) == 1
+    assert raises(RuntimeError, lambda: r.solve(['twin'], returnall=True))
+
+    with env_var('CONDA_REPORT_ALTERNATE_SOLUTIONS', 'true',
+                 stack_callback=conda_tests_ctxt_mgmt_def_pol):
+        with patch('conda.resolve.stdoutlog') as stdoutlog:
+            r.solve(['twin'])
+        assert 'possible package resolutions' in stdoutlog.info.call_args[0][0]
+
+    with env_var('CONDA_JSON', 'true', stack_callback=conda_tests_ctxt_mgmt_def_pol):
+        assert not context.report_alternate_solutions
+        with patch('conda.resolve.stdoutlog') as stdoutlog:
+            assert r.solve(['twin']) == solutions[0]
+        assert not stdoutlog.info.called
+
+
+def test_collapse_equivalent_builds():
+    index2 = {}
+    for channel, build, subdir in (('channel-1', 'h1234_0', context.subdir),
+                                   ('channel-2', 'h1234_0', context.subdir),
+                                   ('channel-1', 'h5678_0', context.subdir),
+                                   ('channel-1', 'pyh1234_0', 'noarch')):
+        prec = PackageRecord(**{
+            "channel": channel,
+            "subdir": subdir,
+            "md5": "0123456789",
+            "fn": "doesnt-matter-here",
+            'build': build,
+            'build_number': 0,
+            'depends': [],
+            'name': 'twin',
+            'version': '1.0',
+        })
+        index2[prec] = prec
+    r = Resolve(index2, channels=(Channel('channel-1'), Channel('channel-2')))
+    specs = (MatchSpec('twin'),)
+
+    reduced_index = r.get_reduced_index(specs)
+    assert len(reduced_index) == 4
+    collapsed_index, collapsed = r._collapse_equivalent_builds(reduced_index, specs)
+    # the noarch build is never collapsed with the others
+    assert len(collapsed_index) == 2
+    assert sorted(prec.subdir for prec in collapsed_index) == sorted([context.subdir, 'noarch'])
+    best = next(prec for prec in collapsed_index if prec.subdir == context.subdir)
+    assert best.channel.name == 'channel-1'
+    # only the other build from the same channel ties with it on every objective
+    assert sorted(collapsed[best.dist_str()]) == [
+        'channel-1::twin-1.0-h1234_0', 'channel-1::twin-1.0-h5678_0',
+    ]
+
+    # the collapsed builds are still reported as alternate solutions
+    solutions = r.solve_alternatives(['twin'])
+    assert sorted(sol[0].dist_str() for sol in solutions) == [
+        'channel-1::twin-1.0-h1234_0', 'channel-1::twin-1.0-h5678_0',
+        'channel-1::twin-1.0-pyh1234_0',
+    ]
+    assert solutions[0] == r.solve(['twin'])
+    assert len(r.solve_alternatives(['twin'], limit=1)) == 1
+    assert raises(RuntimeError, lambda: r.solve(['twin'], returnall=True))
+
+    # a spec that tells the builds apart keeps them all
+    specs = (MatchSpec('twin'), MatchSpec('twin[build=h5678_0]', optional=True))
+    assert len(r._collapse_equivalent_builds(reduced_index, specs)[0]) == 4
+    # so does an installed build
+    specs = (MatchSpec('twin', target='channel-2::twin-1.0-h1234_0'),)
+    assert len(r._collapse_equivalent_builds(reduced_index, specs)[0]) == 4
+
+
 def test_optional_dependencies():
     index2 = index.copy()
     p1 = PackageRecord(**{